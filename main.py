@@ -31,7 +31,7 @@ except ImportError:
 # from kivy.graphics import Color, Rectangle
 # from kivy.graphics import Line
 from kivymd.app import MDApp
-# from kivy.core.window import Window
+from kivy.core.window import Window
 # from kivy.animation import Animation
 # from kivy.factory import Factory
 from kivymd.uix.button import MDFloatingActionButton
@@ -102,6 +102,7 @@ class RotoCanvasApp(MDApp):
         self.mainWidget.add_widget(self.saveButton)
         self.previous_button = None
         self.initialized = False
+        Window.bind(on_key_down=self.onKeyDown)
         Clock.schedule_once(self.add_relative_widgets, 1)
         return self.mainWidget
 
@@ -127,6 +128,20 @@ class RotoCanvasApp(MDApp):
         )
         self.pack_button(self.paletteButton)
 
+        self.undoButton = MDFloatingActionButton(
+            text="Undo",
+            icon='undo',
+            on_press=lambda instance: self.pixelWidget.undo(),
+        )
+        self.pack_button(self.undoButton)
+
+        self.redoButton = MDFloatingActionButton(
+            text="Redo",
+            icon='redo',
+            on_press=lambda instance: self.pixelWidget.redo(),
+        )
+        self.pack_button(self.redoButton)
+
         '''
         # self.colorButton = MDFloatingActionButton(text="Color",
                                           # id="colorButton")
@@ -189,6 +204,18 @@ class RotoCanvasApp(MDApp):
             self.mainWidget.add_widget(button)
         self.previous_button = button
 
+    def onKeyDown(self, window, key, scancode, codepoint, modifiers):
+        """Handle Ctrl+Z (undo), Ctrl+Shift+Z and Ctrl+Y (redo)."""
+        if ('ctrl' not in modifiers) and ('meta' not in modifiers):
+            return False
+        if codepoint == 'z':
+            if 'shift' in modifiers:
+                return self.pixelWidget.redo()
+            return self.pixelWidget.undo()
+        if codepoint == 'y':
+            return self.pixelWidget.redo()
+        return False
+
     def choseColor(self, color):
         if color is not None:
             self.pixelWidget.viewImage.setBrushColor(color)
@@ -0,0 +1,227 @@
+"""Show overlay layers on top of a video frame.
+
+The composite of the current frame is cached, so showing it again is
+free, and editing a layer only redraws the changed region (see
+Compositor.invalidate). Each layer only costs time where it has tiles
+(see PPTiledImage), so sparse overlays stay fast while scrubbing.
+"""
+from PIL import (
+    Image,
+    ImageChops,
+)
+
+from rotocanvas.pythonpixels import (
+    PPRect,
+    PPTiledImage,
+    clip_rect_to_size,
+)
+
+# blend mode -> function(base, layer) for the RGB of both (before alpha)
+BLEND_MODES = {
+    'normal': lambda base, layer: layer,
+    'add': ImageChops.add,
+    'multiply': ImageChops.multiply,
+    'screen': ImageChops.screen,
+    'lighten': ImageChops.lighter,
+    'darken': ImageChops.darker,
+    'difference': ImageChops.difference,
+}
+
+
+def pil_from_pp(image, rect):
+    """Copy part of a 4-byte-per-pixel PPImage to a PIL RGBA Image.
+
+    The image's channel offsets (bOffset etc.) are used, so a KPImage
+    with any channel order works.
+
+    Args:
+        image (PPImage): The source.
+        rect (PPRect): The part (must be inside of image).
+    """
+    if image.byteDepth != 4:
+        raise ValueError("Only 4-byte (RGBA) layers can be composited,"
+                         " not {}-byte".format(image.byteDepth))
+    line_size = rect.width * 4
+    start = rect.top * image.stride + rect.left * 4
+    if (rect.left == 0) and (rect.width == image.size[0]):
+        data = bytes(image.data[start:start+rect.height*image.stride])
+    else:
+        data = b"".join(
+            bytes(image.data[start+y*image.stride:
+                             start+y*image.stride+line_size])
+            for y in range(rect.height)
+        )
+    bands = Image.frombytes("RGBA", (rect.width, rect.height), data).split()
+    # ^ each band is a byte position, so reorder them by the offsets:
+    return Image.merge("RGBA", (bands[image.rOffset], bands[image.gOffset],
+                                bands[image.bOffset], bands[image.aOffset]))
+
+
+class CompositeLayer:
+    """A layer shown by Compositor.
+
+    Args:
+        image (Union[PPTiledImage,PPImage]): The pixels (4 bytes per
+            pixel, the same size as the frame).
+        opacity (Optional[float]): 0.0 to 1.0 (multiplies the alpha).
+        blend (Optional[str]): A key of BLEND_MODES.
+        visible (Optional[bool]): Whether to show the layer.
+        name (Optional[str]): The layer name (see OverlayStore).
+    """
+    def __init__(self, image, opacity=1.0, blend='normal', visible=True,
+                 name=None):
+        if blend not in BLEND_MODES:
+            raise ValueError("blend must be one of {} but is {}"
+                             .format(sorted(BLEND_MODES), repr(blend)))
+        self.image = image
+        self.opacity = float(opacity)
+        self.blend = blend
+        self.visible = visible
+        self.name = name
+
+    def parts_in(self, rect):
+        """Get (PPImage, part in it, rect of the part in self) to draw.
+
+        Tiles that were never painted are skipped.
+        """
+        image = self.image
+        if not isinstance(image, PPTiledImage):
+            part = clip_rect_to_size(rect.left, rect.top, rect.width,
+                                     rect.height, image.size)
+            return [] if part is None else [(image, part, part)]
+        parts = []
+        for tileX, tileY in image.get_tile_coords_in(rect):
+            tile = image.get_tile(tileX, tileY)
+            if tile is None:
+                continue
+            tile_rect = image.get_tile_rect(tileX, tileY)
+            part = clip_rect_to_size(
+                rect.left - tile_rect.left, rect.top - tile_rect.top,
+                rect.width, rect.height, (tile_rect.width, tile_rect.height),
+            )
+            if part is None:
+                continue
+            parts.append((tile, part, PPRect(part.left + tile_rect.left,
+                                             part.top + tile_rect.top,
+                                             part.width, part.height)))
+        return parts
+
+    def draw_onto(self, region, rect):
+        """Blend the layer onto region (an RGB Image of rect of the frame).
+        """
+        if (not self.visible) or (self.opacity <= 0):
+            return
+        blend = BLEND_MODES[self.blend]
+        for image, part, at in self.parts_in(rect):
+            rgba = pil_from_pp(image, part)
+            r, g, b, alpha = rgba.split()
+            if self.opacity < 1:
+                alpha = alpha.point(
+                    lambda value: int(value * self.opacity + .5))
+            if alpha.getbbox() is None:
+                continue  # fully transparent
+            box = (at.left - rect.left, at.top - rect.top,
+                   at.left - rect.left + at.width,
+                   at.top - rect.top + at.height)
+            base = region.crop(box)
+            top = blend(base, Image.merge("RGB", (r, g, b)))
+            region.paste(Image.composite(top, base, alpha), box)
+
+
+class Compositor:
+    """Blend a frame with overlay layers, caching the result.
+
+    Call set_frame when the frame changes (or is the same frame, which
+    keeps the cache), invalidate with the region of any layer edit, and
+    composite to get the image to show.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget the frame (such as when the video is closed)."""
+        self.key = None  # identifies the frame (see set_frame)
+        self.frame = None  # PIL RGB Image
+        self.layers = []  # CompositeLayer (bottom first)
+        self._composite = None
+        self._dirty = []  # PPRect regions to redraw
+        self.redrawn_pixels = 0  # (for measuring, since the last frame)
+
+    def set_frame(self, key, frame, layers):
+        """Set the frame and its layers, unless key is already set.
+
+        Args:
+            key (tuple): Identifies the frame (such as source and frame
+                number). If it is the same as before, nothing changes
+                (use invalidate after editing layers).
+            frame (PIL.Image.Image): The frame at full (layer) size.
+            layers (Union[list[CompositeLayer],Callable]): The layers,
+                or a function returning them (only called if key
+                changed).
+        """
+        if key == self.key:
+            return
+        if callable(layers):
+            layers = layers()
+        self.key = key
+        self.frame = frame.convert("RGB")
+        self.layers = list(layers)
+        self._composite = None
+        self._dirty = []
+        self.redrawn_pixels = 0
+
+    def replace_frame(self, frame):
+        """Show a better copy of the same frame, keeping the layers.
+
+        For example, use the full-resolution frame after a proxy frame
+        was shown.
+        """
+        if self.frame is None:
+            raise ValueError("There is no frame (see set_frame).")
+        frame = frame.convert("RGB")
+        if frame.size != self.frame.size:
+            raise ValueError("The frame is {} but the layers are {}"
+                             .format(frame.size, self.frame.size))
+        self.frame = frame
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        """Redraw a region on the next composite (None for all of it)."""
+        if rect is None:
+            self._composite = None
+            self._dirty = []
+        elif self._composite is not None:
+            self._dirty.append(rect)
+
+    def composite(self):
+        """Get the frame with the layers on top (cached until changed).
+
+        Returns:
+            PIL.Image.Image: An RGB image (don't modify it).
+        """
+        if self.frame is None:
+            raise ValueError("There is no frame (see set_frame).")
+        if not any(layer.visible for layer in self.layers):
+            return self.frame
+        if self._composite is None:
+            self._composite = self.frame.copy()
+            rects = [PPRect(0, 0, self.frame.size[0], self.frame.size[1])]
+        else:
+            rects = self._dirty
+        self._dirty = []
+        for rect in rects:
+            self._redraw(rect)
+        return self._composite
+
+    def _redraw(self, rect):
+        rect = clip_rect_to_size(rect.left, rect.top, rect.width,
+                                 rect.height, self.frame.size)
+        if rect is None:
+            return
+        box = (rect.left, rect.top, rect.left + rect.width,
+               rect.top + rect.height)
+        region = self.frame.crop(box)
+        for layer in self.layers:
+            layer.draw_onto(region, rect)
+        self._composite.paste(region, box)
+        self.redrawn_pixels += rect.width * rect.height
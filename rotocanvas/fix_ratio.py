@@ -2,12 +2,66 @@
 from __future__ import print_function
 import sys
 import argparse
+from functools import partial
+
+opencv_enabled = False
 try:
     import cv2
+    opencv_enabled = True
 except ImportError:
-    sys.stderr.write("You must install OpenCV for Python or run this"
-                     " using a venv with OpenCV.\n")
-    exit(1)
+    cv2 = None
+
+
+def ratio_size(width, height, ratioPart0, ratioPart1, preserveDim):
+    """Get the size that enforces a ratio, keeping one dimension.
+
+    Args:
+        width (int): The current width.
+        height (int): The current height.
+        ratioPart0 (Union[int,float]): Numerator (for width)
+        ratioPart1 (Union[int,float]): Denominator (for height)
+        preserveDim (int): Set this to 0 if you want to keep the
+            width the same when enforcing the ratio. To keep the height
+            the same, set it to 1.
+
+    Returns:
+        tuple[int]: The new width and height.
+
+    Raises:
+        ValueError: If dimension isn't x or y (0 or 1).
+    """
+    size = [float(width), float(height)]
+    if str(preserveDim) == "0":
+        size[1] = size[0] * (float(ratioPart1) / float(ratioPart0))
+    elif str(preserveDim) == "1":
+        size[0] = size[1] * (float(ratioPart0) / float(ratioPart1))
+    else:
+        raise ValueError("preserveDim must be 0 or 1 since there"
+                         " are only 2 dimensions in an image.")
+    return round(size[0]), round(size[1])
+
+
+def resize_array(img, ratioPart0, ratioPart1, preserveDim):
+    """Resize an OpenCV image (numpy array) to enforce a ratio.
+
+    See ratio_size for the arguments.
+
+    Returns:
+        numpy.ndarray: The resized image.
+    """
+    dim = ratio_size(img.shape[1], img.shape[0],  # row,col order
+                     ratioPart0, ratioPart1, preserveDim)
+    return cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+
+
+def ratio_stage(ratioPart0, ratioPart1, preserveDim):
+    """Get a pipeline stage (see rcupscale.upscale_file) for a ratio.
+
+    The stage can be sent to worker processes (it is picklable).
+    """
+    ratio_size(1, 1, ratioPart0, ratioPart1, preserveDim)  # validate
+    return partial(resize_array, ratioPart0=ratioPart0,
+                   ratioPart1=ratioPart1, preserveDim=preserveDim)
 
 
 def resize(inPath, outPath, ratioPart0, ratioPart1, preserveDim):
@@ -30,18 +84,7 @@ def resize(inPath, outPath, ratioPart0, ratioPart1, preserveDim):
     # img = cv2.imread(originalPath, cv2.IMREAD_UNCHANGED)
     # print('Original Dimensions: ', img.shape)
     img = cv2.imread(inPath, cv2.IMREAD_UNCHANGED)
-    size = [float(img.shape[1]), float(img.shape[0])]  # row,col order
-    if str(preserveDim) == "0":
-        size[1] = size[0] * (float(ratioPart1) / float(ratioPart0))
-    elif str(preserveDim) == "1":
-        size[0] = size[1] * (float(ratioPart0) / float(ratioPart1))
-    else:
-        raise ValueError("preserveDim must be 0 or 1 since there"
-                         " are only 2 dimensions in an image.")
-    width = round(size[0])
-    height = round(size[1])
-    dim = (width, height)
-    resized = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+    resized = resize_array(img, ratioPart0, ratioPart1, preserveDim)
     # "Pi Zero doesn’t like the inter flag set to cv2.INTER_AREA. If
     # you change it to cv2.INTER_LINEAR it should work."
     # -Adrian Rosebrock
@@ -55,6 +98,10 @@ def resize(inPath, outPath, ratioPart0, ratioPart1, preserveDim):
 
 
 def main():
+    if not opencv_enabled:
+        sys.stderr.write("You must install OpenCV for Python or run this"
+                         " using a venv with OpenCV.\n")
+        return 1
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--input", required=True,
                     help="path to image")
@@ -69,7 +116,8 @@ def main():
     args = vars(ap.parse_args())
     resize(args["input"], args["output"], args["ratio0"],
            args["ratio1"], args["preserve_dimension"])
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""A memory-bounded cache of decoded video frames.
+
+Frames are stored as packed RGB buffers (3 bytes per pixel) keyed by
+(source, frame number), so the display and the paint/overlay compositor
+can share one cache (see get_shared_frame_cache) instead of each
+decoding the same frames.
+"""
+import threading
+
+from collections import OrderedDict
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_WINDOW = 8
+
+
+class CachedFrame:
+    """A decoded frame as packed (top-down) RGB bytes.
+
+    Args:
+        data (bytes): width * height * 3 bytes.
+        size (tuple[int]): width and height.
+    """
+    __slots__ = ('data', 'size')
+    mode = "RGB"
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = (int(size[0]), int(size[1]))
+        if len(data) != self.size[0] * self.size[1] * 3:
+            raise ValueError("{} bytes is not RGB for size {}"
+                             .format(len(data), self.size))
+
+    @classmethod
+    def from_av_frame(cls, frame):
+        """Convert an av.VideoFrame (for example, from rc_av.FrameReader).
+        """
+        rgb = frame.reformat(format='rgb24')
+        plane = rgb.planes[0]
+        line_size = rgb.width * 3
+        if plane.line_size == line_size:
+            data = bytes(plane)
+        else:  # remove the padding at the end of each line
+            view = memoryview(plane)
+            data = b"".join(
+                view[y*plane.line_size:y*plane.line_size+line_size]
+                for y in range(rgb.height)
+            )
+        return cls(data, (rgb.width, rgb.height))
+
+    def to_image(self):
+        """Get a PIL Image (sharing no memory with the cache)."""
+        from PIL import Image
+        return Image.frombytes(self.mode, self.size, self.data)
+
+    @property
+    def byte_count(self):
+        return len(self.data)
+
+
+class FrameCache:
+    """An LRU cache of CachedFrame with a byte budget.
+
+    Frames within window of the playhead (see set_playhead) are
+    protected: they are only evicted if nothing else can be. All methods
+    are thread-safe so a prefetch thread can fill the cache.
+
+    Args:
+        max_bytes (Optional[int]): The budget for frame data.
+        window (Optional[int]): Frames on each side of the playhead to
+            protect from eviction.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, window=DEFAULT_WINDOW):
+        self.max_bytes = max_bytes
+        self.window = window
+        self._frames = OrderedDict()  # (source, index) -> CachedFrame
+        self._lock = threading.RLock()
+        self.byte_count = 0
+        self.playhead = None  # (source, index)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    @property
+    def hit_rate(self):
+        """Get the ratio of get calls that were hits (0.0 if none)."""
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return self.hits / total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'frames': len(self._frames),
+                'bytes': self.byte_count,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hit_rate,
+            }
+
+    def set_playhead(self, source, index):
+        """Set the frame being shown (the center of the protected window).
+        """
+        with self._lock:
+            self.playhead = (source, index)
+
+    def is_protected(self, key):
+        if self.playhead is None:
+            return False
+        source, index = key
+        return ((source == self.playhead[0])
+                and (abs(index - self.playhead[1]) <= self.window))
+
+    def get(self, source, index):
+        """Get a CachedFrame, or None (and count a miss) if not cached."""
+        key = (source, index)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, source, index, frame):
+        """Add or replace a frame, then evict to stay within max_bytes.
+
+        Args:
+            frame (CachedFrame): The frame (see CachedFrame.from_av_frame).
+        """
+        if frame.byte_count > self.max_bytes:
+            logger.warning("[FrameCache] A {}-byte frame can't fit in {}."
+                           .format(frame.byte_count, self.max_bytes))
+            return
+        key = (source, index)
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.byte_count -= old.byte_count
+            self._frames[key] = frame
+            self.byte_count += frame.byte_count
+            self._evict()
+
+    def get_or_decode(self, source, index, decode):
+        """Get a frame, decoding and caching it on a miss.
+
+        Args:
+            decode (Callable): Called with index on a miss. It must
+                return a CachedFrame.
+        """
+        frame = self.get(source, index)
+        if frame is None:
+            frame = decode(index)
+            self.put(source, index, frame)
+        return frame
+
+    def _evict(self):
+        if self.byte_count <= self.max_bytes:
+            return
+        # Evict least recently used first, but skip the playhead window:
+        for key in [key for key in self._frames
+                    if not self.is_protected(key)]:
+            self._remove(key)
+            if self.byte_count <= self.max_bytes:
+                return
+        for key in list(self._frames):
+            if len(self._frames) <= 1:
+                break  # keep the frame that was just added
+            self._remove(key)
+            if self.byte_count <= self.max_bytes:
+                return
+
+    def _remove(self, key):
+        frame = self._frames.pop(key)
+        self.byte_count -= frame.byte_count
+        self.evictions += 1
+
+    def clear(self, source=None):
+        """Remove all frames, or only those of one source."""
+        with self._lock:
+            if source is None:
+                self._frames.clear()
+                self.byte_count = 0
+                return
+            for key in [key for key in self._frames if key[0] == source]:
+                self.byte_count -= self._frames.pop(key).byte_count
+
+
+_shared_frame_cache = None
+
+
+def get_shared_frame_cache():
+    """Get the FrameCache shared by the display and the compositor."""
+    global _shared_frame_cache
+    if _shared_frame_cache is None:
+        _shared_frame_cache = FrameCache()
+    return _shared_frame_cache
@@ -1,5 +1,7 @@
 from __future__ import print_function
 import os
+import threading
+from collections import OrderedDict
 # import io
 # import time
 
@@ -25,6 +27,12 @@ try:
     pygame_enable = True
 except ImportError:
     pass
+ENABLE_PIL = False
+try:
+    from PIL import Image as PILImage
+    ENABLE_PIL = True
+except ImportError:
+    pass
 # except Exception as e:
 # #   print("Could not finish importing pygame:"+str(e))
 # from kivy.uix.image import Image
@@ -45,6 +53,100 @@ from rotocanvas import (
 from rotocanvas.common import view_traceback
 from rotocanvas.pythonpixels import PPImage, PPColor, vec4_from_vec3
 from rotocanvas.pythonpixels import bufferToTupleStyleString
+from rotocanvas.pythonpixels import brush_blend_with_bo
+from rotocanvas.pythonpixels import tint_with_bo
+
+# Tinted copies of brushes, most recently used last, so scrolling
+# through a palette doesn't re-tint the brush each time. Each key is
+# (brush path, color, size) and each value is the tinted data.
+TINTED_BRUSH_CACHE_SIZE = 64
+_tinted_brushes = OrderedDict()
+
+
+# The position of (r, g, b, a) in each pixel of Kivy ImageData (the
+# same order read_pixel uses to return each color as rgba):
+KIVY_FMT_CHANNELS = {
+    'rgba': (0, 1, 2, 3),
+    'bgra': (2, 1, 0, 3),
+    'argb': (1, 2, 3, 0),
+    'abgr': (3, 2, 1, 0),
+    'rgb': (0, 1, 2, None),
+    'bgr': (2, 1, 0, None),
+}
+
+
+def decode_image_file(fileName):
+    """Decode an image file to a raw buffer in one call using Pillow.
+
+    Returns:
+        tuple: (data, size, stride, byteDepth, channels) where channels
+            is the position of (r, g, b, a) in each pixel, or None if
+            Pillow is not available.
+    """
+    if not ENABLE_PIL:
+        return None
+    with PILImage.open(fileName) as im:
+        if im.mode != "RGBA":
+            im = im.convert("RGBA")
+        data = im.tobytes()
+        size = im.size
+    return data, size, size[0] * 4, 4, (0, 1, 2, 3)
+
+
+def decode_kivy_image(thisKivyImage):
+    """Get the raw buffer that Kivy already decoded.
+
+    Args:
+        thisKivyImage (kivy.core.image.Image): An image loaded with
+            keep_data=True.
+
+    Returns:
+        tuple: See decode_image_file, or None if the image data isn't
+            kept or is in a format that can't be copied directly (such
+            as a compressed texture format).
+    """
+    try:
+        image_data = thisKivyImage.image._data[0]
+    except (AttributeError, IndexError, TypeError):
+        return None
+    channels = KIVY_FMT_CHANNELS.get(image_data.fmt)
+    if (image_data.data is None) or (channels is None):
+        return None
+    byteDepth = 4 if channels[3] is not None else 3
+    stride = image_data.width * byteDepth
+    rowlength = getattr(image_data, 'rowlength', 0)
+    if rowlength:
+        stride = rowlength * byteDepth
+    return (image_data.data, (image_data.width, image_data.height),
+            stride, byteDepth, channels)
+
+
+PIL_MODES = {
+    4: "RGBA",
+    3: "RGB",
+    2: "I;16",
+    1: "L",
+}
+
+
+def pil_image_from_buffer(data, size, stride, byteDepth, flip_v=False):
+    """Wrap a raw buffer in a Pillow image, flipping it by line order.
+
+    The buffer is used as-is (r, g, b, a order like the Kivy texture
+    path), and for modes Pillow can map (such as RGBA and L) the image
+    shares memory with data (flip_v only sets a negative line step), so
+    encoding reads straight from data without an intermediate copy.
+
+    Returns:
+        PIL.Image.Image: The image, or None if byteDepth has no
+            matching mode.
+    """
+    mode = PIL_MODES.get(byteDepth)
+    if mode is None:
+        return None
+    ystep = -1 if flip_v else 1
+    return PILImage.frombuffer(mode, tuple(size), data, "raw", mode,
+                               stride, ystep)
 
 
 def get_ext_lower(path):
@@ -94,6 +196,12 @@ def load_image(self, fileName):
                 # participle = ("loading Kivy 1.9 image from unparsed"
                 # " file bytes")
                 this_ext = get_ext_lower(fileName)
+                participle = "decoding " + this_ext + " using Pillow"
+                decoded = decode_image_file(fileName)
+                if decoded is not None:
+                    result = KPImage(decoded[1])
+                    result.blitDecoded(decoded)
+                    return result
                 # participle = ("loading Kivy 1.9 " + this_ext
                 # + " format data from unparsed file bytes")
                 # im = CoreImage(compressed, ext=this_ext,
@@ -129,12 +237,27 @@ class KPImage(PPImage):
     def setBrushColor(self, color):
         # print("setting brush color to " + str(color))
         self._brush_color = color
-        if self.brushImage is not None:
-            self.brushImage.blit_copy(self.brushOriginalImage)
-            self.brushImage.tintByColor(self._brush_color)
-        else:
+        if self.brushImage is None:
             raise ValueError("brushImage is None in setBrushColor"
                              " (you must call setBrushPath first)")
+        try:
+            key = (self.brushFileName, tuple(color),
+                   tuple(self.brushImage.size))
+        except TypeError:
+            key = None  # color is an object (not cacheable as a tuple)
+        tinted = None
+        if key is not None:
+            tinted = _tinted_brushes.get(key)
+        if tinted is not None:
+            _tinted_brushes.move_to_end(key)
+            self.brushImage.data[:] = tinted
+            return
+        self.brushImage.blit_copy(self.brushOriginalImage)
+        self.brushImage.tintByColor(self._brush_color)
+        if key is not None:
+            _tinted_brushes[key] = bytes(self.brushImage.data)
+            while len(_tinted_brushes) > TINTED_BRUSH_CACHE_SIZE:
+                _tinted_brushes.popitem(last=False)
 
     def copyRuntimeVarsByRefFrom(self, kpimage):
         self.brushFileName = kpimage.brushFileName
@@ -216,6 +339,13 @@ class KPImage(PPImage):
                     # participle = ("loading Kivy 1.9 image from"
                     # " unparsed file bytes")
                     this_ext = get_ext_lower(fileName)
+                    participle = ("decoding {} using Pillow"
+                                  "".format(this_ext))
+                    decoded = decode_image_file(fileName)
+                    if decoded is not None:
+                        self.init(decoded[1])
+                        self.blitDecoded(decoded)
+                        return
                     # participle = ("loading Kivy 1.9 " + this_ext
                     # + " format data from unparsed file bytes")
                     # im = CoreImage(compressed, ext=this_ext,
@@ -310,60 +440,80 @@ class KPImage(PPImage):
                 # (self.fbo.size[0], self.fbo.size[1]), 'RGBA', True)
                 # is not at fault for channel order issue, & has correct
                 # channel order
-                translatedImage.blit_copy_with_bo(self.data,
-                                                  self.stride,
-                                                  self.byteDepth,
-                                                  self.size,
-                                                  self.bOffset,
-                                                  self.gOffset,
-                                                  self.rOffset,
-                                                  self.aOffset)
-                data = bytes(translatedImage.data)
-                # ^ convert from bytearray to bytes
-                surface = pygame.image.fromstring(data, self.size,
-                                                  'RGBA', True)
+                try:
+                    translatedImage.blit_copy_with_bo(self.data,
+                                                      self.stride,
+                                                      self.byteDepth,
+                                                      self.size,
+                                                      self.bOffset,
+                                                      self.gOffset,
+                                                      self.rOffset,
+                                                      self.aOffset,
+                                                      flip_v=True)
+                    # ^ Reorder & flip in one pass (formerly a bytes
+                    #   copy then pygame.image.fromstring(..., True)).
+                except ValueError:
+                    # flip_v is only for color images of the same size,
+                    # so reorder then flip as a separate copy:
+                    translatedImage.blit_copy_with_bo(self.data,
+                                                      self.stride,
+                                                      self.byteDepth,
+                                                      self.size,
+                                                      self.bOffset,
+                                                      self.gOffset,
+                                                      self.rOffset,
+                                                      self.aOffset)
+                    translatedImage = translatedImage.copy_flipped_v()
+                surface = pygame.image.frombuffer(translatedImage.data,
+                                                  self.size, 'RGBA')
                 pygame.image.save(surface, fileName)
+            elif ENABLE_PIL:
+                # Encode directly from self.data (no copy, see
+                # pil_image_from_buffer).
+                im = pil_image_from_buffer(self.data, self.size,
+                                           self.stride, self.byteDepth,
+                                           flip_v=texture_flipped)
+                if im is None:
+                    print("NOT YET IMPLEMENTED: saving with this"
+                          " byteDepth ({})".format(self.byteDepth))
+                else:
+                    print("  saving...")
+                    im.save(fileName)
+                    print("  saved.")
             else:
                 # Kivy 1.9.0+:
                 # data = bytes(translatedImage.data)
                 # ^ convert from bytearray to bytes
                 # CoreImage can load io.BytesIO but must have
                 # file header
-                translatedImage = self
-                print("  tricking Kivy so flipped warning won't"
-                      " matter...")
-                if not texture_flipped:
-                    # kivy texture is upside-down, so negate that:
-                    print("  manually un-flipping")
-                    translatedImage = self.copy_flipped_v()
                 print("  saving...")
                 this_texture = None
                 if self.byteDepth == 4:
                     this_texture = Texture.create(size=self.size,
                                                   colorfmt='rgba',
                                                   bufferfmt='ubyte')
-                    this_texture.blit_buffer(translatedImage.data,
+                    this_texture.blit_buffer(self.data,
                                              colorfmt='rgba',
                                              bufferfmt='ubyte')
                 elif self.byteDepth == 3:
                     this_texture = Texture.create(size=self.size,
                                                   colorfmt='rgb',
                                                   bufferfmt='ubyte')
-                    this_texture.blit_buffer(translatedImage.data,
+                    this_texture.blit_buffer(self.data,
                                              colorfmt='rgb',
                                              bufferfmt='ubyte')
                 elif self.byteDepth == 1:
                     this_texture = Texture.create(size=self.size,
                                                   colorfmt='luminance',
                                                   bufferfmt='ubyte')
-                    this_texture.blit_buffer(translatedImage.data,
+                    this_texture.blit_buffer(self.data,
                                              colorfmt='luminance',
                                              bufferfmt='ubyte')
                 elif self.byteDepth == 2:
                     this_texture = Texture.create(size=self.size,
                                                   colorfmt='luminance',
                                                   bufferfmt='ushort')
-                    this_texture.blit_buffer(translatedImage.data,
+                    this_texture.blit_buffer(self.data,
                                              colorfmt='luminance',
                                              bufferfmt='ushort')
                 else:
@@ -373,7 +523,10 @@ class KPImage(PPImage):
                 # https://kivy.org/docs/api-kivy.graphics.texture.html
                 # im = CoreImage(bytes(translatedImage.data), ext="png")
                 if this_texture is not None:
-                    this_texture.save(fileName)
+                    # Texture.save flips by default (textures are stored
+                    # bottom up), so not flipping is the manual
+                    # un-flip (formerly done by copy_flipped_v).
+                    this_texture.save(fileName, flipped=texture_flipped)
                     print("  saved.")
                     # im = CoreImage(this_texture)
                     # im.save(fileName, flipped=False)
@@ -388,6 +541,64 @@ class KPImage(PPImage):
 
         return IsOK
 
+    def saveAsAsync(self, fileName, texture_flipped=True, callback=None):
+        '''Save on a background thread so the UI doesn't wait.
+
+        The pixels are snapshotted first (one copy, much faster than
+        encoding) so painting can continue during the save. Only the
+        Pillow path can run on another thread (pygame surfaces and
+        Kivy textures must be used on the main thread), so without
+        Pillow this saves synchronously.
+
+        Keyword arguments:
+        texture_flipped -- See saveAs.
+        callback -- If not None, called as callback(error) when done,
+            where error is None on success. It runs on the background
+            thread, so schedule any UI changes (such as using
+            kivy.clock.Clock.schedule_once).
+
+        Returns:
+        threading.Thread: The thread, or None if already saved
+            synchronously.
+        '''
+        if pygame_enable or not ENABLE_PIL:
+            error = None
+            try:
+                self.saveAs(fileName, texture_flipped=texture_flipped)
+            except Exception as ex:
+                error = ex
+            if callback is not None:
+                callback(error)
+            return None
+        snapshot = bytes(self.data)
+        size = self.size
+        stride = self.stride
+        byteDepth = self.byteDepth
+
+        def encode():
+            error = None
+            try:
+                im = pil_image_from_buffer(snapshot, size, stride,
+                                           byteDepth,
+                                           flip_v=texture_flipped)
+                if im is None:
+                    raise NotImplementedError(
+                        "saving with this byteDepth ({})"
+                        .format(byteDepth))
+                im.save(fileName)
+                print("Saved '" + fileName + "'")
+            except Exception as ex:
+                error = ex
+                print("Could not finish saving '{}': {}"
+                      .format(fileName, ex))
+            if callback is not None:
+                callback(error)
+
+        thread = threading.Thread(target=encode, name="KPImage save")
+        thread.daemon = True
+        thread.start()
+        return thread
+
     def save(self, texture_flipped=True):
         '''
         Args:
@@ -397,6 +608,12 @@ class KPImage(PPImage):
                            texture_flipped=texture_flipped)
 
     def brushAt(self, centerX, centerY):
+        """Draw the brush (brushImage) centered at the given location.
+
+        Returns:
+            PPRect: The affected rect, or None if the brush was entirely
+                outside of the image.
+        """
         # normalSize = self.brushImage.get_norm_image_size()
         # self.brushImage.size[0] = self.brushImage.size[0]
         #     # int(normalSize[0])
@@ -426,19 +643,6 @@ class KPImage(PPImage):
         destY = int(centerY) - int(self.brushImage.size[1] / 2)
         # destLineStartX = destX
 
-        # internal offsets:
-        iB = self.bOffset
-        iG = self.gOffset
-        iR = self.rOffset
-        iA = self.aOffset
-
-        # brushBuffer_byteDepth = 4
-        # brushBuffer_stride = int(self.brushImage.size[0])
-        #                      * brushBuffer_byteDepth
-        src = self.brushImage.data  # self.brushPixels
-        # d_bi:
-        di = destY * self.stride + destX * self.byteDepth
-        dstLSI = di  # destLineStartIndex
         if self.enableDebug:
             print()
             print("self.brushImage.size: {}"
@@ -448,93 +652,54 @@ class KPImage(PPImage):
             print("brushImage.stride: {}".format(self.brushImage.stride))
             print("self.stride: {}".format(self.stride))
             print("self.byteDepth: {}".format(self.byteDepth))
-            print("d_bi: {}".format(di))
+            print("dest: {}".format((destX, destY)))
 
-        srcLSI = 0
-        debugPixelWriteCount = 0
+        # The brush is clipped to self, then blended as a whole patch
+        # (see brush_blend_with_bo). The internal offsets of self are
+        # used for the brush too.
         try:
-            for sourceY in range(0, int(self.brushImage.size[1])):
-                # destX = destLineStartX
-                di = dstLSI
-                si = srcLSI  # s_bi
-                for sourceX in range(0, int(self.brushImage.size[0])):
-                    sab = src[si + iA]  # src_a_i
-                    # src_a:
-                    a = sab / 255.0
-                    # src_inv_a:
-                    ia = 1.0 - a
-                    dab = self.data[di + iA]
-                    da = dab / 255.0
-
-                    # si = (sourceY * brushBuffer_stride
-                    #       + sourceX * brushBuffer_byteDepth)
-                    if (sab != 0):
-                        # calculate resulting alpha:
-                        # a_total_i = dab
-                        # if sab > dab:
-                        #     a_total_i = sab
-                        a_total_i = int(dab) + sab
-                        if a_total_i > 255:
-                            a_total_i = 255
-
-                        # do alpha formula on colors
-
-                        # account for dest (color transparent more):
-                        # (from here down, 'a' affects color not alpha)
-                        dia = 1.0 - da
-                        # use alpha formula to overlay 1.0 onto brush's
-                        # alpha as dest alpha approaches 0.0 (dia 1.0)
-                        # to remove black fringe around brush stroke
-                        # ba = da*a  # both alpha
-                        # bia = 1.0 - ba
-                        # a = da*a + dia*1.0
-                        # a = dia*a + dia*da
-                        # a = ia*a + a*da
-                        ia = 1.0 - a
-
-                        # self.data[di+iB] = int(round(
-                        #     ia*float(self.data[di+iB]) +
-                        #     a*float(src[si+iB])))
-                        # self.data[di+iG] = int(round(
-                        #     ia*float(self.data[di+iG]) +
-                        #     a*float(src[si+iG])))
-                        # self.data[di+iR] = int(round(
-                        #     ia*float(self.data[di+iR]) +
-                        #     a*float(src[si+iR])))
-                        # self.data[di+aOffset] = a_total_i
-
-                        res = [int(ia * float(self.data[di + iB])
-                                   + a * float(src[si + iB]) + .5),
-                               int(ia * float(self.data[di + iG])
-                                   + a * float(src[si + iG]) + .5),
-                               int(ia * float(self.data[di + iR])
-                                   + a * float(src[si + iR]) + .5),
-                               a_total_i]
-                        # brushBGRABytes = bytes(res)
-                        self.data[di + iB] = res[0]
-                        self.data[di + iG] = res[1]
-                        self.data[di + iR] = res[2]
-                        self.data[di + iA] = res[3]
-
-                        debugPixelWriteCount += 1
-                    # destX += 1
-                    di += self.byteDepth
-                    si += self.brushImage.byteDepth
-                # destY += 1
-                dstLSI += self.stride
-                srcLSI += self.brushImage.stride
+            rect = brush_blend_with_bo(
+                self.data, self.stride, self.byteDepth, self.size,
+                self.brushImage.data, self.brushImage.stride,
+                self.brushImage.byteDepth, self.brushImage.size,
+                destX, destY,
+                self.bOffset, self.gOffset, self.rOffset, self.aOffset,
+            )
         except Exception as e:
             print("Could not finish brushAt: {}".format(e))
-            print("    d_bi: {}"
-                  "; s_bi: {}"
+            print("    dest: {}"
                   "; len(self.data): {}"
                   "; len(brushPixels): {}"
-                  .format(di, si, len(self.data), len(src)))
+                  .format((destX, destY), len(self.data),
+                          len(self.brushImage.data)))
             raise
         if self.enableDebug:
-            print("debugPixelWriteCount:" + str(debugPixelWriteCount))
+            if rect is not None:
+                print("brushAt rect: {}".format(
+                    (rect.left, rect.top, rect.width, rect.height)))
+            else:
+                print("brushAt rect: None (brush is outside of image)")
+        return rect
+
+    def blitDecoded(self, decoded):
+        """Copy a decoded buffer to self in one swizzle pass.
+
+        Args:
+            decoded (tuple): The result of decode_image_file or
+                decode_kivy_image (must be the same size as self).
+        """
+        data, size, stride, byteDepth, channels = decoded
+        # Like the pygame (Kivy 1.8) path, source r goes to bOffset etc:
+        self.blit_copy_with_bo(data, stride, byteDepth, size,
+                               channels[0], channels[1], channels[2],
+                               channels[3])
 
     def drawKivyImage(self, thisKivyImage):
+        decoded = decode_kivy_image(thisKivyImage)
+        if (decoded is not None) and (tuple(decoded[1]) == self.size):
+            self.blitDecoded(decoded)
+            return
+        # Otherwise read one pixel at a time:
         maxAlpha = 0
         sourcePixelCount = 0
 
@@ -612,101 +777,31 @@ class KPImage(PPImage):
         self.tintByColor((color.b, color.g, color.r, color.a))
 
     def tintByColor(self, colorVec4OrVec3):
+        """Multiply each channel by the color (see tint_with_bo).
+
+        Args:
+            colorVec4OrVec3 (Union[tuple[float],object]): 3 or 4 floats
+                (multipliers for bOffset, gOffset, rOffset, then
+                aOffset), or a color object with .b, .g, .r and .a.
+        """
         color = colorVec4OrVec3
-        # thisPPColor = PPColor()
-        # thisPPColor.setBytesFromRGBA(int(color.r*255.0+.5),
-        # int(color.g*255.0+.5),
-        # int(color.b*255.0+.5),
-        # int(color.a*255.0+.5) )
-        eB = 0
-        eG = 1
-        eR = 2
-        eA = 3
-        # Internal offsets:
-        iB = self.bOffset
-        iG = self.gOffset
-        iR = self.rOffset
-        iA = self.aOffset
         print("  tinting brush: " + str(color))
-        if len(color) < 4:
+        if hasattr(color, 'r'):
+            color = (color.b, color.g, color.r, color.a)
+        elif len(color) < 4:
             color = vec4_from_vec3(color, 1.0)
-        di = 0  # pixelByteIndex
+        if (self.aOffset is None) and (self.byteDepth != 3):
+            print("Not yet implemented KVImage tintByColor where"
+                  " self.byteDepth=" + str(self.byteDepth))
+            return
         try:
-            if (iA is not None):
-                for pixelIndex in range(0, self.size[0] * self.size[1]):
-                    self.data[di + iB] = int(round(
-                        float(self.data[di + iB])
-                        * color[eB]))
-                    self.data[di + iG] = int(round(
-                        float(self.data[di + iG])
-                        * color[eG]))
-                    self.data[di + iR] = int(round(
-                        float(self.data[di + iR])
-                        * color[eR]))
-                    self.data[di + iA] = int(round(
-                        float(self.data[di + iA])
-                        * color[eA]))
-                    di += self.byteDepth
-            elif self.byteDepth == 3:
-                for _px_i in range(0, self.size[0] * self.size[1]):
-                    self.data[di + iB] = int(round(
-                        float(self.data[di + iB])
-                        * color[eB]))
-                    self.data[di + iG] = int(round(
-                        float(self.data[di + iG])
-                        * color[eG]))
-                    self.data[di + iR] = int(round(
-                        float(self.data[di + iR])
-                        * color[eR]))
-                    di += self.byteDepth
-            else:
-                print("Not yet implemented KVImage tintByColor where"
-                      " self.byteDepth=" + str(self.byteDepth))
+            tint_with_bo(self.data, self.byteDepth, color,
+                         self.bOffset, self.gOffset, self.rOffset,
+                         self.aOffset)
         except:
-            print("Triggered alternate tintByColor algorithm:")
-            view_traceback()
-            try:
-                di = 0
-                totalCount = self.size[0] * self.size[1]
-                if (iA is not None):
-                    for pixelIndex in range(0, totalCount):
-                        self.data[di + iB] = int(round(
-                            float(self.data[di + iB]) * color.b
-                        ))
-                        self.data[di + iG] = int(round(
-                            float(self.data[di + iG]) * color.g
-                        ))
-                        self.data[di + iR] = int(round(
-                            float(self.data[di + iR]) * color.r
-                        ))
-                        self.data[di + iA] = int(round(
-                            float(self.data[di + iA]) * color.a
-                        ))
-                        di += self.byteDepth
-                elif self.byteDepth == 3:
-                    for pixelIndex in range(0, totalCount):
-                        self.data[di + iB] = int(
-                            float(self.data[di + iB])
-                            * color.b + .5
-                        )  # + .5 for rounding
-                        self.data[di + iG] = int(
-                            float(self.data[di + iG])
-                            * color.g + .5
-                        )  # + .5 for rounding
-                        self.data[di + iR] = int(
-                            float(self.data[di + iR])
-                            * color.r + .5
-                        )  # + .5 for rounding
-                        di += self.byteDepth
-                else:
-                    print("Not yet implemented KVImage tintByColor"
-                          " where self.byteDepth={}"
-                          .format(self.byteDepth))
-            except:
-                print("Could not finish KVImage tintByColor: color={}"
-                      "".format(color))
-                # view_traceback()
-                raise
+            print("Could not finish KVImage tintByColor: color={}"
+                  "".format(color))
+            raise
 
 
 if __name__ == "__main__":
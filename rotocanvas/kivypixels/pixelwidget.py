@@ -12,12 +12,17 @@ except ImportError:
     exit(1)
 
 from rotocanvas.kivypixels import KPImage  # , load_image
+from kivy.clock import Clock
 from kivy.uix.widget import Widget
 from kivy.graphics import Fbo, ClearColor, ClearBuffers
 # from kivy.graphics.fbo import Fbo
 from kivy.properties import ObjectProperty, NumericProperty
 from kivy.graphics import Canvas, Color, Rectangle
 from rotocanvas.pythonpixels import ibgr_from_hex  # , vec4_from_vec3
+from rotocanvas.undojournal import (
+    UndoJournal,
+    brush_rect,
+)
 
 __all__ = ('PixelWidget', )
 
@@ -92,6 +97,8 @@ class PixelWidget(Widget):
 
         self.viewImage.setBrushPath("brush2.png")
         self.viewImage.setBrushColor((1, 1, 1, 1))
+        self.undoJournal = UndoJournal(self.viewImage)
+        # ^ records the tiles each stroke changes (see undo and redo)
         # self.brushImage = Image(source=self.brushFileName,
         # keep_data=True)
         # self.brushImage = CoreImage(self.brushFileName)
@@ -186,6 +193,8 @@ class PixelWidget(Widget):
             self.viewImage.rOffset = self.viewImage_rOffset
             self.viewImage.aOffset = self.viewImage_aOffset
 
+            self.undoJournal.set_image(self.viewImage)
+
             print(prefix + "size: {}".format(self.viewImage.size))
             # print("TOTAL_BYTE_COUNT:" + str(self.TOTAL_BYTE_COUNT))
             # print("TOTAL_PIXEL_COUNT:" + str(self.TOTAL_PIXEL_COUNT))
@@ -262,16 +271,43 @@ class PixelWidget(Widget):
             # else:
                 # self.setBrushColor(self.paletteWidget.pickedColor)
             # self.brushAt(touch.x-self.pos[0], touch.y-self.pos[1])
-            self.viewImage.brushAt(touch.x - self.pos[0],
-                                   touch.y - self.pos[1])
+            self.undoJournal.begin()
+            self.brushAt(touch.x - self.pos[0], touch.y - self.pos[1])
             self.uploadBufferToTexture()
 
     def on_touch_move(self, touch):
         super(PixelWidget, self).on_touch_move(touch)
         # self.brushAt(touch.x-self.pos[0], touch.y-self.pos[1])
-        self.viewImage.brushAt(touch.x - self.pos[0],
-                               touch.y - self.pos[1])
+        self.brushAt(touch.x - self.pos[0], touch.y - self.pos[1])
+        self.uploadBufferToTexture()
+
+    def on_touch_up(self, touch):
+        super(PixelWidget, self).on_touch_up(touch)
+        self.undoJournal.end()
+
+    def brushAt(self, x, y):
+        """Draw the brush on viewImage, recording it for undo."""
+        self.undoJournal.capture(brush_rect(self.viewImage.brushImage,
+                                            x, y))
+        return self.viewImage.brushAt(x, y)
+
+    def undo(self):
+        """Undo the last stroke.
+
+        Returns:
+            bool: True if there was a stroke to undo.
+        """
+        if self.undoJournal.undo() is None:
+            return False
+        self.uploadBufferToTexture()
+        return True
+
+    def redo(self):
+        """Redo the last undone stroke (see undo)."""
+        if self.undoJournal.redo() is None:
+            return False
         self.uploadBufferToTexture()
+        return True
 
     def uploadBufferToTexture(self):
         # formerly used ImageData (decided to not use core.ImageData --
@@ -291,7 +327,9 @@ class PixelWidget(Widget):
         while os.path.isfile(saveFileName):
             index += 1
             saveFileName = "Untitled{}.png".format(index)
-        self.viewImage.saveAs(saveFileName)
+        self.viewImage.saveAsAsync(saveFileName,
+                                   callback=self._onSaveFinished)
+        # ^ Encoding happens on another thread so painting can continue.
         if self.enableDebug:
             if self.brushImage is not None:
                 self.brushImage.saveAs(
@@ -299,6 +337,14 @@ class PixelWidget(Widget):
                     texture_flipped=self.texture_flipped,
                 )
 
+    def _onSaveFinished(self, error):
+        # Called on the save thread, so show the result on the UI thread.
+        Clock.schedule_once(lambda dt: self.onSaveFinished(error))
+
+    def onSaveFinished(self, error):
+        if error is not None:
+            print("[PixelWidget] Save failed: {}".format(error))
+
     # def onColorButtonClick(self,instance):
     #     self.paletteWidget.open()
 
@@ -1,5 +1,16 @@
 import os
 
+from logging import getLogger
+
+ENABLE_PUREMAGIC = False
+try:
+    import puremagic
+    ENABLE_PUREMAGIC = True
+except ImportError:
+    puremagic = None
+
+logger = getLogger(__name__)
+
 dot_ext_mimetypes = {
     ".alac": "audio/alac",
     ".flac": "audio/flac",
@@ -31,3 +42,35 @@ def path_mimetype(path):
     path_lower = path.lower()
     dot_ext = os.path.splitext(path_lower)[1]
     return dot_ext_mimetypes.get(dot_ext)
+
+
+_sniffed = {}  # path -> (size, mtime_ns, MIME type)
+
+
+def sniff_mimetype(path):
+    """Get the MIME type from the file's content (or else extension).
+
+    Results are cached by path, size and mtime so opening the same file
+    again doesn't read it again.
+
+    Returns:
+        str: The MIME type, or None if unknown.
+    """
+    stat = os.stat(path)
+    key = os.path.realpath(path)
+    cached = _sniffed.get(key)
+    if (cached is not None) and (cached[:2] == (stat.st_size,
+                                                stat.st_mtime_ns)):
+        return cached[2]
+    mime_type = None
+    if ENABLE_PUREMAGIC:
+        try:
+            mime_type = puremagic.from_file(path, mime=True)
+            # ^ (without mime=True it only gets an extension such as .mp4)
+        except puremagic.PureError as ex:
+            logger.warning("Could not determine file type of \"{}\": {}"
+                           .format(path, ex))
+    if not mime_type:
+        mime_type = path_mimetype(path)
+    _sniffed[key] = (stat.st_size, stat.st_mtime_ns, mime_type)
+    return mime_type
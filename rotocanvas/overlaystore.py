@@ -0,0 +1,222 @@
+"""Overlay (paint) layers of each frame, stored as deduplicated tiles.
+
+Each layer is split into tiles (see PPTiledImage). Empty (all zero)
+tiles are not stored at all, and each other tile is zlib-compressed and
+stored once by the hash of its content, so a tile that is the same in
+many frames (or layers) takes space once. Loading a layer only reads
+its own tiles (optionally only the visible ones), so seeking to a frame
+doesn't read any other frame's overlay.
+"""
+import hashlib
+import struct
+import zlib
+
+from collections import OrderedDict
+from logging import getLogger
+
+from rotocanvas.pythonpixels import PPTiledImage
+
+logger = getLogger(__name__)
+
+DEFAULT_LEVEL = 6  # zlib level (1 is fastest, 9 is smallest)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+TILE_HEADER = struct.Struct("<HHB")  # width, height, byte depth (hashed)
+
+
+def tile_hash(width, height, byteDepth, data):
+    """Get the content address of a tile (its size is part of it)."""
+    digest = hashlib.sha256(TILE_HEADER.pack(width, height, byteDepth))
+    digest.update(data)
+    return digest.digest()
+
+
+def split_into_tiles(image, tileSize):
+    """Get (tile x, tile y, width, height, bytes) of non-empty tiles.
+
+    Args:
+        image (PPImage): A dense image (such as a KPImage), or a
+            PPTiledImage (its own tiles are used, so tileSize must
+            match its tileSize).
+        tileSize (int): The tile width and height.
+    """
+    if isinstance(image, PPTiledImage):
+        if image.tileSize != tileSize:
+            raise ValueError("The image has {}px tiles but the layer has"
+                             " {}px tiles".format(image.tileSize, tileSize))
+        for (tileX, tileY), tile in sorted(image.tiles.items()):
+            data = bytes(tile.data)
+            if data.count(0) != len(data):
+                yield tileX, tileY, tile.size[0], tile.size[1], data
+        return
+    bd = image.byteDepth
+    width, height = image.size
+    for tileY in range(0, (height + tileSize - 1) // tileSize):
+        top = tileY * tileSize
+        tileH = min(tileSize, height - top)
+        for tileX in range(0, (width + tileSize - 1) // tileSize):
+            left = tileX * tileSize
+            tileW = min(tileSize, width - left)
+            line_size = tileW * bd
+            srcI = top * image.stride + left * bd
+            data = b"".join(
+                bytes(image.data[srcI+y*image.stride:
+                                 srcI+y*image.stride+line_size])
+                for y in range(tileH)
+            )
+            if data.count(0) != len(data):
+                yield tileX, tileY, tileW, tileH, data
+
+
+class OverlayStore:
+    """Save and load overlay layers in a project's ProjectStore.
+
+    Writes are part of the store's transaction (committed by
+    RCProject.save).
+
+    Args:
+        store (ProjectStore): The project file.
+        level (Optional[int]): The zlib compression level.
+        cacheBytes (Optional[int]): Budget for decompressed tiles kept
+            by hash (so seeking back and forth, or tiles shared by
+            frames, don't decompress again).
+    """
+    def __init__(self, store, level=DEFAULT_LEVEL,
+                 cacheBytes=DEFAULT_CACHE_BYTES):
+        self.store = store
+        self.connection = store.connection
+        self.level = level
+        self.cacheBytes = cacheBytes
+        self._tiles = OrderedDict()  # hash -> decompressed bytes (LRU)
+        self._cachedBytes = 0
+
+    def save_layer(self, source, frame, layer, image, tileSize=None):
+        """Save (replace) a layer of a frame.
+
+        Only tiles that aren't stored yet (by content) are compressed.
+
+        Args:
+            source (str): The video (see RCProject.addVideo).
+            frame (int): The frame number.
+            layer (str): The layer name.
+            image (Union[PPImage,PPTiledImage]): The pixels (stored in
+                the image's channel order).
+            tileSize (Optional[int]): Defaults to the image's tileSize
+                if it is a PPTiledImage, else PPTiledImage.TILE_SIZE.
+
+        Returns:
+            int: The number of (non-empty) tiles in the layer.
+        """
+        if tileSize is None:
+            tileSize = getattr(image, 'tileSize', PPTiledImage.TILE_SIZE)
+        self.delete_layer(source, frame, layer)
+        self.connection.execute(
+            "INSERT INTO layers (source, frame, layer, width, height,"
+            " byte_depth, tile_size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (source, frame, layer, image.size[0], image.size[1],
+             image.byteDepth, tileSize))
+        count = 0
+        for tileX, tileY, width, height, data in split_into_tiles(
+                image, tileSize):
+            digest = tile_hash(width, height, image.byteDepth, data)
+            if self.connection.execute("SELECT 1 FROM tiles WHERE hash = ?",
+                                       (digest,)).fetchone() is None:
+                self.connection.execute(
+                    "INSERT INTO tiles (hash, data) VALUES (?, ?)",
+                    (digest, zlib.compress(data, self.level)))
+            self.connection.execute(
+                "INSERT INTO layer_tiles (source, frame, layer, tile_x,"
+                " tile_y, hash) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, frame, layer, tileX, tileY, digest))
+            count += 1
+        return count
+
+    def load_layer(self, source, frame, layer, rect=None):
+        """Load a layer of a frame.
+
+        Args:
+            rect (Optional[PPRect]): If not None, only load tiles
+                touching this region (such as the visible part).
+
+        Returns:
+            PPTiledImage: The layer, or None if it wasn't saved.
+        """
+        row = self.connection.execute(
+            "SELECT width, height, byte_depth, tile_size FROM layers"
+            " WHERE source = ? AND frame = ? AND layer = ?",
+            (source, frame, layer)).fetchone()
+        if row is None:
+            return None
+        width, height, byteDepth, tileSize = row
+        image = PPTiledImage((width, height), byteDepth=byteDepth,
+                             tileSize=tileSize)
+        wanted = None
+        if rect is not None:
+            wanted = set(image.get_tile_coords_in(rect))
+        for tileX, tileY, digest in self.connection.execute(
+                "SELECT tile_x, tile_y, hash FROM layer_tiles"
+                " WHERE source = ? AND frame = ? AND layer = ?",
+                (source, frame, layer)).fetchall():
+            if (wanted is not None) and ((tileX, tileY) not in wanted):
+                continue
+            tile = image.get_tile(tileX, tileY, create=True)
+            tile.data[:] = self._get_tile_data(digest)
+        return image
+
+    def _get_tile_data(self, digest):
+        data = self._tiles.get(digest)
+        if data is not None:
+            self._tiles.move_to_end(digest)
+            return data
+        row = self.connection.execute(
+            "SELECT data FROM tiles WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError("Tile {} is missing from {}"
+                           .format(digest.hex(), self.store.path))
+        data = zlib.decompress(row[0])
+        self._tiles[digest] = data
+        self._cachedBytes += len(data)
+        while (self._cachedBytes > self.cacheBytes) and self._tiles:
+            _, old = self._tiles.popitem(last=False)
+            self._cachedBytes -= len(old)
+        return data
+
+    def delete_layer(self, source, frame, layer):
+        """Remove a layer (see collect_garbage for its tiles)."""
+        self.connection.execute(
+            "DELETE FROM layers WHERE source = ? AND frame = ? AND layer = ?",
+            (source, frame, layer))
+        self.connection.execute(
+            "DELETE FROM layer_tiles"
+            " WHERE source = ? AND frame = ? AND layer = ?",
+            (source, frame, layer))
+
+    def layer_names(self, source, frame):
+        """Get the names of the saved layers of a frame."""
+        return [row[0] for row in self.connection.execute(
+            "SELECT layer FROM layers WHERE source = ? AND frame = ?"
+            " ORDER BY layer", (source, frame))]
+
+    def collect_garbage(self):
+        """Remove tiles no longer used by any layer.
+
+        Returns:
+            int: The number of tiles removed.
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM tiles WHERE hash NOT IN"
+            " (SELECT hash FROM layer_tiles)")
+        return cursor.rowcount
+
+    def stats(self):
+        tiles, stored = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM tiles"
+        ).fetchone()
+        refs = self.connection.execute(
+            "SELECT COUNT(*) FROM layer_tiles").fetchone()[0]
+        return {
+            'tiles': tiles,  # unique (stored) tiles
+            'tile_refs': refs,  # tiles of all layers
+            'stored_bytes': stored,
+            'cached_bytes': self._cachedBytes,
+        }
+
@@ -0,0 +1,159 @@
+"""SQLite storage for a .rotocanvas project.
+
+Project-wide settings are stored as JSON values by key, and each frame's
+annotations (and layer references) are a separate JSON record keyed by
+(source, frame), so saving after one stroke only writes that frame's
+record and opening a project doesn't read any frame until it is shown.
+Overlay layers are stored as tiles (see overlaystore.OverlayStore).
+"""
+import json
+import os
+import sqlite3
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+STORE_VERSION = 2  # stored as PRAGMA user_version (2 added overlays)
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+def is_project_store(path):
+    """Check whether path is a ProjectStore (not a legacy JSON project).
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as stream:
+        return stream.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+class ProjectStore:
+    """A project file with per-frame records.
+
+    Writes are in a transaction until commit is called (RCProject.save
+    calls it), so an unsaved project doesn't change on disk.
+
+    Args:
+        path (str): The .rotocanvas file (created if it doesn't exist).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        version = self.connection.execute(
+            "PRAGMA user_version").fetchone()[0]
+        if version > STORE_VERSION:
+            self.connection.close()
+            raise ValueError("{} is from a newer version of rotocanvas"
+                             " (store version {} > {})"
+                             .format(path, version, STORE_VERSION))
+        if version < STORE_VERSION:
+            self._create()
+
+    def _create(self):
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS frames ("
+                " source TEXT NOT NULL,"
+                " frame INTEGER NOT NULL,"
+                " record TEXT NOT NULL,"
+                " PRIMARY KEY (source, frame))")
+            # Overlay layers (see overlaystore.OverlayStore):
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS layers ("
+                " source TEXT NOT NULL,"
+                " frame INTEGER NOT NULL,"
+                " layer TEXT NOT NULL,"
+                " width INTEGER NOT NULL,"
+                " height INTEGER NOT NULL,"
+                " byte_depth INTEGER NOT NULL,"
+                " tile_size INTEGER NOT NULL,"
+                " PRIMARY KEY (source, frame, layer))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS layer_tiles ("
+                " source TEXT NOT NULL,"
+                " frame INTEGER NOT NULL,"
+                " layer TEXT NOT NULL,"
+                " tile_x INTEGER NOT NULL,"
+                " tile_y INTEGER NOT NULL,"
+                " hash BLOB NOT NULL,"
+                " PRIMARY KEY (source, frame, layer, tile_x, tile_y))")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS layer_tiles_hash"
+                " ON layer_tiles (hash)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                " hash BLOB PRIMARY KEY,"
+                " data BLOB NOT NULL)")  # zlib-compressed tile bytes
+            self.connection.execute(
+                "PRAGMA user_version = {}".format(STORE_VERSION))
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def meta_items(self):
+        """Get all project-wide settings as a dict."""
+        return {key: json.loads(value) for key, value in
+                self.connection.execute("SELECT key, value FROM meta")}
+
+    def set_meta(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value, sort_keys=True)))
+
+    def delete_meta(self, key):
+        self.connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+    def get_frame(self, source, frame):
+        """Read one frame's record.
+
+        Returns:
+            dict: The record, or None if the frame has none.
+        """
+        row = self.connection.execute(
+            "SELECT record FROM frames WHERE source = ? AND frame = ?",
+            (source, frame)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_frame(self, source, frame, record):
+        """Write (replace) one frame's record (a JSON-compatible dict)."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO frames (source, frame, record)"
+            " VALUES (?, ?, ?)",
+            (source, frame, json.dumps(record, sort_keys=True)))
+
+    def delete_frame(self, source, frame):
+        self.connection.execute(
+            "DELETE FROM frames WHERE source = ? AND frame = ?",
+            (source, frame))
+
+    def frame_numbers(self, source):
+        """Get the numbers of frames that have records, in order."""
+        return [row[0] for row in self.connection.execute(
+            "SELECT frame FROM frames WHERE source = ? ORDER BY frame",
+            (source,))]
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        """Close (without committing) the store."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -2,6 +2,13 @@ from __future__ import print_function
 import math
 import time
 
+ENABLE_NUMPY = False
+try:
+    import numpy as np
+    ENABLE_NUMPY = True
+except ImportError:
+    np = None
+
 _PYGAME_BLEND_ADD  = 0x1  # noqa: E221
 _PYGAME_BLEND_SUB  = 0x2  # noqa: E221
 _PYGAME_BLEND_MULT = 0x3  # noqa: E221
@@ -542,14 +549,14 @@ def set_at_from_fvec_with_bo(
     dst[pixelByteIndex + gOffset] = int(round(brushColor[1] * 255.0))
     dst[pixelByteIndex + rOffset] = int(round(brushColor[0] * 255.0))
     if (aOffset is not None) and (aOffset < destByteDepth):
-        dst[pixelByteIndex + aOffset] = int(round(brushColor[4] * 255.0))
+        dst[pixelByteIndex + aOffset] = int(round(brushColor[3] * 255.0))
 
 
 def set_at_from_fcolor_with_bo(
         dst, dstStride, destByteDepth, vec2, brushColor,
         bOffset, gOffset, rOffset, aOffset):
     xCenter = int(vec2[0])
-    yCenter = int(vec2[0])
+    yCenter = int(vec2[1])
     pixelByteIndex = dstStride * yCenter + xCenter * destByteDepth
     # print ("pixelByteIndex:" + str(pixelByteIndex))
     # print ("len(pixelBuffer):" + str(len(dst)))
@@ -643,6 +650,241 @@ def blit_copy(dst_data, dstStride,
         print("Not Yet Implemented: different byte depth in blit_copy")
 
 
+def clip_rect_to_size(left, top, width, height, size):
+    """Clip a rect to an image of the given size.
+
+    Returns:
+        PPRect: The part of the rect that is inside of the image, or
+            None if none of it is.
+    """
+    right = min(left + width, size[0])
+    bottom = min(top + height, size[1])
+    left = max(left, 0)
+    top = max(top, 0)
+    if (right <= left) or (bottom <= top):
+        return None
+    return PPRect(left, top, right - left, bottom - top)
+
+
+def _brush_blend_python(dst_data, dstStride, dst_byteDepth,
+                        src_data, srcStride, src_byteDepth,
+                        dstRect, srcX, srcY,
+                        bOffset, gOffset, rOffset, aOffset):
+    """Blend a brush using a per-pixel loop (when numpy is missing).
+    See brush_blend_with_bo for the formula.
+    """
+    iB = bOffset
+    iG = gOffset
+    iR = rOffset
+    iA = aOffset
+    src = src_data
+    dst = dst_data
+    dstLSI = dstRect.top * dstStride + dstRect.left * dst_byteDepth
+    srcLSI = srcY * srcStride + srcX * src_byteDepth
+    for _y in range(dstRect.height):
+        di = dstLSI
+        si = srcLSI
+        for _x in range(dstRect.width):
+            sab = src[si + iA]
+            if sab != 0:
+                a = sab / 255.0
+                ia = 1.0 - a
+                a_total_i = int(dst[di + iA]) + sab
+                if a_total_i > 255:
+                    a_total_i = 255
+                dst[di + iB] = int(ia * float(dst[di + iB])
+                                   + a * float(src[si + iB]) + .5)
+                dst[di + iG] = int(ia * float(dst[di + iG])
+                                   + a * float(src[si + iG]) + .5)
+                dst[di + iR] = int(ia * float(dst[di + iR])
+                                   + a * float(src[si + iR]) + .5)
+                dst[di + iA] = a_total_i
+            di += dst_byteDepth
+            si += src_byteDepth
+        dstLSI += dstStride
+        srcLSI += srcStride
+
+
+def buffer_view(data, stride, byteDepth, rect):
+    """Get a writable numpy (height, width, byteDepth) view of a rect.
+
+    No pixels are copied, so writing to the view writes to data.
+
+    Args:
+        data (bytearray): The pixel buffer.
+        stride (int): Bytes per line.
+        byteDepth (int): Bytes per pixel.
+        rect (PPRect): The region (must already be clipped).
+    """
+    lines = np.frombuffer(data, dtype=np.uint8,
+                          count=stride * (rect.top + rect.height))
+    lines = lines.reshape(rect.top + rect.height, stride)
+    region = lines[rect.top:rect.top+rect.height,
+                   rect.left*byteDepth:(rect.left+rect.width)*byteDepth]
+    return region.reshape(rect.height, rect.width, byteDepth)
+
+
+def _brush_blend_numpy(dst_data, dstStride, dst_byteDepth,
+                       src_data, srcStride, src_byteDepth,
+                       dstRect, srcX, srcY,
+                       bOffset, gOffset, rOffset, aOffset):
+    """Blend a whole brush patch at once using numpy.
+    See brush_blend_with_bo for the formula.
+    """
+    dst = buffer_view(dst_data, dstStride, dst_byteDepth, dstRect)
+    src = buffer_view(
+        src_data, srcStride, src_byteDepth,
+        PPRect(srcX, srcY, dstRect.width, dstRect.height),
+    )
+    channels = [bOffset, gOffset, rOffset]
+    src_a = src[..., aOffset]
+    mask = src_a != 0
+    if not mask.any():
+        return
+    a = src_a.astype(np.float32)[..., None] * np.float32(1.0 / 255.0)
+    dst_c = dst[..., channels]
+    blended = ((np.float32(1.0) - a) * dst_c
+               + a * src[..., channels]
+               + np.float32(.5)).astype(np.uint8)
+    # ^ astype truncates, so + .5 rounds (same as int(x + .5) above).
+    dst[..., channels] = np.where(mask[..., None], blended, dst_c)
+    dst_a = dst[..., aOffset]
+    a_total = np.minimum(dst_a.astype(np.uint16) + src_a, 255)
+    dst[..., aOffset] = np.where(mask, a_total, dst_a).astype(np.uint8)
+
+
+def brush_blend_with_bo(dst_data, dstStride, dst_byteDepth, dst_size,
+                        src_data, srcStride, src_byteDepth, src_size,
+                        destX, destY, bOffset, gOffset, rOffset, aOffset):
+    """Alpha-blend a brush onto dst_data with its top left at destX,destY.
+
+    The brush rect is clipped to dst_size first, so the brush can hang
+    off of any edge. Both buffers use the given channel offsets. Where
+    brush alpha is not 0, each color becomes
+    int(ia * dst + a * src + .5) (a is brush alpha as 0.0 to 1.0, and
+    ia is 1.0 - a), and alpha becomes the sum of both alphas (capped at
+    255). The numpy version (used if numpy is installed) matches the
+    per-pixel version within 1 for each channel.
+
+    Returns:
+        PPRect: The rect in dst that was affected, or None if the brush
+            is entirely outside of dst.
+    """
+    if aOffset is None:
+        raise ValueError("brush_blend_with_bo requires an alpha channel.")
+    dstRect = clip_rect_to_size(destX, destY, src_size[0], src_size[1],
+                                dst_size)
+    if dstRect is None:
+        return None
+    srcX = dstRect.left - destX
+    srcY = dstRect.top - destY
+    if ENABLE_NUMPY:
+        blend = _brush_blend_numpy
+    else:
+        blend = _brush_blend_python
+    blend(dst_data, dstStride, dst_byteDepth,
+          src_data, srcStride, src_byteDepth,
+          dstRect, srcX, srcY,
+          bOffset, gOffset, rOffset, aOffset)
+    return dstRect
+
+
+def tint_with_bo(data, byteDepth, color, bOffset, gOffset, rOffset,
+                 aOffset):
+    """Multiply each channel by a factor, in place.
+
+    Each value becomes int(round(value * factor)), where the factors
+    are color[0] for bOffset, color[1] for gOffset, color[2] for
+    rOffset and color[3] for aOffset (skipped if aOffset is None).
+    With numpy this is one vectorized multiply, otherwise each channel
+    is mapped through a 256-entry lookup table (bytes.translate).
+
+    Args:
+        data (bytearray): The pixel buffer (with no slack at line ends).
+        byteDepth (int): Bytes per pixel.
+        color (Union[list[float],tuple[float]]): 4 factors (usually 0.0
+            to 1.0).
+    """
+    channels = []
+    factors = []
+    for offset, factor in zip((bOffset, gOffset, rOffset, aOffset), color):
+        if offset is None:
+            continue
+        channels.append(offset)
+        factors.append(float(factor))
+    if ENABLE_NUMPY:
+        pixels = np.frombuffer(data, dtype=np.uint8).reshape(-1, byteDepth)
+        tinted = np.rint(pixels[:, channels] * np.array(factors))
+        # ^ rint rounds half to even, the same as Python's round.
+        pixels[:, channels] = np.clip(tinted, 0, 255).astype(np.uint8)
+        return
+    for offset, factor in zip(channels, factors):
+        lut = bytes(min(255, max(0, int(round(value * factor))))
+                    for value in range(256))
+        data[offset::byteDepth] = data[offset::byteDepth].translate(lut)
+
+
+def swizzle_copy_with_bo(dst_data, dstStride, dst_byteDepth, dst_offsets,
+                         src_data, srcStride, src_byteDepth, src_offsets,
+                         size, flip_v=False):
+    """Copy same-size pixels in one pass, reordering channels.
+
+    Lines are copied in reverse order if flip_v. If src has no alpha
+    (the last src offset is None) but dst does, dst alpha becomes 255.
+
+    Args:
+        dst_offsets (tuple[int]): Destination (b, g, r, a) offsets
+            (a may be None).
+        src_offsets (tuple[int]): Source (b, g, r, a) offsets, where
+            each source channel is copied to the same item in
+            dst_offsets.
+        size (tuple[int]): Width and height of both images.
+    """
+    width, height = int(size[0]), int(size[1])
+    pairs = [(d, s) for d, s in zip(dst_offsets, src_offsets)
+             if (d is not None) and (s is not None)]
+    opaque_offset = None
+    if (dst_offsets[3] is not None) and (src_offsets[3] is None):
+        opaque_offset = dst_offsets[3]
+    if ENABLE_NUMPY:
+        rect = PPRect(0, 0, width, height)
+        dst = buffer_view(dst_data, dstStride, dst_byteDepth, rect)
+        src = np.frombuffer(src_data, dtype=np.uint8,
+                            count=srcStride * height)
+        src = src.reshape(height, srcStride)[:, :width*src_byteDepth]
+        src = src.reshape(height, width, src_byteDepth)
+        if flip_v:
+            src = src[::-1]  # a view (negative stride), not a copy
+        dst[..., [d for d, _ in pairs]] = src[..., [s for _, s in pairs]]
+        if opaque_offset is not None:
+            dst[..., opaque_offset] = 255
+        return
+    dst_line_size = width * dst_byteDepth
+    src_line_size = width * src_byteDepth
+    if ((not flip_v) and (dstStride == dst_line_size)
+            and (srcStride == src_line_size)):
+        # No slack at line ends, so copy each whole channel at once:
+        count = width * height
+        for d, s in pairs:
+            dst_data[d:count*dst_byteDepth:dst_byteDepth] = \
+                src_data[s:count*src_byteDepth:src_byteDepth]
+        if opaque_offset is not None:
+            dst_data[opaque_offset:count*dst_byteDepth:dst_byteDepth] = \
+                b'\xff' * count
+        return
+    opaque_line = b'\xff' * width
+    for y in range(height):
+        src_y = (height - 1 - y) if flip_v else y
+        d_lpi = y * dstStride
+        s_lpi = src_y * srcStride
+        for d, s in pairs:
+            dst_data[d_lpi+d:d_lpi+dst_line_size:dst_byteDepth] = \
+                src_data[s_lpi+s:s_lpi+src_line_size:src_byteDepth]
+        if opaque_offset is not None:
+            dst_data[d_lpi+opaque_offset:d_lpi+dst_line_size:
+                     dst_byteDepth] = opaque_line
+
+
 # blit_copy_with_bo
 # (NOT static_set_at_from_fvec_with_bo)
 # was formerly:
@@ -736,21 +978,14 @@ class PPImage:
 
     def copy_flipped_v(self):
         result = self.getNew(self.size, self.byteDepth)
-        srcY = self.size[1] - 1
+        line_size = self.size[0] * self.byteDepth
+        srcI = (self.size[1] - 1) * self.stride
         dstI = 0
-        # source_slack = self.stride - self.size[0] * self.byteDepth
-        dest_slack = result.stride - result.size[0] * result.byteDepth
         for _dest_y in range(0, self.size[1]):
-            srcI = srcY * self.stride
-            for _x in range(0, self.size[0]):
-                for _channel in range(0, self.byteDepth):
-                    result.data[dstI] = self.data[srcI]
-                    srcI += 1
-                    dstI += 1
-                # srcI += self.byteDepth
-                # dstI += translatedImage.byteDepth
-            srcY -= 1
-            dstI += dest_slack
+            result.data[dstI:dstI+line_size] = \
+                self.data[srcI:srcI+line_size]
+            srcI -= self.stride
+            dstI += result.stride
         return result
 
     def get_size(self):
@@ -943,7 +1178,7 @@ class PPImage:
                 if self.byteDepth >= 4:
                     RGB_bytes[3] = self.data[pixelByteIndex + self.aOffset]
                 else:
-                    RGB_bytes[4] = 255
+                    RGB_bytes[3] = 255
             else:
                 RGB_bytes[0] = self.data[pixelByteIndex]
                 RGB_bytes[1] = self.data[pixelByteIndex]
@@ -1023,11 +1258,18 @@ class PPImage:
 
     def blit_copy_with_bo(self, src_data, srcStride,
                           src_byteDepth, src_size, src_bOffset,
-                          src_gOffset, src_rOffset, src_aOffset):
+                          src_gOffset, src_rOffset, src_aOffset,
+                          flip_v=False):
         '''Copy the source image to self.
 
         All of the parameters describe the source. The offsets are
-        channel offsets relative to the beginning of a pixel.
+        channel offsets relative to the beginning of a pixel. If the
+        source is the same size as self and both are color images, the
+        copy is done in one pass by swizzle_copy_with_bo.
+
+        Keyword arguments:
+        flip_v -- Copy the lines in reverse order (only for a source
+            the same size as self).
         '''
         # this is much like LineCopy version, except instead of using
         # python array slicing it uses static_range_copy_with_bo
@@ -1097,6 +1339,21 @@ class PPImage:
         # Allow other value types such as float in case of float
         # color.
 
+        if ((src_width, src_height) == tuple(self.size)
+                and (self.byteDepth >= 3) and (src_byteDepth >= 3)
+                and isinstance(src_data, (bytes, bytearray, memoryview))):
+            swizzle_copy_with_bo(
+                self.data, self.stride, self.byteDepth,
+                (self.bOffset, self.gOffset, self.rOffset, self.aOffset),
+                src_data, srcStride, src_byteDepth,
+                (src_bOffset, src_gOffset, src_rOffset, src_aOffset),
+                self.size, flip_v=flip_v,
+            )
+            return
+        if flip_v:
+            raise ValueError("flip_v is only implemented for a color"
+                             " source the same size as the destination.")
+
         if ((self.byteDepth >= 3)
                 and (src_byteDepth >= 3 or src_byteDepth == 1)):
             dl_zeroes = None
@@ -1467,6 +1724,252 @@ class PPImage:
 # end class PPImage
 
 
+class PPTiledImage:
+    """A sparse image made of tiles that are allocated on first write.
+
+    Tiles that were never written are transparent (all zeros) and take
+    no memory, so a huge, mostly-empty overlay is cheap to keep. The
+    drawing methods match PPImage (get_at, set_at_*, blit and brushAt
+    using brushImage), and compose makes a dense PPImage of only the
+    region that is visible.
+
+    Args:
+        size (tuple[int]): The full width and height.
+        byteDepth (Optional[int]): Bytes per pixel (as in PPImage).
+        tileSize (Optional[int]): Width and height of each tile
+            (except the right and bottom edge tiles, which are cropped
+            to size). Defaults to PPTiledImage.TILE_SIZE.
+    """
+    TILE_SIZE = 256
+
+    def __init__(self, size, byteDepth=4, tileSize=None):
+        if tileSize is None:
+            tileSize = PPTiledImage.TILE_SIZE
+        self.size = (int(size[0]), int(size[1]))
+        self.byteDepth = int(byteDepth)
+        self.tileSize = int(tileSize)
+        self.tiles = {}  # (tile x, tile y) -> PPImage
+        offsets = PPImage((1, 1), byteDepth=self.byteDepth)
+        self.bOffset = offsets.bOffset
+        self.gOffset = offsets.gOffset
+        self.rOffset = offsets.rOffset
+        self.aOffset = offsets.aOffset
+        self.brushImage = None
+        self.enableDebug = False
+        self.lastUsedFileName = None
+
+    def get_size(self):
+        return self.size
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def get_rect(self):
+        return PPRect(0, 0, self.size[0], self.size[1])
+
+    def get_tile_rect(self, tileX, tileY):
+        left = tileX * self.tileSize
+        top = tileY * self.tileSize
+        return PPRect(left, top,
+                      min(self.tileSize, self.size[0] - left),
+                      min(self.tileSize, self.size[1] - top))
+
+    def get_tile(self, tileX, tileY, create=False):
+        """Get a tile, or None if it was never written.
+
+        Args:
+            create (Optional[bool]): Allocate the (transparent) tile if
+                it doesn't exist yet.
+        """
+        tile = self.tiles.get((tileX, tileY))
+        if (tile is None) and create:
+            rect = self.get_tile_rect(tileX, tileY)
+            tile = PPImage((rect.width, rect.height),
+                           byteDepth=self.byteDepth)
+            tile.bOffset = self.bOffset
+            tile.gOffset = self.gOffset
+            tile.rOffset = self.rOffset
+            tile.aOffset = self.aOffset
+            self.tiles[(tileX, tileY)] = tile
+        return tile
+
+    def set_tile(self, tileX, tileY, tile):
+        """Set or (if tile is None) remove a tile."""
+        if tile is None:
+            self.tiles.pop((tileX, tileY), None)
+            return
+        rect = self.get_tile_rect(tileX, tileY)
+        if tuple(tile.size) != (rect.width, rect.height):
+            raise ValueError("Tile {} must be {} but is {}"
+                             .format((tileX, tileY),
+                                     (rect.width, rect.height), tile.size))
+        self.tiles[(tileX, tileY)] = tile
+
+    def get_tile_coords_in(self, rect):
+        """Get the (tile x, tile y) of every tile touching a rect.
+
+        Args:
+            rect (PPRect): The region (clipped to self automatically).
+        """
+        rect = clip_rect_to_size(rect.left, rect.top, rect.width,
+                                 rect.height, self.size)
+        if rect is None:
+            return []
+        ts = self.tileSize
+        return [(tileX, tileY)
+                for tileY in range(rect.top // ts,
+                                   (rect.top + rect.height - 1) // ts + 1)
+                for tileX in range(rect.left // ts,
+                                   (rect.left + rect.width - 1) // ts + 1)]
+
+    def _tile_at(self, vec2, create):
+        x = int(vec2[0])
+        y = int(vec2[1])
+        if (x < 0) or (y < 0) or (x >= self.size[0]) or (y >= self.size[1]):
+            raise IndexError("{} is outside of {}".format(vec2, self.size))
+        tile = self.get_tile(x // self.tileSize, y // self.tileSize,
+                             create=create)
+        return tile, (x % self.tileSize, y % self.tileSize)
+
+    def get_at(self, coordinates):
+        tile, local = self._tile_at(coordinates, False)
+        if tile is None:
+            return bytearray(4)
+        return tile.get_at(local)
+
+    def set_at_from_fcolor(self, vec2, brushColor):
+        """See PPImage.set_at_from_fcolor."""
+        tile, local = self._tile_at(vec2, True)
+        tile.set_at_from_fcolor(local, brushColor)
+
+    def set_at_from_fvec(self, vec2, brushColor):
+        """See PPImage.set_at_from_fvec."""
+        tile, local = self._tile_at(vec2, True)
+        tile.set_at_from_fvec(local, brushColor)
+
+    def set_at_from_ivec(self, vec2, brushColor):
+        """See PPImage.set_at_from_ivec."""
+        tile, local = self._tile_at(vec2, True)
+        tile.set_at_from_ivec(local, brushColor)
+
+    def blit(self, srcImage, dstRect):
+        """Alpha-blend a PPImage onto self (see PPImage._blit).
+
+        Args:
+            srcImage (PPImage): The source.
+            dstRect (PPRect): Only left and top are used.
+        """
+        dstRect = PPRect(dstRect.left, dstRect.top,
+                         srcImage.size[0], srcImage.size[1])
+        for tileX, tileY in self.get_tile_coords_in(dstRect):
+            tile_rect = self.get_tile_rect(tileX, tileY)
+            part = clip_rect_to_size(
+                dstRect.left - tile_rect.left, dstRect.top - tile_rect.top,
+                dstRect.width, dstRect.height,
+                (tile_rect.width, tile_rect.height),
+            )
+            if part is None:
+                continue
+            area = PPRect(part.left + tile_rect.left - dstRect.left,
+                          part.top + tile_rect.top - dstRect.top,
+                          part.width, part.height)
+            tile = self.get_tile(tileX, tileY, create=True)
+            tile._blit(srcImage, part, area=area)
+
+    def setBrushImage(self, brushImage):
+        """Set the PPImage that brushAt draws (already tinted)."""
+        self.brushImage = brushImage
+
+    def brushAt(self, centerX, centerY):
+        """Draw brushImage centered at the given location.
+
+        Only tiles under the brush are touched (and allocated).
+
+        Returns:
+            PPRect: The affected rect, or None if the brush was entirely
+                outside of the image.
+        """
+        brush = self.brushImage
+        if brush is None:
+            raise ValueError("brushImage is None in brushAt"
+                             " (you must call setBrushImage first)")
+        destX = int(centerX) - int(brush.size[0] / 2)
+        destY = int(centerY) - int(brush.size[1] / 2)
+        rect = clip_rect_to_size(destX, destY, brush.size[0],
+                                 brush.size[1], self.size)
+        if rect is None:
+            return None
+        for tileX, tileY in self.get_tile_coords_in(rect):
+            tile_rect = self.get_tile_rect(tileX, tileY)
+            tile = self.get_tile(tileX, tileY, create=True)
+            brush_blend_with_bo(
+                tile.data, tile.stride, tile.byteDepth, tile.size,
+                brush.data, brush.stride, brush.byteDepth, brush.size,
+                destX - tile_rect.left, destY - tile_rect.top,
+                self.bOffset, self.gOffset, self.rOffset, self.aOffset,
+            )
+        return rect
+
+    def compose(self, rect=None):
+        """Copy a region into a new dense PPImage.
+
+        Args:
+            rect (Optional[PPRect]): The visible region. Defaults to the
+                whole image. Parts outside of self are transparent.
+
+        Returns:
+            PPImage: An image the size of rect.
+        """
+        if rect is None:
+            rect = self.get_rect()
+        result = PPImage((rect.width, rect.height), byteDepth=self.byteDepth)
+        result.bOffset = self.bOffset
+        result.gOffset = self.gOffset
+        result.rOffset = self.rOffset
+        result.aOffset = self.aOffset
+        bd = self.byteDepth
+        for tileX, tileY in self.get_tile_coords_in(rect):
+            tile = self.get_tile(tileX, tileY)
+            if tile is None:
+                continue  # result is already transparent there
+            tile_rect = self.get_tile_rect(tileX, tileY)
+            part = clip_rect_to_size(
+                rect.left - tile_rect.left, rect.top - tile_rect.top,
+                rect.width, rect.height, (tile_rect.width, tile_rect.height),
+            )
+            if part is None:
+                continue
+            line_size = part.width * bd
+            dstI = ((part.top + tile_rect.top - rect.top) * result.stride
+                    + (part.left + tile_rect.left - rect.left) * bd)
+            srcI = part.top * tile.stride + part.left * bd
+            for _y in range(part.height):
+                result.data[dstI:dstI+line_size] = \
+                    tile.data[srcI:srcI+line_size]
+                dstI += result.stride
+                srcI += tile.stride
+        return result
+
+    def is_tile_empty(self, tileX, tileY):
+        tile = self.get_tile(tileX, tileY)
+        return (tile is None) or (tile.data.count(0) == len(tile.data))
+
+    def drop_empty_tiles(self):
+        """Free tiles that only contain zeros (such as after erasing)."""
+        for key in list(self.tiles.keys()):
+            if self.is_tile_empty(key[0], key[1]):
+                del self.tiles[key]
+
+    def clear(self):
+        self.tiles = {}
+
+    def get_allocated_byte_count(self):
+        return sum(len(tile.data) for tile in self.tiles.values())
+
+
 if __name__ == "__main__":
     print("  tests:")
     size = (128, 128)
@@ -1,48 +1,336 @@
 import av
 import hashlib
+import json
+import multiprocessing
 import os
+import struct
+import sys
+import threading
 import time
 import shutil
 
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from logging import getLogger
+from queue import Queue
+
+from rotocanvas.framecache import CachedFrame
 
 
 logger = getLogger(__name__)
 
+INDEX_MAGIC = b"RCIDX"
+INDEX_VERSION = 1
+# magic, version, file size, mtime in ns, sampled sha256
+INDEX_HEADER = struct.Struct("<5sHQq32s")
+INDEX_COUNT = struct.Struct("<Q")
+INDEX_NONE = -(2 ** 63)  # stands for a None timestamp/offset in an array
+INDEX_SAMPLE_SIZE = 65536
+INDEX_SAMPLE_COUNT = 16
+# Keys of meta collected by demuxing (stored as int64 arrays in the index):
+INDEX_ARRAY_KEYS = ('iframe_offsets', 'iframe_dts', 'iframe_pts',
+                    'packet_pts')
 
-def cache_keyframes(video_path):
-    cache_path = video_path + "_rotocanvas"
-    if not os.path.isdir(cache_path):
-        os.makedirs(cache_path)
-    # See https://pyav.org/docs/stable/cookbook/basics.html#saving-keyframes
-    with av.open(video_path) as container:
-        # Signal that we only want to look at keyframes.
+
+def index_path_for(video_path):
+    """Get the path of the packet index (beside the _rotocanvas cache)."""
+    return video_path + "_rotocanvas.rcindex"
+
+
+def file_fingerprint(path):
+    """Identify the content of a file without reading all of it.
+
+    Returns:
+        tuple: (size, mtime in nanoseconds, sha256 digest) where the
+            digest is of the size and of INDEX_SAMPLE_COUNT evenly
+            spaced samples (including the start and end of the file).
+    """
+    st = os.stat(path)
+    size = st.st_size
+    sha = hashlib.sha256(str(size).encode('utf-8'))
+    with open(path, 'rb') as stream:
+        last = max(size - INDEX_SAMPLE_SIZE, 0)
+        positions = sorted(set(
+            last * i // (INDEX_SAMPLE_COUNT - 1)
+            for i in range(INDEX_SAMPLE_COUNT)
+        ))
+        for pos in positions:
+            stream.seek(pos)
+            sha.update(stream.read(INDEX_SAMPLE_SIZE))
+    return size, st.st_mtime_ns, sha.digest()
+
+
+def _int64_array(values):
+    result = array('q', (INDEX_NONE if value is None else value
+                         for value in values))
+    if sys.byteorder != "little":
+        result.byteswap()
+    return result
+
+
+def _list_from_int64(data):
+    values = array('q')
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return [None if value == INDEX_NONE else value for value in values]
+
+
+def save_index(video_path, meta, fingerprint=None):
+    """Save the demux results of analyze_video beside the video.
+
+    The format is INDEX_HEADER, a length-prefixed JSON object of the
+    remaining (JSON-compatible) metadata, then a count and
+    little-endian int64 values for each of INDEX_ARRAY_KEYS.
+
+    Args:
+        video_path (str): The video that was analyzed.
+        meta (dict): The result of analyze_video.
+        fingerprint (Optional[tuple]): The result of file_fingerprint
+            if already known (before analyzing, so a change during
+            analysis makes the index stale rather than wrong).
+    """
+    if fingerprint is None:
+        fingerprint = file_fingerprint(video_path)
+    size, mtime_ns, digest = fingerprint
+    other = {key: value for key, value in meta.items()
+             if (key not in INDEX_ARRAY_KEYS) and (key != 'container')}
+    other_bytes = json.dumps(other).encode('utf-8')
+    path = index_path_for(video_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as stream:
+        stream.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, size,
+                                       mtime_ns, digest))
+        stream.write(INDEX_COUNT.pack(len(other_bytes)))
+        stream.write(other_bytes)
+        for key in INDEX_ARRAY_KEYS:
+            values = meta.get(key) or []
+            stream.write(INDEX_COUNT.pack(len(values)))
+            _int64_array(values).tofile(stream)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(video_path, fingerprint=None):
+    """Load the index saved by save_index if it matches the video.
+
+    Returns:
+        dict: The saved meta (without 'container'), or None if there is
+            no index, it is from another version, or the video changed
+            (size, mtime or sampled content).
+    """
+    path = index_path_for(video_path)
+    if not os.path.isfile(path):
+        return None
+    if fingerprint is None:
+        fingerprint = file_fingerprint(video_path)
+    try:
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        magic, version, size, mtime_ns, digest = \
+            INDEX_HEADER.unpack_from(data, 0)
+        if (magic != INDEX_MAGIC) or (version != INDEX_VERSION):
+            return None
+        if (size, mtime_ns, digest) != tuple(fingerprint):
+            return None
+        pos = INDEX_HEADER.size
+        count, = INDEX_COUNT.unpack_from(data, pos)
+        pos += INDEX_COUNT.size
+        meta = json.loads(data[pos:pos+count].decode('utf-8'))
+        pos += count
+        for key in INDEX_ARRAY_KEYS:
+            count, = INDEX_COUNT.unpack_from(data, pos)
+            pos += INDEX_COUNT.size
+            end = pos + count * 8
+            if end > len(data):
+                raise ValueError("truncated {}".format(key))
+            meta[key] = _list_from_int64(data[pos:end])
+            pos = end
+    except (struct.error, ValueError) as ex:
+        logger.warning("Ignoring bad index \"{}\": {}".format(path, ex))
+        return None
+    return meta
+
+
+def keyframe_path(cache_path, pts):
+    return os.path.join(cache_path, "{:04d}.jpg".format(pts))
+
+
+def _cache_keyframe_run(video_path, cache_path, run, quality=80):
+    """Decode and save a run of consecutive keyframes (in one process).
+
+    Args:
+        run (list[int]): pts of keyframes that are adjacent in the
+            video (so decoding continues from one to the next after a
+            single seek).
+
+    Returns:
+        int: The number of keyframes saved.
+    """
+    wanted = set(run)
+    futures = []
+    with av.open(video_path) as container, \
+            ThreadPoolExecutor(max_workers=2) as encoders:
         stream = container.streams.video[0]
         stream.codec_context.skip_frame = "NONKEY"
+        container.seek(run[0], backward=True, any_frame=False, stream=stream)
         for frame in container.decode(stream):
-            # if frame.is_keyframe:  # has no such attribute. See analyze_video
-            #   but skip_frame = "NONKEY" is used above anyway.
-            oops_path = cache_path + "{:04d}.jpg".format(frame.pts)
-            f_path = os.path.join(cache_path, "{:04d}.jpg".format(frame.pts))
-            if os.path.isfile(oops_path):
-                shutil.move(oops_path, f_path)
-                print("mv \"{}\" \"{}\"".format(oops_path, f_path))
-            if os.path.isfile(f_path):
+            if frame.pts is None:
                 continue
-            # We use `frame.pts` as `frame.index` won't make must sense with the `skip_frame`.
-            frame.to_image().save(
-                f_path,
-                quality=80,
-            )
+            if frame.pts in wanted:
+                # Encode on a thread (PIL releases the GIL) while the
+                # next keyframe decodes:
+                futures.append(encoders.submit(
+                    frame.to_image().save,
+                    keyframe_path(cache_path, frame.pts),
+                    quality=quality,
+                ))
+            if frame.pts >= run[-1]:
+                break
+        for future in futures:
+            future.result()  # raise any exception from the encoder
+    return len(futures)
+
+
+def cache_keyframes(video_path, callback=None, meta=None, workers=None):
+    """Save each keyframe as a JPEG (named by pts) in the cache directory.
+
+    Keyframes that are already saved are skipped without decoding them.
+    The rest are split into runs of adjacent keyframes, each decoded in
+    a separate process. The processes are spawned (not forked), so this
+    is safe to call from a thread (such as OpenVideoJob does).
+
+    Args:
+        video_path (str): The video file.
+        callback (Optional[Callable]): Called with a dict containing
+            'ratio' to report progress (as in analyze_video).
+        meta (Optional[dict]): The result of analyze_video (to get the
+            keyframe pts). If None, analyze_video is called (which uses
+            the saved index if valid).
+        workers (Optional[int]): Processes to use (default: CPU count).
+
+    Returns:
+        str: The cache directory.
+    """
+    cache_path = video_path + "_rotocanvas"
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    if meta is None:
+        meta = analyze_video(video_path, lambda status: None)
+        meta.pop('container').close()
+    key_pts = sorted(pts for pts in meta['iframe_pts'] if pts is not None)
+    runs = []
+    run = []
+    for pts in key_pts:
+        oops_path = cache_path + "{:04d}.jpg".format(pts)
+        f_path = keyframe_path(cache_path, pts)
+        if os.path.isfile(oops_path):
+            shutil.move(oops_path, f_path)
+            print("mv \"{}\" \"{}\"".format(oops_path, f_path))
+        if os.path.isfile(f_path):
+            if run:
+                runs.append(run)
+                run = []
+            continue
+        run.append(pts)
+    if run:
+        runs.append(run)
+    total = sum(len(run) for run in runs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Split long runs (such as the first time) so all workers get some:
+    max_run = max(1, -(-total // (workers * 4)))
+    runs = [run[i:i+max_run] for run in runs
+            for i in range(0, len(run), max_run)]
+    done = 0
+    update_time = None
+    if (workers > 1) and (len(runs) > 1):
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(runs)),
+            mp_context=multiprocessing.get_context('spawn'),
+        )  # ^ forking a process that has threads can deadlock
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)  # no process overhead
+    with executor:
+        futures = [executor.submit(_cache_keyframe_run, video_path,
+                                   cache_path, run)
+                   for run in runs]
+        for future in as_completed(futures):
+            done += future.result()
+            if callback is not None:
+                if update_time is None or time.time() - update_time > 1:
+                    callback({'ratio': done / total})
+                    update_time = time.time()
+    if callback is not None:
+        callback({'ratio': 1.0})
+    return cache_path
+
+
+def analyze_video(video_path, callback, use_cache=True, on_keyframe=None):
+    """Collect stream info and keyframe locations of a video.
 
+    Args:
+        video_path (str): The video file.
+        callback (Callable): Called about once per second with a status
+            dict (see iter_analyze_video) containing 'ratio' (0.0 to
+            1.0) to report progress.
+        use_cache (Optional[bool]): Load the demux results from the index
+            beside the video (see save_index) if it is still valid, and
+            save the index after demuxing otherwise.
+        on_keyframe (Optional[Callable]): Called with each keyframe
+            av.Packet while demuxing (not called if the index is loaded
+            instead). See KeyframeDecodeWorker.
 
-def analyze_video(video_path, callback):
-    prefix = "[rc_av.analyze_video] "
+    Returns:
+        dict: metadata including iframe_offsets, iframe_dts, iframe_pts,
+            packet_pts (every video packet, in decoding order) and the
+            open 'container' (the caller must close it).
+    """
+    for status in iter_analyze_video(video_path, use_cache=use_cache,
+                                     on_keyframe=on_keyframe, interval=1.0):
+        callback(status)
+    return status['meta']
+
+
+def iter_analyze_video(video_path, use_cache=True, on_keyframe=None,
+                       interval=.25):
+    """Analyze a video incrementally (see analyze_video).
+
+    Closing the generator early (or a "break" in the loop) cancels the
+    analysis and closes the container.
+
+    Args:
+        interval (Optional[float]): Seconds between yielded statuses.
+
+    Yields:
+        dict: A status with 'ratio', 'packets', 'bytes', 'elapsed',
+            'packets_per_sec', 'bytes_per_sec', 'done' (True only for
+            the last one) and 'meta' (the partial meta, which grows
+            until done). The index is complete up to 'indexed_frames'
+            frames, so frames in that prefix can already be used.
+    """
+    prefix = "[rc_av.iter_analyze_video] "
+    start_time = time.time()
+    fingerprint = None
+    if use_cache:
+        fingerprint = file_fingerprint(video_path)
+        meta = load_index(video_path, fingerprint=fingerprint)
+        if meta is not None:
+            meta['container'] = av.open(video_path)
+            yield _analyze_status(meta, 1.0, 0, 0, start_time, True)
+            return
     # Initialize the meta dictionary to store video metadata
     meta = {
         'iframe_offsets': [],
         'iframe_dts': [],
         'iframe_pts': [],
+        'packet_pts': [],
         'path_sha256': '',
         'video_length_frames': None,
         'video_length_timecode': None,
@@ -63,7 +351,47 @@ def analyze_video(video_path, callback):
     # Open the video file
     container = av.open(video_path)
     meta['container'] = container
+    try:
+        for status in _demux_index(container, meta, file_size, start_time,
+                                   on_keyframe, interval):
+            yield status
+    except BaseException:
+        # including GeneratorExit (cancelled)
+        container.close()
+        raise
+
+    if use_cache:
+        try:
+            save_index(video_path, meta, fingerprint=fingerprint)
+        except OSError as ex:
+            logger.warning(prefix+"Could not save index: {}".format(ex))
+
+    yield _analyze_status(meta, 1.0, status['packets'], status['bytes'],
+                          start_time, True)
+
+
+def _analyze_status(meta, ratio, packets, processed_bytes, start_time,
+                    done):
+    elapsed = max(time.time() - start_time, 1e-6)
+    return {
+        'ratio': ratio,
+        'packets': packets,
+        'bytes': processed_bytes,
+        'elapsed': elapsed,
+        'packets_per_sec': packets / elapsed,
+        'bytes_per_sec': processed_bytes / elapsed,
+        'indexed_frames': len(meta['packet_pts']),
+        'done': done,
+        'meta': meta,
+    }
+
+
+def _demux_index(container, meta, file_size, start_time, on_keyframe,
+                 interval):
+    """Fill meta from the container, yielding a status every interval."""
     meta['total_streams'] = len(container.streams)
+    packets = 0
+    processed_bytes = 0
 
     # Initialize the stream counter and collect stream information
     for stream in container.streams:
@@ -102,19 +430,21 @@ def analyze_video(video_path, callback):
         meta['video_length_timecode'] = str(video_stream.duration * video_stream.time_base) if video_stream.duration else None
 
         # Set variables for callback tracking
-        update_time = None
-        processed_bytes = 0
+        update_time = time.time()
         offset = 0
         prev_dts = None
         # Iterate through packets in the video stream
         for packet in container.demux(video_stream):
             # av.packet.Packet
+            if packet.size > 0:  # not the empty flush packet at the end
+                packets += 1
             processed_bytes += packet.size
-            ratio = processed_bytes / file_size
 
             # Update progress periodically
-            if update_time is None or time.time() - update_time > 1:
-                callback({'ratio': ratio})
+            if time.time() - update_time > interval:
+                yield _analyze_status(meta, processed_bytes / file_size,
+                                      packets, processed_bytes, start_time,
+                                      False)
                 update_time = time.time()
 
             # NOTE: I-Frame is independent,
@@ -140,6 +470,8 @@ def analyze_video(video_path, callback):
                 #             "".format(offset, packet.pos))
                 #         offset = packet.pos
                 meta['iframe_offsets'].append(packet.pos)
+                if on_keyframe is not None:
+                    on_keyframe(packet)
 
                 if packet.dts is not None:
                     # decoding timestamp in time_base units
@@ -155,14 +487,732 @@ def analyze_video(video_path, callback):
                 else:
                     meta['iframe_pts'].append(None)
 
+            if is_frame_start and (packet.size > 0):
+                # (skip the empty flush packet at the end)
+                meta['packet_pts'].append(packet.pts)
             offset += packet.size
             prev_dts = packet.dts
 
+    # Always yield once, so the caller gets the totals
+    yield _analyze_status(meta, processed_bytes / max(file_size, 1),
+                          packets, processed_bytes, start_time, False)
 
-    # Ensure callback at the end
-    callback({'ratio': 1.0})
 
-    return meta
+class AnalyzeJob:
+    """Run iter_analyze_video on a thread.
+
+    Statuses are put in the updates queue (poll it from a GUI). The meta
+    in each status is the same partial dict (see snapshot to copy it
+    safely). Call cancel to stop early.
+
+    Args:
+        video_path (str): The video file.
+        use_cache (Optional[bool]): See analyze_video.
+        on_keyframe (Optional[Callable]): See analyze_video.
+        interval (Optional[float]): Seconds between statuses.
+    """
+    def __init__(self, video_path, use_cache=True, on_keyframe=None,
+                 interval=.25):
+        self.video_path = video_path
+        self.updates = Queue()
+        self.meta = None  # partial until done
+        self.result = None  # the meta (after done)
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self._statuses = iter_analyze_video(
+            video_path, use_cache=use_cache, on_keyframe=on_keyframe,
+            interval=interval)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for status in self._statuses:
+                self.meta = status['meta']
+                if self.cancelled:
+                    if status['done']:
+                        # The generator already handed the container over.
+                        status['meta'].pop('container').close()
+                    break
+                if status['done']:
+                    self.result = status['meta']
+                    self._on_done(self.result)
+                self.updates.put(status)
+        except Exception as ex:
+            self.error = ex
+            self.updates.put({'error': ex, 'done': True})
+        finally:
+            self._statuses.close()  # closes the container if cancelled
+            self.done.set()
+
+    def _on_done(self, meta):
+        """Run on the job's thread before the final status is put."""
+        pass
+
+    def cancel(self, wait=True):
+        """Stop analyzing (the partial index is not saved)."""
+        self.cancelled = True
+        if wait:
+            self.done.wait()
+
+    def snapshot(self):
+        """Copy the partial index (safe while the job is running).
+
+        Returns:
+            dict: See indexed_prefix, or None if the job hasn't started
+                demuxing.
+        """
+        meta = self.meta
+        if meta is None:
+            return None
+        return indexed_prefix(meta, done=(self.result is not None))
+
+
+def indexed_prefix(meta, done=False):
+    """Copy the part of a (partial) index whose frame numbers are final.
+
+    Unless done, packet_pts only keeps frames before the second-to-last
+    keyframe found: later packets in decoding order may still have an
+    earlier pts (B-frames), which would change the number of the frames
+    after them.
+
+    Args:
+        meta (dict): The meta of a status of iter_analyze_video (it may
+            still be growing on another thread).
+        done (Optional[bool]): Whether meta is complete.
+
+    Returns:
+        dict: The meta without 'container'. A FrameReader can use it to
+            read frames in the indexed part of the video (see
+            FrameReader.set_index).
+    """
+    prefix = {key: (list(value) if isinstance(value, list) else value)
+              for key, value in meta.items() if key != 'container'}
+    # ^ (iframe_pts is copied before packet_pts, so packet_pts has every
+    #   packet before the keyframes copied)
+    if not done:
+        key_pts = [pts for pts in prefix['iframe_pts'] if pts is not None]
+        end = key_pts[-2] if len(key_pts) > 1 else None
+        prefix['packet_pts'] = [
+            pts for pts in prefix['packet_pts']
+            if (end is not None) and (pts is not None) and (pts < end)]
+    return prefix
+
+
+class KeyframeDecodeWorker:
+    """Save keyframe packets as JPEGs on a thread, while demuxing.
+
+    Pass put as on_keyframe to analyze_video so the file is only read
+    once. Keyframes are intra-coded, so a separate decoder can decode
+    them without the packets between them.
+
+    Args:
+        cache_path (str): The directory (see cache_keyframes).
+        max_queued (Optional[int]): Packets to queue before demuxing
+            waits for decoding (to limit memory use).
+    """
+    def __init__(self, cache_path, max_queued=16, quality=80):
+        self.cache_path = cache_path
+        self.quality = quality
+        self.packets = Queue(maxsize=max_queued)
+        self.codec_context = None
+        self.saved_count = 0
+        self.error = None
+        self._encoders = ThreadPoolExecutor(max_workers=2)
+        self._futures = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, packet):
+        if (packet.pts is None) or (packet.size < 1):
+            return
+        if os.path.isfile(keyframe_path(self.cache_path, packet.pts)):
+            return  # skip it before decoding
+        if self.codec_context is None:
+            source = packet.stream.codec_context
+            self.codec_context = av.CodecContext.create(source.name, 'r')
+            if source.extradata:
+                self.codec_context.extradata = source.extradata
+        self.packets.put(packet)
+
+    def _save(self, frames):
+        for frame in frames:
+            if frame.pts is None:
+                continue
+            self._futures.append(self._encoders.submit(
+                frame.to_image().save,
+                keyframe_path(self.cache_path, frame.pts),
+                quality=self.quality,
+            ))
+
+    def _run(self):
+        while True:
+            packet = self.packets.get()
+            if packet is None:
+                break
+            if self.error is not None:
+                continue  # drain the queue so demuxing doesn't block
+            try:
+                self._save(self.codec_context.decode(packet))
+            except av.error.FFmpegError as ex:
+                self.error = ex
+        if (self.codec_context is not None) and (self.error is None):
+            try:
+                self._save(self.codec_context.decode(None))  # flush
+            except av.error.FFmpegError as ex:
+                self.error = ex
+
+    def finish(self):
+        """Wait for all queued keyframes to be saved.
+
+        Returns:
+            int: The number of keyframes saved.
+
+        Raises:
+            Exception: The first decoding or saving error, if any.
+        """
+        self.packets.put(None)
+        self._thread.join()
+        self._encoders.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+            self.saved_count += 1
+        self._futures = []
+        if self.error is not None:
+            raise self.error
+        return self.saved_count
+
+
+def analyze_and_cache_video(video_path, callback, use_cache=True):
+    """Run analyze_video and cache_keyframes in one pass over the file.
+
+    If there is a valid index (see analyze_video), only keyframes not
+    yet cached are decoded (see cache_keyframes). Otherwise keyframe
+    packets found while demuxing are decoded by a KeyframeDecodeWorker.
+
+    Returns:
+        tuple: The meta from analyze_video (including 'container') and
+            the cache directory.
+    """
+    cache_path = video_path + "_rotocanvas"
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    if use_cache and (load_index(video_path) is not None):
+        meta = analyze_video(video_path, callback)
+        cache_keyframes(video_path, meta=meta)
+        return meta, cache_path
+    worker = KeyframeDecodeWorker(cache_path)
+    try:
+        meta = analyze_video(video_path, callback, use_cache=use_cache,
+                             on_keyframe=worker.put)
+    finally:
+        worker.finish()
+    return meta, cache_path
+
+
+def decode_first_frame(video_path):
+    """Decode only the first frame (frame 0) of a video.
+
+    Returns:
+        CachedFrame: The frame, or None if the video has no frames.
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        for frame in container.decode(stream):
+            return CachedFrame.from_av_frame(frame)
+    return None
+
+
+class OpenVideoJob(AnalyzeJob):
+    """Open a video on a thread, like analyze_and_cache_video.
+
+    Frame 0 is decoded first and put in the cache (and in updates as
+    {'first_frame': CachedFrame, 'done': False}) so it can be shown
+    while the video is indexed. The final status's meta (also result)
+    has no 'container'. Keyframes are cached after that (see
+    keyframes_done), since reading frames doesn't need them.
+
+    Args:
+        video_path (str): The video file.
+        cache (Optional[FrameCache]): Where to put frame 0.
+        use_cache (Optional[bool]): See analyze_video.
+        interval (Optional[float]): Seconds between statuses.
+    """
+    def __init__(self, video_path, cache=None, use_cache=True,
+                 interval=.25):
+        self.cache = cache
+        self.use_cache = use_cache
+        self.cache_path = video_path + "_rotocanvas"
+        self.worker = None  # KeyframeDecodeWorker if not indexed yet
+        self.keyframes_done = threading.Event()
+        self.keyframe_error = None
+        AnalyzeJob.__init__(self, video_path, use_cache=use_cache,
+                            on_keyframe=self._on_keyframe,
+                            interval=interval)
+
+    def _on_keyframe(self, packet):
+        if self.worker is not None:
+            self.worker.put(packet)
+
+    def _run(self):
+        try:
+            self._show_first_frame()
+            if not os.path.isdir(self.cache_path):
+                os.makedirs(self.cache_path)
+            if not (self.use_cache
+                    and (load_index(self.video_path) is not None)):
+                self.worker = KeyframeDecodeWorker(self.cache_path)
+        except Exception as ex:
+            self.error = ex
+            self.updates.put({'error': ex, 'done': True})
+            self._statuses.close()
+            self.done.set()
+            self.keyframes_done.set()
+            return
+        AnalyzeJob._run(self)
+        try:
+            if self.worker is not None:
+                self.worker.finish()
+            elif (self.result is not None) and (not self.cancelled):
+                cache_keyframes(self.video_path, meta=self.result)
+        except Exception as ex:
+            self.keyframe_error = ex
+            logger.warning("[OpenVideoJob] Caching keyframes failed: {}"
+                           .format(ex))
+        finally:
+            self.keyframes_done.set()
+
+    def _show_first_frame(self):
+        frame = None
+        if (self.cache is not None) and ((self.video_path, 0) in self.cache):
+            frame = self.cache.get(self.video_path, 0)  # may be evicted
+        if frame is None:
+            frame = decode_first_frame(self.video_path)
+            if frame is None:
+                return
+            if self.cache is not None:
+                self.cache.put(self.video_path, 0, frame)
+        self.updates.put({'first_frame': frame, 'done': False})
+
+    def _on_done(self, meta):
+        meta.pop('container').close()
+
+
+class FrameReader:
+    """Decode exact frames by number using the index from analyze_video.
+
+    A frame number is mapped to its pts (the sorted packet_pts), then
+    to the keyframe at or before it. Reading the next frame (or any
+    frame before the next keyframe) continues decoding from the current
+    position instead of seeking, and the most recent frames are kept so
+    stepping back by a few frames is free.
+
+    Args:
+        video_path (str): The video file.
+        meta (Optional[dict]): The result of analyze_video (its
+            'container' is not used). If None, analyze_video is called.
+        history (Optional[int]): How many recently decoded frames to keep.
+    """
+    def __init__(self, video_path, meta=None, history=8):
+        if meta is None:
+            meta = analyze_video(video_path, lambda status: None)
+            meta.pop('container').close()
+        self.video_path = video_path
+        self.source = video_path  # FrameCache key
+        self.frame_pts = []
+        self.set_index(meta)
+        self.container = av.open(video_path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self._frames = None  # decoder iterator (None until first seek)
+        self._last_pts = None  # pts of the last frame from self._frames
+        self.recent = deque(maxlen=history)  # (index, frame) pairs
+        self.seek_count = 0
+        self.decoded_count = 0
+        # How many frames decoding forward costs about as much as a seek:
+        self.seek_cost_frames = 8
+
+    @property
+    def frame_count(self):
+        return len(self.frame_pts)
+
+    def set_index(self, meta):
+        """Use a newer index of the same video.
+
+        This is safe while another thread reads frames, as long as the
+        new index only adds frames after the old ones (such as each
+        AnalyzeJob.snapshot while the video is indexed).
+        """
+        frame_pts = sorted(pts for pts in meta['packet_pts']
+                           if pts is not None)
+        key_pts = sorted(pts for pts in meta['iframe_pts']
+                         if pts is not None)
+        # Set frame_pts last so frame_count never exceeds the lookups:
+        self._pts_index = {pts: i for i, pts in enumerate(frame_pts)}
+        self.key_pts = key_pts
+        self.frame_pts = frame_pts
+
+    def _key_pts_for(self, pts):
+        i = bisect_right(self.key_pts, pts) - 1
+        if i < 0:
+            return None
+        return self.key_pts[i]
+
+    def _can_continue_to(self, pts):
+        if (self._frames is None) or (self._last_pts is None):
+            return False
+        if self._last_pts >= pts:
+            return False
+        key_pts = self._key_pts_for(pts)
+        if (key_pts is None) or (key_pts <= self._last_pts):
+            return True  # seeking would decode the same frames again
+        # Seek only if it skips enough frames to pay for the seek:
+        target = self._pts_index[pts]
+        last = bisect_right(self.frame_pts, self._last_pts) - 1
+        key = self._pts_index.get(key_pts, target)
+        return (target - last) <= (target - key) + self.seek_cost_frames
+
+    def _seek(self, pts):
+        key_pts = self._key_pts_for(pts)
+        if key_pts is None:
+            key_pts = self.frame_pts[0]
+        self.container.seek(key_pts, backward=True, any_frame=False,
+                            stream=self.stream)
+        self._frames = self.container.decode(self.stream)
+        self._last_pts = None
+        self.seek_count += 1
+
+    def get_frame(self, index):
+        """Get an av.VideoFrame by 0-based frame number.
+
+        Raises:
+            IndexError: If index is not from 0 to frame_count - 1.
+        """
+        if (index < 0) or (index >= self.frame_count):
+            raise IndexError("frame {} is not in 0 to {}"
+                             .format(index, self.frame_count - 1))
+        for recent_index, frame in self.recent:
+            if recent_index == index:
+                return frame
+        pts = self.frame_pts[index]
+        if not self._can_continue_to(pts):
+            self._seek(pts)
+        for frame in self._frames:
+            self.decoded_count += 1
+            if frame.pts is None:
+                continue
+            self._last_pts = frame.pts
+            frame_index = self._pts_index.get(frame.pts)
+            if frame_index is not None:
+                self.recent.append((frame_index, frame))
+            if frame.pts >= pts:
+                if frame.pts != pts:
+                    logger.warning(
+                        "[FrameReader] Frame {} (pts {}) was not decoded."
+                        " Using pts {} instead."
+                        .format(index, pts, frame.pts))
+                return frame
+        self._frames = None
+        raise EOFError("frame {} (pts {}) could not be decoded"
+                       .format(index, pts))
+
+    def get_cached_frame(self, index):
+        """Get a frame as a CachedFrame (see get_frame)."""
+        return CachedFrame.from_av_frame(self.get_frame(index))
+
+    def close(self):
+        self._frames = None
+        self.recent.clear()
+        self.container.close()
+
+
+def extract_frames(video_path, frames, meta=None, quality=95,
+                   callback=None):
+    """Save specific frames of a video as images in one pass.
+
+    The frames are decoded in order using one FrameReader, so nearby
+    frames are decoded in a single forward pass and distant ones only
+    seek to their keyframe (see FrameReader.seek_cost_frames).
+
+    Args:
+        video_path (str): The video file.
+        frames (list[tuple]): (frame number, output path) pairs. The
+            format is from the extension of each path.
+        meta (Optional[dict]): The result of analyze_video.
+        quality (Optional[int]): JPEG quality (if saving as JPEG).
+        callback (Optional[Callable]): Called with a dict containing
+            'ratio' and 'path' after each image is saved.
+
+    Returns:
+        int: The number of frames decoded (including frames decoded
+            only to reach a requested frame).
+    """
+    reader = FrameReader(video_path, meta=meta)
+    decoded = 0
+    try:
+        ordered = sorted(frames, key=lambda pair: pair[0])
+        for i, (index, path) in enumerate(ordered):
+            image = reader.get_frame(index).to_image()
+            ext = os.path.splitext(path)[1].lower()
+            if ext in (".jpg", ".jpeg", ".jpe"):
+                image.save(path, quality=quality)
+            else:
+                image.save(path)
+            if callback is not None:
+                callback({'ratio': (i + 1) / len(ordered), 'path': path})
+        decoded = reader.decoded_count
+    finally:
+        reader.close()
+    return decoded
+
+
+PROXY_VERSION = 1
+PROXY_MANIFEST = "manifest.json"
+PROXY_NAME_FMT = "{:06d}.jpg"  # by frame number (not pts)
+
+
+def proxy_path_for(video_path):
+    """Get the directory of the proxy frames (see make_proxy)."""
+    return video_path + "_rotocanvas_proxy"
+
+
+def _fingerprint_json(fingerprint):
+    size, mtime_ns, digest = fingerprint
+    return [size, mtime_ns, digest.hex()]
+
+
+def load_proxy_manifest(video_path, fingerprint=None):
+    """Get the manifest of a complete, up-to-date proxy, else None."""
+    path = os.path.join(proxy_path_for(video_path), PROXY_MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    if fingerprint is None:
+        fingerprint = file_fingerprint(video_path)
+    try:
+        with open(path, 'r') as stream:
+            manifest = json.load(stream)
+    except ValueError as ex:
+        logger.warning("Ignoring bad proxy manifest \"{}\": {}"
+                       .format(path, ex))
+        return None
+    if manifest.get('version') != PROXY_VERSION:
+        return None
+    if manifest.get('source') != _fingerprint_json(fingerprint):
+        return None
+    if not manifest.get('complete'):
+        return None
+    return manifest
+
+
+def make_proxy(video_path, meta=None, max_height=360, quality=75,
+               callback=None, is_cancelled=None):
+    """Transcode a video to a reduced-size, all-intra proxy.
+
+    Each frame is saved as a JPEG named by its 0-based frame number
+    (using FrameReader so numbers match get_frame exactly), so any frame
+    can be shown without decoding others. The manifest is only marked
+    complete at the end, so an interrupted proxy is never used.
+
+    Args:
+        video_path (str): The video file.
+        meta (Optional[dict]): The result of analyze_video.
+        max_height (Optional[int]): Frames taller than this are scaled
+            down (keeping the aspect ratio).
+        quality (Optional[int]): JPEG quality.
+        callback (Optional[Callable]): Called with a dict containing
+            'ratio' to report progress.
+        is_cancelled (Optional[Callable]): Stop early if this returns
+            True.
+
+    Returns:
+        str: The proxy directory, or None if cancelled.
+    """
+    fingerprint = file_fingerprint(video_path)
+    proxy_path = proxy_path_for(video_path)
+    if load_proxy_manifest(video_path, fingerprint=fingerprint) is not None:
+        return proxy_path
+    if os.path.isdir(proxy_path):
+        shutil.rmtree(proxy_path)  # stale (the source changed) or partial
+    os.makedirs(proxy_path)
+    reader = FrameReader(video_path, meta=meta)
+    manifest = {
+        'version': PROXY_VERSION,
+        'source': _fingerprint_json(fingerprint),
+        'frame_count': reader.frame_count,
+        'size': None,  # proxy size
+        'source_size': None,
+        'complete': False,
+    }
+    update_time = None
+    try:
+        for index in range(reader.frame_count):
+            if is_cancelled is not None and is_cancelled():
+                return None
+            image = reader.get_frame(index).to_image()
+            if manifest['source_size'] is None:
+                manifest['source_size'] = list(image.size)
+            if image.height > max_height:
+                width = max(1, int(round(
+                    image.width * max_height / image.height)))
+                image = image.resize((width, max_height))
+            manifest['size'] = list(image.size)
+            image.save(os.path.join(proxy_path, PROXY_NAME_FMT.format(index)),
+                       quality=quality)
+            if callback is not None:
+                if update_time is None or time.time() - update_time > 1:
+                    callback({'ratio': index / reader.frame_count})
+                    update_time = time.time()
+    finally:
+        reader.close()
+    manifest['complete'] = True
+    tmp_path = os.path.join(proxy_path, PROXY_MANIFEST + ".tmp")
+    with open(tmp_path, 'w') as stream:
+        json.dump(manifest, stream)
+    os.replace(tmp_path, os.path.join(proxy_path, PROXY_MANIFEST))
+    if callback is not None:
+        callback({'ratio': 1.0})
+    return proxy_path
+
+
+class ProxyReader:
+    """Read frames of a proxy made by make_proxy.
+
+    It has the same get_cached_frame and frame_count as FrameReader,
+    but frames are a reduced size (for scrubbing, not painting).
+
+    Raises:
+        FileNotFoundError: If there is no complete, up-to-date proxy.
+    """
+    def __init__(self, video_path):
+        self.manifest = load_proxy_manifest(video_path)
+        if self.manifest is None:
+            raise FileNotFoundError("There is no up-to-date proxy for \"{}\""
+                                    .format(video_path))
+        self.video_path = video_path
+        self.proxy_path = proxy_path_for(video_path)
+        self.source = self.proxy_path  # FrameCache key
+
+    @property
+    def frame_count(self):
+        return self.manifest['frame_count']
+
+    def get_cached_frame(self, index):
+        if (index < 0) or (index >= self.frame_count):
+            raise IndexError("frame {} is not in 0 to {}"
+                             .format(index, self.frame_count - 1))
+        from PIL import Image
+        path = os.path.join(self.proxy_path, PROXY_NAME_FMT.format(index))
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            return CachedFrame(image.tobytes(), image.size)
+
+    def close(self):
+        pass
+
+
+class FramePrefetcher:
+    """Decode frames around the playhead into a FrameCache on a thread.
+
+    The worker owns its own FrameReader, so only the worker thread
+    decodes. Call request whenever the playhead moves: work for the
+    previous request is abandoned after the frame being decoded. The
+    number of each frame added to the cache is put in the ready queue
+    so a GUI can poll it (for example, using Tk's after) instead of
+    being called from the worker thread.
+
+    Args:
+        video_path (str): The video file.
+        cache (FrameCache): Where to put decoded frames.
+        meta (Optional[dict]): The result of analyze_video.
+        ahead (Optional[int]): Frames to decode after the playhead.
+        behind (Optional[int]): Frames to decode before the playhead.
+        reader (Optional[Union[FrameReader,ProxyReader]]): What to
+            decode from (the prefetcher takes ownership). Defaults to a
+            new FrameReader of video_path. The cache key is its source.
+    """
+    def __init__(self, video_path, cache, meta=None, ahead=12, behind=3,
+                 reader=None):
+        self.video_path = video_path
+        self.cache = cache
+        self.ahead = ahead
+        self.behind = behind
+        if reader is None:
+            reader = FrameReader(video_path, meta=meta)
+        self.reader = reader
+        self.source = reader.source
+        self.ready = Queue()
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._playhead = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def frame_count(self):
+        return self.reader.frame_count
+
+    def set_index(self, meta):
+        """Extend the reader's index (see FrameReader.set_index)."""
+        self.reader.set_index(meta)
+        with self._condition:
+            # Prefetch frames that weren't indexed at the last request:
+            if self._playhead is not None:
+                self._generation += 1
+                self._condition.notify()
+
+    def request(self, index):
+        """Move the playhead and start prefetching around it."""
+        self.cache.set_playhead(self.source, index)
+        with self._condition:
+            self._generation += 1
+            self._playhead = index
+            self._condition.notify()
+
+    def is_current(self, generation):
+        return (generation == self._generation) and not self._stopped
+
+    def _wanted(self, index):
+        # The playhead first, then ahead (playback), then behind.
+        wanted = [index]
+        wanted += range(index + 1,
+                        min(index + self.ahead + 1, self.frame_count))
+        wanted += range(index - 1, max(index - self.behind - 1, -1), -1)
+        return wanted
+
+    def _run(self):
+        generation = 0  # wait for the first request
+        while True:
+            with self._condition:
+                while (not self._stopped) and (generation == self._generation):
+                    self._condition.wait()
+                if self._stopped:
+                    break
+                generation = self._generation
+                playhead = self._playhead
+            for index in self._wanted(playhead):
+                if not self.is_current(generation):
+                    break
+                if (self.source, index) in self.cache:
+                    continue
+                try:
+                    frame = self.reader.get_cached_frame(index)
+                except (EOFError, IndexError, OSError,
+                        av.error.FFmpegError) as ex:
+                    logger.warning("[FramePrefetcher] frame {}: {}"
+                                   .format(index, ex))
+                    continue
+                self.cache.put(self.source, index, frame)
+                self.ready.put(index)
+        self.reader.close()
+
+    def close(self):
+        """Stop the worker (it closes its reader when it finishes)."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import copy
 import os
 import sys
 import json
@@ -15,6 +16,11 @@ except ModuleNotFoundError:
 
 from rcsource import RCSource
 from rotocanvas import sysdirs
+from rotocanvas.overlaystore import OverlayStore
+from rotocanvas.projectstore import (
+    ProjectStore,
+    is_project_store,
+)
 
 
 class RCProject:
@@ -51,6 +57,11 @@ class RCProject:
         self._name = "Untitled_{}.rotocanvas".format(ts)
         self._dir = RCProject.VIDEOS
         self._meta = {}
+        self._savedMeta = {}  # _meta as of the last open or save
+        self._dirtyFrames = {}  # (vidPath, frame) -> record (None=delete)
+        self._dirtyLayers = {}  # (vidPath, frame, layer) -> image or None
+        self._store = None  # ProjectStore after open or save
+        self._overlays = None  # OverlayStore (see getOverlayStore)
         self._videos = {}
 
     def addVideo(self, vidPath, fpsStr):
@@ -74,19 +85,220 @@ class RCProject:
         return None
 
     def stop(self):
-        return "Not Yet Implemented"
+        """Stop batches (such as superResolutionAI) gracefully.
+
+        Frames in progress finish and every finished frame is
+        checkpointed in the batch's job manifest, so running the batch
+        again resumes it.
+
+        Returns:
+        error string or None
+        """
+        for video in self._videos.values():
+            video.stop()
+        return None
 
     def open(self, path):
+        """Open a project.
+
+        Only the project-wide settings are read now. Each frame's record
+        is read when needed (see getFrameData). A legacy (JSON) project
+        is converted when it is saved.
+        """
+        self.close()
         self.path = path
-        with open(self.path, 'r') as ins:
-            self._meta = json.load(ins)
+        self._dirtyFrames = {}
+        self._dirtyLayers = {}
+        if is_project_store(self.path):
+            self._store = ProjectStore(self.path)
+            self._meta = self._store.meta_items()
+            self._savedMeta = copy.deepcopy(self._meta)
+        else:
+            with open(self.path, 'r') as ins:
+                self._meta = json.load(ins)
+            self._savedMeta = {}  # write everything on save
+
+    def _openStore(self):
+        """Get the store at self.path (such as after Save As).
+
+        If another store is open, its saved data is copied. If a legacy
+        project is at the path, it is kept with the extension
+        ".json.bak".
+        """
+        if (self._store is not None) and (self._store.path == self.path):
+            return self._store
+        if os.path.isfile(self.path) and not is_project_store(self.path):
+            backup = self.path + ".json.bak"
+            os.replace(self.path, backup)
+            print("[rcproject.py] Moved the legacy project to \"{}\""
+                  .format(backup))
+        store = ProjectStore(self.path)
+        if self._store is not None:
+            if self._store.connection.in_transaction:
+                # backup waits forever for an open transaction, so keep
+                # writes made directly to the old store (see
+                # getOverlayStore):
+                self._store.commit()
+            self._store.connection.backup(store.connection)
+            self._store.close()
+        self._store = store
+        return store
 
     def save(self):
+        """Write only the settings and frames changed since the last save.
+
+        Returns:
+        error string or None
+        """
         if self._name is None:
             return "You have not set a path."
-        with open(self.path, 'w') as outs:
-            json.dump(self._meta, outs, indent=2, sort_keys=True)
+        store = self._openStore()
+        try:
+            for key, value in self._meta.items():
+                if self._savedMeta.get(key) != value:
+                    store.set_meta(key, value)
+            for key in self._savedMeta:
+                if key not in self._meta:
+                    store.delete_meta(key)
+            for (vidPath, frame), record in self._dirtyFrames.items():
+                if record is None:
+                    store.delete_frame(vidPath, frame)
+                else:
+                    store.put_frame(vidPath, frame, record)
+            if self._dirtyLayers:
+                overlays = self.getOverlayStore()
+                for (vidPath, frame, layer), image in \
+                        self._dirtyLayers.items():
+                    if image is None:
+                        overlays.delete_layer(vidPath, frame, layer)
+                    else:
+                        overlays.save_layer(vidPath, frame, layer, image)
+                overlays.collect_garbage()  # tiles of replaced layers
+            store.commit()
+        except Exception:
+            store.rollback()
+            raise
+        self._savedMeta = copy.deepcopy(self._meta)
+        self._dirtyFrames = {}
+        self._dirtyLayers = {}
         print("[rcproject.py] Saved \"{}\"".format(self.path))
+        return None
+
+    def getOverlayStore(self, create=True):
+        """Get the saved overlay layers of this project's frames.
+
+        To change layers, use setLayer (so nothing is written until
+        save). Layers saved directly in the OverlayStore are committed
+        on the next save (the file is created if the project is new).
+
+        Keyword arguments:
+        create - If False, return None instead of creating the file.
+
+        Returns:
+        OverlayStore or None
+        """
+        if (not create) and (self._store is None):
+            return None
+        store = self._openStore()
+        if (self._overlays is None) or (self._overlays.store is not store):
+            self._overlays = OverlayStore(store)
+        return self._overlays
+
+    def getLayer(self, vidPath, frame, layer):
+        """Get an overlay layer, including unsaved changes.
+
+        Returns:
+        PPTiledImage (or the image given to setLayer), or None if the
+        frame doesn't have the layer
+        """
+        key = (vidPath, frame, layer)
+        if key in self._dirtyLayers:
+            return self._dirtyLayers[key]
+        overlays = self.getOverlayStore(create=False)
+        if overlays is None:
+            return None
+        return overlays.load_layer(vidPath, frame, layer)
+
+    def setLayer(self, vidPath, frame, layer, image):
+        """Set an overlay layer of a frame (written on the next save).
+
+        Sequential arguments:
+        vidPath - the key of the RCSource (see addVideo)
+        frame - the frame number
+        layer - the layer name
+        image - a PPImage or PPTiledImage (kept, not copied, until the
+            save), or None to remove the layer
+        """
+        self._dirtyLayers[(vidPath, frame, layer)] = image
+
+    def getLayerNames(self, vidPath, frame):
+        """Get the names of a frame's layers, including unsaved ones."""
+        names = set()
+        overlays = self.getOverlayStore(create=False)
+        if overlays is not None:
+            names.update(overlays.layer_names(vidPath, frame))
+        for (source, number, layer), image in self._dirtyLayers.items():
+            if (source, number) != (vidPath, frame):
+                continue
+            if image is None:
+                names.discard(layer)
+            else:
+                names.add(layer)
+        return sorted(names)
+
+    def getLayerSettings(self, layer):
+        """Get how a layer is shown (see compositor.CompositeLayer).
+
+        Returns:
+        dict that may have 'opacity', 'blend' and 'visible' (from the
+        project's "layers" setting)
+        """
+        return dict(self._meta.get('layers', {}).get(layer, {}))
+
+    def close(self):
+        """Close the project file (unsaved changes are kept in memory).
+        """
+        self._overlays = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def getFrameData(self, vidPath, frame):
+        """Get the record (annotations and layers) of a frame.
+
+        Returns:
+        dict or None (if the frame has no record)
+        """
+        key = (vidPath, frame)
+        if key in self._dirtyFrames:
+            return self._dirtyFrames[key]
+        if self._store is None:
+            return None
+        return self._store.get_frame(vidPath, frame)
+
+    def setFrameData(self, vidPath, frame, record):
+        """Set the record of a frame (written on the next save).
+
+        Sequential arguments:
+        vidPath - the key of the RCSource (see addVideo)
+        frame - the frame number
+        record - a JSON-compatible dict, or None to remove the record
+        """
+        self._dirtyFrames[(vidPath, frame)] = record
+
+    def getFrameNumbers(self, vidPath):
+        """Get the numbers of frames that have records, in order."""
+        frames = set()
+        if self._store is not None:
+            frames.update(self._store.frame_numbers(vidPath))
+        for (source, frame), record in self._dirtyFrames.items():
+            if source != vidPath:
+                continue
+            if record is None:
+                frames.discard(frame)
+            else:
+                frames.add(frame)
+        return sorted(frames)
 
     @property
     def path(self):
@@ -1,81 +1,174 @@
 #!/usr/bin/env python
+import json
 import os
+import re
 import sys
 
-_opencv_tip = None
-
 from rotocanvas import (
     sysdirs,
 )
 
 
 class RCSettings:
-    def __init__(self):
+    """Find the tools and models that super resolution needs.
+
+    Discovery is lazy so importing rcsource (and starting the GUI) is
+    fast: OpenCV (including any opencvenv) is only probed on the first
+    opencv_enabled/assertOpenCV/thisPython use, and models are only
+    found on the first scalingModels use. Found models are saved to
+    configPath and reused while the files still exist.
+
+    Args:
+        configPath (Optional[str]): The JSON file for the found models.
+            Defaults to rcsettings.json in the rotocanvas config
+            directory (False to not save).
+        tryDirs (Optional[list[str]]): Directories to search for models.
+    """
+    tryModels = [["EDSR_x4.pb", 4], ["ESPCN_x4.pb", 4],
+                 ["FSRCNN_x3.pb", 3], ["LapSRN_x8.pb", 8]]
+
+    def __init__(self, configPath=None, tryDirs=None):
+        self.modulePath = os.path.join(
+            os.path.dirname(os.path.realpath(__file__))
+        )
+        self.thisSRPy = os.path.join(
+            self.modulePath,
+            "super_res_image_save.py"
+        )
+        self.thisScalePy = os.path.join(
+            self.modulePath,
+            "fix_ratio.py"
+        )
+        self.thisFFMpeg = "ffmpeg"
+        if configPath is None:
+            configPath = False
+            if sysdirs.get('APPDATA') is not None:
+                configPath = os.path.join(sysdirs['APPDATA'], "rotocanvas",
+                                          "rcsettings.json")
+        self.configPath = configPath
+        if tryDirs is None:
+            tryDirs = []
+            tryDirs.append(os.path.join("..", "..", "models"))
+            tryDirs.append(os.path.join(sysdirs['HOME'], "Videos",
+                                        "Demo_Reel", "media",
+                                        "super-resolution", "models"))
+        self.tryDirs = tryDirs
+        self._thisPython = None
+        self._enable_opencv = None  # None until probed
+        self._scalingModelsDir = None
+        self._scalingModels = None  # None until found
+
+    def _probeOpenCV(self):
         modulePath = os.path.dirname(os.path.realpath(__file__))
         repoPath = os.path.dirname(modulePath)
         reposPath = os.path.dirname(repoPath)  # repos
         parentPath = os.path.dirname(reposPath)  # even higher up
-        self.thisPython = "python"
+        self._thisPython = "python"
         self._enable_opencv = False
         tryLocal = os.path.join(sysdirs['HOME'], "Videos", "Demo_Reel",
                                 "media")
         if os.path.isdir(os.path.join(parentPath, "opencvenv")):
-            self.thisPython = os.path.join(reposPath, "opencvenv",
-                                           "bin", "python")
-            # print("Using python in virtual env for opencv: {}"
-            # #     "".format(self.thisPython))
+            self._thisPython = os.path.join(reposPath, "opencvenv",
+                                            "bin", "python")
             self._enable_opencv = True
         elif os.path.isdir(os.path.join(tryLocal, "opencvenv")):
-            self.thisPython = os.path.join(tryLocal, "opencvenv",
-                                           "bin", "python")
-            # print("Using python in virtual env for opencv: {}"
-            # #     "".format(self.thisPython))
+            self._thisPython = os.path.join(tryLocal, "opencvenv",
+                                            "bin", "python")
             self._enable_opencv = True
         else:
             try:
-                import cv2
+                import cv2  # noqa: F401
                 self._enable_opencv = True
             except ImportError:
                 print("Warning: No opencv")
-        self.modulePath = os.path.join(
-            os.path.dirname(os.path.realpath(__file__))
-        )
-        self.thisSRPy = os.path.join(
-            self.modulePath,
-            "super_res_image_save.py"
-        )
-        if not os.path.isfile(self.thisSRPy):
-            print("WARNING: Missing {}".format(self.thisSRPy))
-        self.thisScalePy = os.path.join(
-            self.modulePath,
-            "fix_ratio.py"
-        )
-        self.thisFFMpeg = "ffmpeg"
-        tryDirs = []
-        tryDirs.append(os.path.join("..", "..", "models"))
-        tryDirs.append(os.path.join(sysdirs['HOME'], "Videos", "Demo_Reel",
-                                    "media", "super-resolution", "models"))
-        self.scalingModelsDir = None
-        for tryDir in tryDirs:
+
+    @property
+    def thisPython(self):
+        if self._enable_opencv is None:
+            self._probeOpenCV()
+        return self._thisPython
+
+    @property
+    def scalingModelsDir(self):
+        if self._scalingModels is None:
+            self._findModels()
+        return self._scalingModelsDir
+
+    @property
+    def scalingModels(self):
+        """Get [path, multiplier] for each model found."""
+        if self._scalingModels is None:
+            self._findModels()
+        return self._scalingModels
+
+    def _findModels(self):
+        if not self._loadModels():
+            self.rescanModels()
+
+    def _loadModels(self):
+        """Use the models saved in configPath if they still exist.
+
+        Returns:
+            bool: True if saved models were used.
+        """
+        if (not self.configPath) or (not os.path.isfile(self.configPath)):
+            return False
+        try:
+            with open(self.configPath, 'r') as stream:
+                config = json.load(stream)
+        except ValueError as ex:
+            print("WARNING: {} is not valid JSON, so models will be"
+                  " found again: {}".format(self.configPath, ex))
+            return False
+        models = config.get('scalingModels')
+        if not models:
+            return False
+        for path, _ in models:
+            if not os.path.isfile(path):
+                return False
+        self._scalingModelsDir = config.get('scalingModelsDir')
+        self._scalingModels = models
+        return True
+
+    def _saveModels(self):
+        if not self.configPath:
+            return
+        configsDir = os.path.dirname(self.configPath)
+        if not os.path.isdir(configsDir):
+            os.makedirs(configsDir)
+        config = {
+            'scalingModelsDir': self._scalingModelsDir,
+            'scalingModels': self._scalingModels,
+        }
+        tmp = self.configPath + ".tmp"
+        with open(tmp, 'w') as stream:
+            json.dump(config, stream, indent=2)
+        os.replace(tmp, self.configPath)
+
+    def rescanModels(self):
+        """Search tryDirs for models (even if some were saved)."""
+        self._scalingModelsDir = None
+        for tryDir in self.tryDirs:
             if os.path.isdir(tryDir):
-                self.scalingModelsDir = os.path.realpath(tryDir)
-        if self.scalingModelsDir is None:
-            self.scalingModelsDir = os.path.realpath("models")
-            if not os.path.isdir(self.scalingModelsDir):
+                self._scalingModelsDir = os.path.realpath(tryDir)
+        if self._scalingModelsDir is None:
+            self._scalingModelsDir = os.path.realpath("models")
+            if not os.path.isdir(self._scalingModelsDir):
                 print("WARNING: {} wasn't present, place them there or"
-                      " in {}".format(tryDir, self.scalingModelsDir))
-        self.scalingModels = []
-        tryModels = [["EDSR_x4.pb", 4], ["ESPCN_x4.pb", 4],
-                     ["FSRCNN_x3.pb", 3], ["LapSRN_x8.pb", 8]]
-        for tryModel in tryModels:
-            tryPath = os.path.join(self.scalingModelsDir, tryModel[0])
+                      " in {}".format(self.tryDirs,
+                                      self._scalingModelsDir))
+        self._scalingModels = []
+        for tryModel in RCSettings.tryModels:
+            tryPath = os.path.join(self._scalingModelsDir, tryModel[0])
             if os.path.isfile(tryPath):
-                self.scalingModels.append([tryPath, tryModel[1]])
+                self._scalingModels.append([tryPath, tryModel[1]])
                 print("- found scaling model: {}".format(tryModel[0]))
-        if len(self.scalingModels) < 1:
-            modelNames = [model[0] for model in tryModels]
+        if len(self._scalingModels) < 1:
+            modelNames = [model[0] for model in RCSettings.tryModels]
             print("WARNING: 0 models were found in {} (tried {})"
-                  "".format(self.scalingModelsDir, modelNames))
+                  "".format(self._scalingModelsDir, modelNames))
+        else:
+            self._saveModels()
         # The above correspond to the following commands
         # where
         # PY=./opencvenv/python
@@ -88,26 +181,56 @@ class RCSettings:
         # $PY $CMD --model models/LapSRN_x8.pb --image \
         #   examples/zebra.png
 
-    def addModel(self, path):
+    def addModel(self, path, multiplier=None):
+        """Add a model (and save it to configPath).
+
+        Args:
+            path (str): The model file.
+            multiplier (Optional[int]): The scale. If None, get it from
+                the name (such as 4 for EDSR_x4.pb).
+        """
         if not os.path.isfile(path):
             raise ValueError("The path for addModel isn't a file or"
                              " doesn't exist: {}".format(path))
-        self.scalingModels.append(path)
+        if multiplier is None:
+            match = re.search(r"_x(\d+)$",
+                              os.path.splitext(os.path.basename(path))[0])
+            if match is None:
+                raise ValueError("The scale isn't in the name (such as"
+                                 " EDSR_x4.pb) so specify multiplier: {}"
+                                 .format(path))
+            multiplier = int(match.group(1))
+        self.scalingModels.append([path, multiplier])
+        self._saveModels()
 
     def assertOpenCV(self):
-        if not self._enable_opencv:
+        if not self.opencv_enabled():
             if not os.path.isfile(self.thisPython):
-                raise AssertionError(_opencv_tip)
+                raise AssertionError(opencv_tip())
 
     def opencv_enabled(self):
+        if self._enable_opencv is None:
+            self._probeOpenCV()
         return self._enable_opencv
 
 
 settings = RCSettings()
 
-_opencv_tip = (
-    "You must first install opencv-python available to {}"
-    " or in a virtual environment"
-    " at {} (Then restart the program)"
-    .format(sys.executable, settings.thisPython)
-)
+
+def opencv_tip():
+    """Get instructions for installing OpenCV."""
+    how = [
+        "python3 -m venv opencvenv",
+        "source ./opencvenv/bin/activate",
+        "pip install --upgrade pip setuptools wheel",
+        "pip install opencv-python",
+        "pip install opencv-contrib-python  # dnn_superres etc",
+        "# (you still need the binary version of opencv on your system)",
+    ]
+    return (
+        "You must first install opencv-python available to {}"
+        " or in a virtual environment"
+        " at {} (Then restart the program), such as you can create via:"
+        "\n    {}"
+        .format(sys.executable, settings.thisPython, "\n    ".join(how))
+    )
@@ -4,7 +4,7 @@ import os
 import sys
 import subprocess
 import shutil
-import time
+import threading
 myName = "rcsource.py"
 try:
     from rcsettings import settings
@@ -17,36 +17,15 @@ except ModuleNotFoundError:
 from ffmpegtime import FFMPEGTime  # noqa: E402
 from util import split_frame_name  # noqa: E402
 from util import get_frame_name  # noqa: E402
-opencv_enabled = False
-
-from rotocanvas import (
-    sysdirs,
-)
+from util import get_sequence_index  # noqa: E402
 
+ENABLE_AV = False
 try:
-    import cv2
-    opencv_enabled = True
+    import av  # noqa: F401
+    from rotocanvas import rc_av
+    ENABLE_AV = True
 except ImportError:
-    whereMsg = ""
-    how = [
-        ":"
-        "python3 -m venv opencvenv",
-        "source ./opencvenv/bin/activate",
-        "pip install --upgrade pip setuptools wheel",
-        "pip install opencv-python",
-        "pip install opencv-contrib-python  # dnn_superres etc",
-        "# (you still need the binary version of opencv on your system)",
-    ]
-    tryPath = os.path.join(sysdirs['HOME'], "Videos", "Demo_Reel",
-                           "media", "opencvenv", "bin", "python3")
-    if os.path.isfile(tryPath):
-        whereMsg = " such as running via \"{}\"".format(tryPath)
-    else:
-        whereMsg = " such as you can create via" + "\n    ".join(how)
-    sys.stderr.write("WARNING: To use OpenCV you must install OpenCV"
-                     " for Python or use a venv with OpenCV{}.\n"
-                     "".format(whereMsg))
-    # exit(1)
+    rc_av = None
 
 
 class RCSource:
@@ -109,11 +88,22 @@ class RCSource:
 
         self._vidPathNoExt = os.path.splitext(vidPath)[0]
         self.fpsStr = fpsStr
+        self.stopEvent = threading.Event()
+
+    def stop(self):
+        """Stop superResolutionAI after the frames in progress.
+
+        Finished frames are already recorded in the job manifest, so
+        running superResolutionAI again resumes the batch.
+        """
+        self.stopEvent.set()
 
     @property
     def vidPath(self):
-        frame = self._first if self._first is not None else ""
-        return self._vidPathNoExt + frame + self._ext
+        """The source file (for an image sequence, the frame given)."""
+        if self._ext is None:
+            return self._vidPathNoExt
+        return self._vidPathNoExt + "." + self._ext
 
     def isImageSequence(self):
         if (self._first is None) and (self._ext in self._extensions):
@@ -131,11 +121,24 @@ class RCSource:
                                  "".format(len(parts), self.fpsStr))
             return float(parts[0]) / float(parts[1])
 
+    def getSequenceIndex(self):
+        """Get the (cached) SequenceIndex of this image sequence.
+
+        Returns:
+            SequenceIndex: The frames with this source's prefix and
+                extension (refreshed only if the directory changed), or
+                None if this is not an image sequence.
+        """
+        if self._first is None:
+            return None
+        return get_sequence_index(self._dir, prefix=self._prefix,
+                                  extensions=[self._ext])
+
     def getAllFrameNumbers(self):
-        if self._first is not None:
-            raise NotImplementedError("getAllFrameNumbers is only"
-                                      " implemented for single images")
-        return [None]
+        if self._first is None:
+            # single image
+            return [None]
+        return list(self.getSequenceIndex().frames)
 
     def getFrameName(self, thisFrame, minDigits):
         if self._first is None:
@@ -150,7 +153,8 @@ class RCSource:
     def superResolutionAI(self, onlyTimes=None, forceRatio=None,
                           outFmt="jpg", qscale_v=2, minDigits=None,
                           preserveDim=1, organizeMode=0,
-                          onlyFrames=None):
+                          onlyFrames=None, workers=None, tileSize=None,
+                          tileOverlap=16, tileWorkers=1):
         """Perform AI super-resolution on all frames.
         Args:
             onlyFrames (Optional[list[str]]): If not None, extract only
@@ -165,7 +169,9 @@ class RCSource:
                 according to llogan on
                 <https://stackoverflow.com/questions/10225403/
                 how-can-i-extract-a-good-quality-jpeg-image-from-a-video-
-                file-with-ffmpeg> edited Sep 24 at 22:20.
+                file-with-ffmpeg> edited Sep 24 at 22:20. If PyAV
+                extracts the frames instead, it is converted to a
+                similar JPEG quality.
             _minDigits (Optional[int]): This is the image sequence
                 minimum digits (only for image output). This should take
                 the length of the video. For example, a 4hr video has
@@ -183,11 +189,24 @@ class RCSource:
                 2, place all files of the same frame in the same
                 directory. Pass a RCSource.ORGANIZE_* constant for
                 clarity.
+            workers (Optional[int]): How many processes upscale frames
+                in parallel (see rcupscale.upscale_files).
+            tileSize (Optional[int]): If not None, upscale each frame in
+                overlapping tiles of at most this many input pixels
+                square so memory use fits on smaller machines (the
+                model's memory use grows with the tile area).
+            tileOverlap (Optional[int]): Input pixels each tile overlaps
+                its neighbors (blended to hide the seams).
+            tileWorkers (Optional[int]): Tiles of one frame to upscale
+                at once (multiplies memory use).
         """
         if minDigits is None:
             if self._minDigits is not None:
                 minDigits = self._minDigits
         settings.assertOpenCV()
+        # Import these here since they import OpenCV (slow to import):
+        from rcupscale import JobManifest, upscale_files
+        from fix_ratio import ratio_stage
         dimNumbers = (0, 1)
         if preserveDim not in dimNumbers:
             raise RuntimeError("Only 0 (width) and 1 (height) are video"
@@ -211,29 +230,16 @@ class RCSource:
             # FRAMES
             atList = onlyFrames
         else:
-            p = os.path.dirname(self.vidPath)
-            lde = ["." + ext.lower() for ext in self._extensions]
-            atList = []
-            for sub in os.listdir(p):
-                if not sub.startswith(self._prefix):
-                    continue
-                if sub.lower() not in lde:
-                    continue
-                pre, frameS, de = split_frame_name(sub)
-                atList.append(int(frameS))
             # ENTIRE
-            # TODO: make a new iterable (iterate frames in image list)
+            # TODO: make a new iterable (iterate frames in video)
+            atList = []
             if self.isImageSequence():
-                # TODO: create onlyFrames based on times!
-                if onlyFrames is not None:
-                    onlyTimes = onlyFrames
-                    raise NotImplementedError("A time list isn't"
-                                              " implemented for images"
-                                              ".")
-                else:
-                    atList = self.getAllFrameNumbers()
+                atList = self.getAllFrameNumbers()
         # framesPath = os.path.join(self._dir)
         print("[sr] isImageSequence: {}".format(self.isImageSequence()))
+        jobs = []  # (model, originalPath, mOutPath) for upscale_files
+        toExtract = []  # (frame number, originalPath) for extract_frames
+        jobFrames = []  # frame number of each job (for the manifest)
         for atS in atList:
             timeStr = None
             if self.isImageSequence():
@@ -280,25 +286,33 @@ class RCSource:
                 # extract by frame number:
                 #   ffmpeg -i in.mp4 -vf select='eq(n\,100)+eq(n\,184)+eq(n\,213)'  # noqa: E501
                 #     -vsync 0 frames%d.jpg
-                cmdParts = [self.thisFFMpeg, "-y", "-i", self.vidPath, "-ss",
-                            timeStr, "-vframes", "1"]
-                oFLower = outFmt.lower()
-                if (oFLower == "jpg") or (oFLower == "jpeg"):
-                    cmdParts.append("-qscale:v")
-                    cmdParts.append(str(qscale_v))
-                cmdParts.append(outPath)
-                subprocess.check_output(cmdParts)
-                print('* wrote "{}"'.format(outPath))
-
                 originalsDir = os.path.join(outDir, "originals")
                 if not os.path.isdir(originalsDir):
                     os.makedirs(originalsDir)
                 originalPath = os.path.join(originalsDir, outName)
-                shutil.move(outPath, originalPath)
+                if ENABLE_AV:
+                    # Extract all frames in one pass after this loop.
+                    toExtract.append((int(thisFrame), originalPath))
+                else:
+                    cmdParts = [settings.thisFFMpeg, "-y", "-ss", timeStr,
+                                "-i", self.vidPath, "-vframes", "1"]
+                    # ^ -ss before -i seeks instead of decoding up to it
+                    oFLower = outFmt.lower()
+                    if (oFLower == "jpg") or (oFLower == "jpeg"):
+                        cmdParts.append("-qscale:v")
+                        cmdParts.append(str(qscale_v))
+                    cmdParts.append(outPath)
+                    subprocess.check_output(cmdParts)
+                    print('* wrote "{}"'.format(outPath))
+                    shutil.move(outPath, originalPath)
             else:
-                frameName = self.getFrameName(thisFrame, minDigits)
-
-                originalPath = os.path.join(self._dir, frameName)
+                originalPath = None
+                index = self.getSequenceIndex()
+                if index is not None:
+                    originalPath = index.get_path(thisFrame)
+                if originalPath is None:
+                    frameName = self.getFrameName(thisFrame, minDigits)
+                    originalPath = os.path.join(self._dir, frameName)
             print("originalPath: {}".format(originalPath))
             print("outDir: {}".format(outDir))
             print("outPath: {}".format(outPath))
@@ -306,7 +320,8 @@ class RCSource:
                 raise RuntimeError("[{}] * failed to generate a"
                                    " different filename from the"
                                    " original.".format(myName))
-            if not os.path.isfile(originalPath):
+            deferred = toExtract and (toExtract[-1][1] == originalPath)
+            if (not deferred) and (not os.path.isfile(originalPath)):
                 raise ValueError("{} does not exist."
                                  "".format(originalPath))
             for model, multiplier in settings.scalingModels:
@@ -340,56 +355,50 @@ class RCSource:
                                      "".format(organizeMode))
                 if not os.path.isdir(mOutDir):
                     os.makedirs(mOutDir)
-                print("* upscaling as {}...".format(mOutPath))
-                """
-                srCmdParts = [settings.thisPython, settings.thisSRPy,
-                              "--model",
-                              model, "--image", originalPath,
-                              "--output", mOutPath]
-                subprocess.check_output(srCmdParts)
-                """
-                # extract the model name and model scale from the file path
-                modelName = model.split(os.path.sep)[-1].split("_")[0].lower()
-                modelScale = model.split("_x")[-1]
-                modelScale = int(modelScale[:modelScale.find(".")])
-                print("[INFO] loading super resolution model: {}"
-                      "".format(model))
-                print("[INFO] model name: {}".format(modelName))
-                print("[INFO] model scale: {}".format(modelScale))
-                sr = cv2.dnn_superres.DnnSuperResImpl_create()
-                sr.readModel(model)
-                sr.setModel(modelName, modelScale)
-                image = cv2.imread(originalPath)
-                outPath = mOutPath
-                print("[INFO] w: {}, h: {}".format(image.shape[1],
-                                                   image.shape[0]))
-                start = time.time()
-                upscaled = sr.upsample(image)
-                end = time.time()
-                print("[INFO] super resolution took {:.6f} seconds"
-                      "".format(end - start))
-                print("[INFO] w: {}, h: {}".format(upscaled.shape[1],
-                      upscaled.shape[0]))
-                sys.stderr.write('[{}] writing "{}"\n'.format(myName,
-                                                              outPath))
-                cv2.imwrite(outPath, upscaled)
+                jobs.append((model, originalPath, mOutPath))
+                jobFrames.append(thisFrame)
+
+        if not jobs:
+            return
+        # Skip outputs that a previous (interrupted) run finished:
+        manifest = JobManifest(os.path.join(
+            outDir, "superResolutionAI_jobs.jsonl"))
+        try:
+            jobIndices = [i for i, job in enumerate(jobs)
+                          if not manifest.is_done(job[2])]
+            neededPaths = set(jobs[i][1] for i in jobIndices)
+            toExtract = [pair for pair in toExtract
+                         if pair[1] in neededPaths]
+            print("* {} of {} upscale(s) left (see \"{}\")"
+                  "".format(len(jobIndices), len(jobs), manifest.path))
+            if toExtract:
+                # One decoding pass instead of one ffmpeg run per frame:
+                decoded = rc_av.extract_frames(
+                    self.vidPath, toExtract,
+                    quality=max(5, 100 - (int(qscale_v) - 1) * 3),
+                )
+                print("* extracted {} frame(s) (decoded {})"
+                      "".format(len(toExtract), decoded))
 
-                if forceRatio is not None:
-                    print("  * downscaling to fix aspect ratio...")
-                    aiTmpDir = os.path.join(mOutDir, "ai_tmp")
-                    if not os.path.isdir(aiTmpDir):
-                        os.makedirs(aiTmpDir)
-                    aiTmpPath = os.path.join(aiTmpDir, mOutName)
-                    shutil.move(mOutPath, aiTmpPath)
-                    regularCmdParts = [settings.thisPython,
-                                       settings.thisScalePy,
-                                       "-i", aiTmpPath,
-                                       "-o", mOutPath,
-                                       "-r0", str(forceRatio[0]),
-                                       "-r1", str(forceRatio[1]),
-                                       "-p", str(preserveDim)]
-                    print("Running: {}".format(" ".join(
-                        regularCmdParts
-                    )))
-                    subprocess.check_output(regularCmdParts)
-                    print('  * wrote "{}"'.format(mOutPath))
+            # Upscale in parallel (each worker loads each model once):
+            stages = []
+            if forceRatio is not None:
+                # Fix the ratio of the upscaled image in memory before
+                # saving it.
+                stages.append(ratio_stage(forceRatio[0], forceRatio[1],
+                                          preserveDim))
+            self.stopEvent.clear()
+            upscale_files(jobs, workers=workers, tile_size=tileSize,
+                          overlap=tileOverlap, tile_workers=tileWorkers,
+                          stages=stages, manifest=manifest,
+                          frames=jobFrames, stop_event=self.stopEvent)
+        finally:
+            manifest.close()  # checkpoint
+        failed = [job[2] for job in jobs
+                  if manifest.records.get(job[2], {}).get('status')
+                  == JobManifest.FAILED]
+        if failed:
+            raise RuntimeError("{} upscale(s) failed (run again to retry)"
+                               " such as \"{}\". See \"{}\"."
+                               "".format(len(failed), failed[0],
+                                         manifest.path))
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+"""Upscale images with OpenCV dnn_superres models.
+
+Loaded models are cached per process (see get_model), so upscaling many
+frames only reads and sets each model once per worker process instead
+of once per frame.
+"""
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+
+myName = "rcupscale.py"
+
+ENABLE_NUMPY = False
+try:
+    import numpy as np
+    ENABLE_NUMPY = True
+except ImportError:
+    np = None
+
+opencv_enabled = False
+try:
+    import cv2
+    opencv_enabled = True
+except ImportError:
+    cv2 = None
+
+DEFAULT_OVERLAP = 16
+
+_models = {}  # model path -> DnnSuperResImpl (in this process)
+_thread_models = threading.local()  # for tiles upscaled on threads
+_tile_executors = {}  # workers -> ThreadPoolExecutor (see get_tile_executor)
+_tile_executors_lock = threading.Lock()
+
+
+def model_name_and_scale(model_path):
+    """Get the dnn_superres algorithm name and scale from a model path.
+
+    Args:
+        model_path (str): A path such as "models/EDSR_x4.pb".
+
+    Returns:
+        tuple: The name in lowercase (such as "edsr") and the scale as
+            an int (such as 4).
+    """
+    modelName = os.path.basename(model_path).split("_")[0].lower()
+    modelScale = model_path.split("_x")[-1]
+    modelScale = int(modelScale[:modelScale.find(".")])
+    return modelName, modelScale
+
+
+def get_model(model_path, per_thread=False):
+    """Get a loaded super resolution model (cached in this process).
+
+    Args:
+        per_thread (Optional[bool]): Use a separate model for each
+            thread (so threads can upsample at the same time).
+    """
+    models = _models
+    if per_thread:
+        models = getattr(_thread_models, 'models', None)
+        if models is None:
+            models = _thread_models.models = {}
+    sr = models.get(model_path)
+    if sr is None:
+        if not opencv_enabled:
+            raise RuntimeError("OpenCV (opencv-contrib-python) is required"
+                               " for super resolution.")
+        modelName, modelScale = model_name_and_scale(model_path)
+        print("[INFO] loading super resolution model: {}"
+              "".format(model_path))
+        print("[INFO] model name: {}".format(modelName))
+        print("[INFO] model scale: {}".format(modelScale))
+        sr = cv2.dnn_superres.DnnSuperResImpl_create()
+        sr.readModel(model_path)
+        sr.setModel(modelName, modelScale)
+        models[model_path] = sr
+    return sr
+
+
+def clear_models():
+    _models.clear()
+
+
+def get_tile_executor(workers):
+    """Get the threads for upsampling tiles (shared by every frame).
+
+    The threads last as long as the process, so each one loads a model
+    only once (see get_model's per_thread) instead of once per frame.
+
+    Args:
+        workers (int): How many threads.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: Don't shut it down.
+    """
+    with _tile_executors_lock:
+        executor = _tile_executors.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers,
+                                          thread_name_prefix="rcupscale")
+            _tile_executors[workers] = executor
+        return executor
+
+
+def tile_boxes(width, height, tile_size, overlap=DEFAULT_OVERLAP):
+    """Split an image into tiles that overlap their neighbors.
+
+    Args:
+        tile_size (int): The maximum width and height of a tile
+            excluding overlap.
+        overlap (Optional[int]): Extra pixels on each side that has a
+            neighbor (so the model has context and seams can blend).
+
+    Returns:
+        list[tuple]: (core, padded) for each tile, where each is a
+            (left, top, right, bottom) box (right and bottom exclusive).
+            The cores cover the image exactly once.
+    """
+    if tile_size < 1:
+        raise ValueError("tile_size must be at least 1")
+    boxes = []
+    for top in range(0, height, tile_size):
+        bottom = min(top + tile_size, height)
+        for left in range(0, width, tile_size):
+            right = min(left + tile_size, width)
+            boxes.append((
+                (left, top, right, bottom),
+                (max(left - overlap, 0), max(top - overlap, 0),
+                 min(right + overlap, width), min(bottom + overlap, height)),
+            ))
+    return boxes
+
+
+def _blend_ramp(start, end, core_start, core_end, fade):
+    """Get 1D weights: 1 in the core, fading to near 0 in the overlap."""
+    positions = np.arange(start, end, dtype=np.float32)
+    distance = np.maximum(core_start - positions, positions - (core_end - 1))
+    return np.clip(1.0 - np.maximum(distance, 0) / (fade + 1.0), 0.0, 1.0)
+
+
+def upsample_tiled(upsample, image, scale, tile_size,
+                   overlap=DEFAULT_OVERLAP, workers=1):
+    """Upsample an image one overlapping tile at a time.
+
+    The model only ever sees one tile, and only one row of tiles is
+    accumulated (as float) at a time, so peak memory is bounded by the
+    tile size and the image width rather than the whole frame. The
+    overlapping edges of neighboring tiles are blended with linear
+    weights so seams don't show.
+
+    Args:
+        upsample (Callable): Upsample an (h, w, channels) uint8 array
+            by scale (such as a DnnSuperResImpl's upsample). If workers
+            is more than 1 it is called on several threads at once.
+        image (numpy.ndarray): The (h, w, channels) uint8 image.
+        scale (int): The scale of upsample.
+        tile_size (int): See tile_boxes.
+        overlap (Optional[int]): See tile_boxes.
+        workers (Optional[int]): Threads upsampling tiles at once
+            (see get_tile_executor).
+
+    Returns:
+        numpy.ndarray: The upscaled image.
+    """
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim > 2 else 1
+    out_width = width * scale
+    result = np.empty((height * scale, out_width, channels), dtype=np.uint8)
+    fade = overlap * scale
+    boxes = tile_boxes(width, height, tile_size, overlap=overlap)
+    rows = []  # boxes grouped by tile row
+    for box in boxes:
+        if (not rows) or (rows[-1][0][0][1] != box[0][1]):
+            rows.append([])
+        rows[-1].append(box)
+
+    # The tiles form a grid, so the sum of the weights of all tiles at a
+    # pixel is (sum of row weights at y) * (sum of column weights at x):
+    weight_sum_x = np.zeros(out_width, dtype=np.float32)
+    for core, padded in rows[0]:
+        weight_sum_x[padded[0]*scale:padded[2]*scale] += _blend_ramp(
+            padded[0]*scale, padded[2]*scale, core[0]*scale, core[2]*scale,
+            fade)
+    weight_sum_y = np.zeros(height * scale, dtype=np.float32)
+    for row in rows:
+        core, padded = row[0]
+        weight_sum_y[padded[1]*scale:padded[3]*scale] += _blend_ramp(
+            padded[1]*scale, padded[3]*scale, core[1]*scale, core[3]*scale,
+            fade)
+
+    band = np.zeros((0, out_width, channels), dtype=np.float32)
+    band_top = 0  # output row of band[0]
+    lock = threading.Lock()
+
+    def run(boxes):
+        core, padded = boxes
+        left, top, right, bottom = padded
+        tile = upsample(np.ascontiguousarray(image[top:bottom, left:right]))
+        tile = tile.reshape(((bottom - top) * scale, (right - left) * scale,
+                             channels)).astype(np.float32)
+        tile *= _blend_ramp(left * scale, right * scale, core[0] * scale,
+                            core[2] * scale, fade)[None, :, None]
+        tile *= _blend_ramp(top * scale, bottom * scale, core[1] * scale,
+                            core[3] * scale, fade)[:, None, None]
+        with lock:
+            band[top*scale-band_top:bottom*scale-band_top,
+                 left*scale:right*scale] += tile
+
+    executor = None
+    if workers > 1:
+        executor = get_tile_executor(workers)
+    for row_i, row in enumerate(rows):
+        band_bottom = row[0][1][3] * scale
+        if band_bottom > band_top + len(band):
+            band = np.concatenate((band, np.zeros(
+                (band_bottom - band_top - len(band), out_width,
+                 channels), dtype=np.float32)))
+        if executor is not None:
+            for _ in executor.map(run, row):
+                pass
+        else:
+            for box in row:
+                run(box)
+        # Rows above the next tile row's overlap are complete:
+        if row_i + 1 < len(rows):
+            done = rows[row_i + 1][0][1][1] * scale
+        else:
+            done = band_bottom
+        count = done - band_top
+        norm = weight_sum_y[band_top:done, None, None] \
+            * weight_sum_x[None, :, None]
+        result[band_top:done] = \
+            np.rint(band[:count] / norm).clip(0, 255)
+        band = band[count:].copy()
+        band_top = done
+    if image.ndim == 2:
+        return result[:, :, 0]
+    return result
+
+
+def upscale_file(model_path, in_path, out_path, tile_size=None,
+                 overlap=DEFAULT_OVERLAP, tile_workers=1, stages=None):
+    """Upscale one image file using a cached model.
+
+    Args:
+        tile_size (Optional[int]): If not None, upsample tiles of at
+            most this size (see upsample_tiled) to bound memory use.
+        overlap (Optional[int]): Overlap of tiles in input pixels.
+        tile_workers (Optional[int]): Threads upsampling tiles at once
+            (each with its own model).
+        stages (Optional[list[Callable]]): Functions that each take and
+            return an OpenCV image (numpy array), applied in order to
+            the upscaled image before it is saved (such as
+            fix_ratio.ratio_stage). They must be picklable to be used
+            by upscale_files with more than one worker.
+
+    Returns:
+        str: out_path
+    """
+    image = cv2.imread(in_path)
+    if image is None:
+        raise ValueError("OpenCV could not read \"{}\"".format(in_path))
+    print("[INFO] w: {}, h: {}".format(image.shape[1], image.shape[0]))
+    start = time.time()
+    if tile_size is None:
+        upscaled = get_model(model_path).upsample(image)
+    else:
+        if tile_workers > 1:
+            def upsample(tile):
+                return get_model(model_path, per_thread=True).upsample(tile)
+        else:
+            upsample = get_model(model_path).upsample
+        upscaled = upsample_tiled(upsample, image,
+                                  model_name_and_scale(model_path)[1],
+                                  tile_size, overlap=overlap,
+                                  workers=tile_workers)
+    end = time.time()
+    print("[INFO] super resolution took {:.6f} seconds"
+          "".format(end - start))
+    print("[INFO] w: {}, h: {}".format(upscaled.shape[1],
+                                       upscaled.shape[0]))
+    for stage in (stages or ()):
+        upscaled = stage(upscaled)
+    sys.stderr.write('[{}] writing "{}"\n'.format(myName, out_path))
+    cv2.imwrite(out_path, upscaled)
+    return out_path
+
+
+class JobManifest:
+    """A JSON lines log of upscale jobs, so a batch can be resumed.
+
+    Each line is one status update for an output: a dict with 'output',
+    'status' ("done" or "failed"), 'model', 'input', 'frame',
+    'duration' (seconds), 'error' and 'time'. The last line for an
+    output wins. Lines are flushed as they are written so a crash loses
+    at most the jobs that were in progress.
+
+    Args:
+        path (str): The manifest file (created if it doesn't exist).
+    """
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}  # output path -> last record
+        ends_with_newline = True
+        if os.path.isfile(path):
+            with open(path, 'r') as stream:
+                for line in stream:
+                    ends_with_newline = line.endswith("\n")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # (such as a partial line from a crash)
+                        print("[{}] skipped a bad line in \"{}\""
+                              "".format(myName, path))
+                        continue
+                    self.records[record['output']] = record
+        self._stream = open(path, 'a')
+        if not ends_with_newline:
+            self._stream.write("\n")  # end a partial line from a crash
+
+    def is_done(self, out_path):
+        """Check if an output was completed (and still exists)."""
+        record = self.records.get(out_path)
+        return ((record is not None)
+                and (record['status'] == JobManifest.DONE)
+                and os.path.isfile(out_path))
+
+    def record(self, job, status, duration=None, error=None, frame=None):
+        """Add a status update for a (model, input, output) job."""
+        record = {
+            'output': job[2],
+            'status': status,
+            'model': job[0],
+            'input': job[1],
+            'frame': frame,
+            'duration': duration,
+            'error': error,
+            'time': time.time(),
+        }
+        self.records[job[2]] = record
+        self._stream.write(json.dumps(record) + "\n")
+        self._stream.flush()
+
+    def checkpoint(self):
+        """Make sure all records are on disk."""
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+
+    def close(self):
+        if not self._stream.closed:
+            self.checkpoint()
+            self._stream.close()
+
+
+def _timed_upscale_file(*args, **kwargs):
+    start = time.time()
+    upscale_file(*args, **kwargs)
+    return time.time() - start
+
+
+def _init_worker(threads):
+    # Split the CPU between workers instead of each using all of it.
+    if opencv_enabled:
+        cv2.setNumThreads(threads)
+
+
+def upscale_files(jobs, workers=None, callback=None, manifest=None,
+                  frames=None, stop_event=None, **options):
+    """Upscale many images using a pool of worker processes.
+
+    Each worker loads each model once (see get_model), so the time is
+    bounded by upscaling rather than by loading models. The processes
+    are spawned (not forked), so this is safe to call from a thread of
+    a GUI.
+
+    Args:
+        jobs (list[tuple[str]]): (model path, input path, output path)
+            for each image.
+        workers (Optional[int]): How many processes (default: CPU count,
+            but no more than len(jobs)). If 1, upscale in this process.
+        callback (Optional[Callable]): Called with a dict containing
+            'ratio' and 'path' (the finished output) after each image.
+        manifest (Optional[JobManifest]): Skip jobs it lists as done,
+            and record each finished or failed job. Failures are then
+            recorded instead of raised (so the rest of the batch runs
+            and a rerun retries them).
+        frames (Optional[list]): A frame number for each job (only
+            used for the manifest).
+        stop_event (Optional[threading.Event]): If set, jobs not
+            started yet are skipped (jobs in progress finish and are
+            recorded).
+        options: Keyword arguments for upscale_file (tile_size,
+            overlap, tile_workers or stages).
+
+    Returns:
+        list[str]: The output paths in the order of jobs (None for
+            each job that failed or was skipped due to stop_event).
+    """
+    results = [None] * len(jobs)
+    if frames is None:
+        frames = [None] * len(jobs)
+    pending = []
+    for i, job in enumerate(jobs):
+        if (manifest is not None) and manifest.is_done(job[2]):
+            results[i] = job[2]
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(pending)))
+    done = len(jobs) - len(pending)
+
+    def finish(i, duration, error=None):
+        nonlocal done
+        job = jobs[i]
+        if error is not None:
+            if manifest is None:
+                raise error
+            print("[{}] {} failed: {}".format(myName, job[2], error))
+            manifest.record(job, JobManifest.FAILED, error=str(error),
+                            frame=frames[i])
+            return
+        results[i] = job[2]
+        if manifest is not None:
+            manifest.record(job, JobManifest.DONE, duration=duration,
+                            frame=frames[i])
+        done += 1
+        if callback is not None:
+            callback({'ratio': done / len(jobs), 'path': job[2]})
+
+    def stopped():
+        return (stop_event is not None) and stop_event.is_set()
+
+    if workers == 1:
+        for i in pending:
+            if stopped():
+                break
+            try:
+                duration = _timed_upscale_file(*jobs[i], **options)
+            except Exception as ex:
+                finish(i, None, error=ex)
+                continue
+            finish(i, duration)
+        return results
+    threads = max(1, (os.cpu_count() or 1)
+                  // (workers * options.get('tile_workers', 1)))
+    # Sort by model so each worker tends to reuse the model it loaded:
+    pending.sort(key=lambda i: jobs[i][0])
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(threads,),
+        mp_context=multiprocessing.get_context('spawn'),
+    ) as executor:  # ^ forking a process that has threads can deadlock
+        futures = {executor.submit(_timed_upscale_file, *jobs[i], **options): i
+                   for i in pending}
+        for future in as_completed(futures):
+            if stopped():
+                for other in futures:
+                    other.cancel()  # only cancels jobs not started yet
+            if future.cancelled():
+                continue
+            try:
+                duration = future.result()
+            except Exception as ex:
+                finish(futures[future], None, error=ex)
+                continue
+            finish(futures[future], duration)
+    return results
@@ -7,14 +7,17 @@ import copy
 import json
 import os
 import shutil
-import puremagic
 import sys
+import threading
+import time
 
 # from decimal import Decimal
+from fractions import Fraction
 import locale as lc
 from logging import getLogger
 
 if sys.version_info.major >= 3:
+    from queue import Queue
     import tkinter as tk
     from tkinter import ttk
     from tkinter.filedialog import (
@@ -23,6 +26,7 @@ if sys.version_info.major >= 3:
     )
     import tkinter.messagebox as messagebox
 else:  # Python 2
+    from Queue import Queue  # type: ignore
     import Tkinter as tk  # type: ignore
     import ttk  # type: ignore
     from tkFileDialog import (  # type: ignore
@@ -58,20 +62,63 @@ from rotocanvas import (
     make_real,
 )
 
+from rotocanvas.framecache import (
+    get_shared_frame_cache,
+)
 from rotocanvas.morelogging import formatted_ex
 from rotocanvas.rcnewfileframe import NewFileFrame
 from rotocanvas.rcproject import RCProject  # noqa: E402
 from rotocanvas.moremimetypes import (
     # dot_ext_mimetype,
-    path_mimetype,
+    sniff_mimetype,
+)
+from rotocanvas.pythonpixels import (
+    PPImage,
+    PPTiledImage,
+)
+from rotocanvas.undojournal import (
+    UndoJournal,
+    brush_rect,
 )
+if ENABLE_PIL:
+    from rotocanvas.compositor import (
+        CompositeLayer,
+        Compositor,
+    )
+
+FRAME_POLL_MS = 15  # how often to check for frames from the prefetcher
+PARTIAL_INDEX_S = 1.0  # how often to extend the index while indexing
+FULL_RESOLUTION_MS = 250  # idle time on a proxy frame before decoding it
+PAINT_LAYER = "paint"  # the overlay layer that the canvas paints on
+BRUSH_DIAMETER = 9
+BRUSH_COLOR = (255, 0, 0, 255)  # RGBA
 
 DEFAULT_SETTINGS = {
     'recent_paths': [],
+    'frame_cache_mb': 512,  # memory budget for decoded video frames
 }
 
 logger = getLogger(__name__)
 
+
+def make_round_brush(diameter, color):
+    """Make a round brush (see PPTiledImage.setBrushImage).
+
+    Args:
+        diameter (int): The width and height in pixels.
+        color (tuple[int]): RGBA, each 0 to 255.
+
+    Returns:
+        PPImage: The brush (transparent outside of the circle).
+    """
+    brush = PPImage((diameter, diameter), byteDepth=4)
+    radius = diameter / 2.0
+    for y in range(diameter):
+        for x in range(diameter):
+            if (x + .5 - radius) ** 2 + (y + .5 - radius) ** 2 <= radius ** 2:
+                brush.set_at_from_ivec((x, y), color)
+    return brush
+
 options_setting_types = OrderedDict(
     name={
         'caption': "Name",
@@ -108,6 +155,27 @@ class ProjectFrame(ttk.Frame):
             self.root = self.parent.root
         self.photo = None
         self.image_instruction = None
+        self.prefetcher = None  # rc_av.FramePrefetcher if a video is open
+        self.openJob = None  # rc_av.OpenVideoJob while a video is indexed
+        self._partialIndexTime = None  # when the partial index was used
+        self.frameIndex = 0
+        self.pendingFrame = None  # frame to show as soon as it is decoded
+        self._pollJob = None
+        self.videoPath = None
+        self.videoMeta = None
+        self.displaySize = None  # show proxy frames at this size
+        self.fullPrefetcher = None  # decodes full-resolution frames if proxy
+        self._fullJob = None  # see scheduleFullResolution
+        self.proxyThread = None
+        self.proxyEvents = Queue()
+        self.current_frame = None
+        self.compositor = Compositor() if ENABLE_PIL else None
+        # ^ the current frame with its overlay layers (see showFrame)
+        self.undoJournal = None  # strokes on paintLayer (see paintLayer)
+        self._paintLayer = None  # the CompositeLayer undoJournal is for
+        self._paintKey = None  # the compositor key of _paintLayer
+        self._stroking = False
+        self.playing = False
         self.seqPath = tk.StringVar()
         self.frameRate = tk.StringVar()
         self.result = tk.StringVar()
@@ -153,10 +221,23 @@ class ProjectFrame(ttk.Frame):
             self.fileMenu.add_separator()
         self.fileMenu.add_command(label="Exit", command=self.parent.destroy)
 
+        self.editMenu = tk.Menu(self.menu, tearoff=0)
+        self.menu.add_cascade(label="Edit", menu=self.editMenu)
+        self.editMenu.add_command(label="Undo", command=self.undo,
+                                  accelerator="Ctrl+Z")
+        self.editMenu.add_command(label="Redo", command=self.redo,
+                                  accelerator="Ctrl+Y")
+        self.root.bind("<Control-z>", lambda event: self.undo())
+        self.root.bind("<Control-Z>", lambda event: self.redo())
+        # ^ (Ctrl+Shift+Z)
+        self.root.bind("<Control-y>", lambda event: self.redo())
+
         self.prepMenu = tk.Menu(self.menu, tearoff=0)
         self.menu.add_cascade(label="Prepare", menu=self.prepMenu)
         self.prepMenu.add_command(label="Super Resolution (This Frame)",
                                   command=self.srFrame)
+        self.prepMenu.add_command(label="Make Proxy (Faster Scrubbing)",
+                                  command=self.makeProxy)
 
         # self.themeMenu = tk.Menu(self.menu, tearoff=0)
         # self.menu.add_cascade(label="Theme", menu=self.themeMenu)
@@ -218,6 +299,9 @@ class ProjectFrame(ttk.Frame):
                                columnspan=self.cols)
         self.canvas = tk.Canvas(self.canvas_frame)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind("<ButtonPress-1>", self.onPaintStart)
+        self.canvas.bind("<B1-Motion>", self.onPaintMove)
+        self.canvas.bind("<ButtonRelease-1>", self.onPaintEnd)
         self.canvas_row = row
         row += 1
 
@@ -225,6 +309,9 @@ class ProjectFrame(ttk.Frame):
         resultE = ttk.Entry(self.root, textvariable=self.result, state="readonly")
         # resultE.grid(column=0, columnspan=self.cols, row=row, sticky=tk.EW)
         resultE.pack(fill=tk.X, expand=True)
+        self.progress = ttk.Progressbar(self.root, mode='determinate',
+                                        maximum=1.0)
+        # ^ packed only while opening a video (see openVideo)
         # grid sticky=tk.W
         row += 1
 
@@ -289,9 +376,14 @@ class ProjectFrame(ttk.Frame):
         self.settings = copy.deepcopy(DEFAULT_SETTINGS)
         for key, value in settings.items():
             self.settings[key] = value
+        self._savedSettings = copy.deepcopy(settings) if loaded else None
+        get_shared_frame_cache().max_bytes = \
+            int(self.settings['frame_cache_mb']) * 1024 * 1024
         return loaded
 
     def saveSettings(self):
+        if self.settings == self._savedSettings:
+            return  # unchanged
         path = self.configPath()
         tmp = path + ".tmp"
         with open(tmp, 'w') as stream:
@@ -299,18 +391,55 @@ class ProjectFrame(ttk.Frame):
         if os.path.isfile(path):
             os.remove(path)
         shutil.move(tmp, path)
+        self._savedSettings = copy.deepcopy(self.settings)
 
     def setTheme(self, name):
         self.parent.style.theme_use(name)
 
     def next(self):
-        pass
+        if self.prefetcher is None:
+            return
+        if self.frameIndex + 1 < self.prefetcher.frame_count:
+            self.showFrame(self.frameIndex + 1)
 
     def prev(self):
-        pass
+        if self.prefetcher is None:
+            return
+        if self.frameIndex > 0:
+            self.showFrame(self.frameIndex - 1)
 
     def play(self):
-        pass
+        if self.playing:
+            self.playing = False
+            self.play_button.config(text="Play")
+            self.scheduleFullResolution()
+            return
+        if self.prefetcher is None:
+            return
+        self.playing = True
+        self.play_button.config(text="Pause")
+        self._playStep()
+
+    def frameDelayMs(self):
+        try:
+            rate = Fraction(self.frameRate.get())
+        except (ValueError, ZeroDivisionError):
+            rate = Fraction(30)
+        if rate <= 0:
+            rate = Fraction(30)
+        return max(1, int(round(1000 / rate)))
+
+    def _playStep(self):
+        if not self.playing:
+            return
+        if self.pendingFrame is None:
+            # Only advance once the previous frame was shown (if decoding
+            # falls behind, playback slows down instead of skipping).
+            if self.frameIndex + 1 >= self.prefetcher.frame_count:
+                self.play()  # pause at the end
+                return
+            self.showFrame(self.frameIndex + 1)
+        self.after(self.frameDelayMs(), self._playStep)
 
     def srFrame(self):
         try:
@@ -434,49 +563,413 @@ class ProjectFrame(ttk.Frame):
                 raise
         return results
 
-    def onLoadProgress(self, event_d):
-        ratio = event_d.get('ratio')
-        percent_s = ""
-        if ratio:
-            percent_s = "{}%".format(round(ratio))
-        logger.warning("[onLoadProgress] Not implemented. {}"
-                       .format(percent_s))
+    def onLoadProgress(self, status):
+        """Show the progress of indexing (see rc_av.iter_analyze_video).
+        """
+        self.progress['value'] = status['ratio']
+        self.set_status("Indexing {:.0%} ({} frames, {:.1f} MB/s)".format(
+            status['ratio'], status['indexed_frames'],
+            status['bytes_per_sec'] / 1e6))
 
     def openVideo(self, path, results_template=None):
+        """Start opening a video on a thread (see _pollOpen).
+
+        Frame 0 is shown as soon as it is decoded, and other frames can
+        be shown as soon as they are indexed (see _usePartialIndex).
+        """
         results = make_real(results_template)
-        if ENABLE_AV:
-            cache = rc_av.cache_keyframes(path)
-            meta = rc_av.analyze_video(path, self.onLoadProgress)
-            # collect and remove runtime data:
-            self.container = meta['container']
-            del meta['container']
-            raise NotImplementedError(meta)
-            # See analyze_video in docs/development
-            # Generate a picture (or use canvas directly?) to show video.
-        else:
+        if not ENABLE_AV:
             raise RuntimeError(
                 "Only PyAV is implemented (not pyav)"
                 " but av is not detected/enabled.")
+        self.closeVideo()
+        get_shared_frame_cache().clear(path)  # in case it changed
+        self.videoPath = path
+        self.videoMeta = None
+        self.frameIndex = 0
+        self.photo = None
+        self.progress['value'] = 0
+        self.progress.pack(fill=tk.X, expand=True)
+        self.set_status("Opening {}...".format(os.path.basename(path)))
+        self.openJob = rc_av.OpenVideoJob(path,
+                                          cache=get_shared_frame_cache())
+        self._partialIndexTime = None
+        self._pollJob = self.after(FRAME_POLL_MS, self._pollFrames)
         return results
 
+    def _pollOpen(self):
+        job = self.openJob
+        while (job is not None) and (not job.updates.empty()):
+            status = job.updates.get_nowait()
+            if 'first_frame' in status:
+                if self.prefetcher is None:
+                    self.frameIndex = 0
+                    self.current_frame = status['first_frame']
+                    self.photo = ImageTk.PhotoImage(
+                        status['first_frame'].to_image())
+                    self.showPhotoImage(self.photo)
+                continue
+            if 'error' in status:
+                self.openJob = None
+                self.progress.pack_forget()
+                self.set_status("Opening failed: {}"
+                                .format(formatted_ex(status['error'])))
+                return
+            self.onLoadProgress(status)
+            if status['done']:
+                self.openJob = None
+                self.progress.pack_forget()
+                self.videoMeta = job.result
+                # See analyze_video in docs/development
+                self._startPrefetcher()
+                if self.pendingFrame is not None:
+                    self.showFrame(self.pendingFrame)
+                else:
+                    self.showFrame(self.frameIndex)
+                return
+        if job is not None:
+            self._usePartialIndex(job)
+
+    def _usePartialIndex(self, job):
+        """Allow seeking in the part of the video indexed so far.
+
+        The prefetcher reads from job's partial index, which is extended
+        (at most every PARTIAL_INDEX_S) until indexing finishes.
+        """
+        now = time.monotonic()
+        if ((self._partialIndexTime is not None)
+                and (now - self._partialIndexTime < PARTIAL_INDEX_S)):
+            return
+        meta = job.snapshot()
+        if (meta is None) or (not meta['packet_pts']):
+            return
+        self._partialIndexTime = now
+        if self.prefetcher is not None:
+            self.prefetcher.set_index(meta)
+            return
+        self.displaySize = None
+        self.prefetcher = rc_av.FramePrefetcher(
+            self.videoPath, get_shared_frame_cache(), meta=meta)
+        self.showFrame(self.frameIndex)
+
+    def _startPrefetcher(self):
+        """Prefetch from the proxy if there is one, else from the video.
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        reader = None
+        self.displaySize = None
+        try:
+            reader = rc_av.ProxyReader(self.videoPath)
+            self.displaySize = tuple(reader.manifest['source_size'])
+            get_shared_frame_cache().clear(reader.source)
+        except FileNotFoundError:
+            pass  # use the full-resolution video
+        self.prefetcher = rc_av.FramePrefetcher(
+            self.videoPath, get_shared_frame_cache(), meta=self.videoMeta,
+            reader=reader)
+        if self.fullPrefetcher is not None:
+            self.fullPrefetcher.close()
+            self.fullPrefetcher = None
+        if reader is not None:
+            self.fullPrefetcher = rc_av.FramePrefetcher(
+                self.videoPath, get_shared_frame_cache(),
+                meta=self.videoMeta, ahead=0, behind=0)
+            # ^ only the frame to paint on (see showFullResolution)
+
+    def makeProxy(self):
+        """Make a low-resolution proxy of the video for faster scrubbing.
+        """
+        if self.prefetcher is None:
+            messagebox.showerror("Make Proxy", "Open a video first.")
+            return
+        if self.proxyThread is not None:
+            return  # already running
+        path = self.videoPath
+        meta = self.videoMeta
+
+        def run():
+            try:
+                rc_av.make_proxy(
+                    path, meta=meta,
+                    callback=lambda event_d: self.proxyEvents.put(event_d),
+                    is_cancelled=lambda: self.videoPath != path,
+                )
+                self.proxyEvents.put({'done': path})
+            except Exception as ex:
+                self.proxyEvents.put({'error': formatted_ex(ex)})
+
+        self.proxyThread = threading.Thread(target=run, daemon=True)
+        self.proxyThread.start()
+
+    def _pollProxy(self):
+        while not self.proxyEvents.empty():
+            event_d = self.proxyEvents.get_nowait()
+            if 'ratio' in event_d:
+                self.set_status("Making proxy: {:.0%}"
+                                .format(event_d['ratio']))
+                continue
+            self.proxyThread = None
+            if 'error' in event_d:
+                self.set_status("Making proxy failed: {}"
+                                .format(event_d['error']))
+            elif event_d['done'] == self.videoPath:
+                self._startPrefetcher()
+                self.showFrame(self.frameIndex)
+
+    def scheduleFullResolution(self):
+        """Call showFullResolution if the frame stays shown for a while.
+
+        Scrubbing and playback show proxy frames, so the full-resolution
+        frame is only decoded once the playhead stops.
+        """
+        if self._fullJob is not None:
+            self.after_cancel(self._fullJob)
+            self._fullJob = None
+        if (self.fullPrefetcher is None) or self.playing:
+            return
+        self._fullJob = self.after(FULL_RESOLUTION_MS,
+                                   self.showFullResolution)
+
+    def showFullResolution(self):
+        """Replace the proxy frame shown with the full-resolution frame.
+
+        It is shown as soon as it is decoded (see _pollFrames).
+        """
+        if self._fullJob is not None:
+            self.after_cancel(self._fullJob)  # (if called directly)
+            self._fullJob = None
+        if (self.fullPrefetcher is None) or self.playing:
+            return
+        source = self.fullPrefetcher.source
+        frame = get_shared_frame_cache().get(source, self.frameIndex)
+        if frame is not None:
+            self._showCachedFrame(self.frameIndex, frame, full=True)
+            return
+        self.fullPrefetcher.request(self.frameIndex)
+
+    def closeVideo(self):
+        self.videoPath = None  # (also cancels building the proxy)
+        self.playing = False
+        self.pendingFrame = None
+        self.undoJournal = None
+        self._paintLayer = None
+        self._paintKey = None
+        self._stroking = False
+        if self.compositor is not None:
+            self.compositor.clear()
+        if self.openJob is not None:
+            self.openJob.cancel(wait=False)
+            self.openJob = None
+            self.progress.pack_forget()
+        if self._fullJob is not None:
+            try:
+                self.after_cancel(self._fullJob)
+            except tk.TclError:
+                pass  # The window was already destroyed.
+            self._fullJob = None
+        if self.fullPrefetcher is not None:
+            self.fullPrefetcher.close()
+            self.fullPrefetcher = None
+        if self._pollJob is not None:
+            try:
+                self.after_cancel(self._pollJob)
+            except tk.TclError:
+                pass  # The window was already destroyed.
+            self._pollJob = None
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
     def showFrame(self, frame_number):
-        """Displays a specific frame of the video."""
-        # Seek to the desired frame
-        self.container.seek(frame_number, stream=self.video_stream)
-
-        # Decode the frame
-        for packet in self.container.demux(self.video_stream):
-            for frame in packet.decode():
-                # Display the decoded frame
-                self.current_frame = frame
-                img = frame.to_image()
-                # self.photo = ImageTk.PhotoImage(img)
-                # ^ Keep a reference to prevent garbage collection
-                self.showPhotoImage(self.photo)
-                # self.label.config(image=self.photo)
-                # self.label.image = self.photo
+        """Displays a specific frame of the video.
+
+        If the frame isn't decoded yet, it is shown when the prefetch
+        thread finishes it (see _pollFrames) so the GUI doesn't block.
+
+        Args:
+            frame_number (int): 0-based frame number (not a timestamp).
+        """
+        self.prefetcher.request(frame_number)
+        frame = get_shared_frame_cache().get(self.prefetcher.source,
+                                             frame_number)
+        if frame is None:
+            self.pendingFrame = frame_number
+            self.set_status("Loading frame {}...".format(frame_number + 1))
+            return
+        self.pendingFrame = None
+        self._showCachedFrame(frame_number, frame)
+
+    def _showCachedFrame(self, frame_number, frame, full=False):
+        """Show a decoded frame with its overlay layers.
+
+        Args:
+            full (Optional[bool]): Whether frame is the full-resolution
+                frame that replaces a proxy frame (see
+                showFullResolution).
+        """
+        self.frameIndex = frame_number
+        self.current_frame = frame
+        image = frame.to_image()
+        if (self.displaySize is not None) and (image.size != self.displaySize):
+            image = image.resize(self.displaySize)  # proxy to full size
+        if not full:
+            self.scheduleFullResolution()
+        if self.compositor is None:
+            self.photo = ImageTk.PhotoImage(image)  # (no overlay layers)
+            self.showPhotoImage(self.photo)
+        else:
+            key = (self.videoPath, frame_number)
+            if full and (self.compositor.key == key):
+                self.compositor.replace_frame(image)
+            else:
+                self.compositor.set_frame(
+                    key, image, lambda: self.frameLayers(frame_number))
+            self.showComposite()
+        self.set_status("Frame {} of {} (cache hit rate {:.0%})".format(
+            frame_number + 1, self.prefetcher.frame_count,
+            get_shared_frame_cache().hit_rate))
+
+    def showComposite(self):
+        """Show the frame with its layers (such as after invalidate)."""
+        self.photo = ImageTk.PhotoImage(self.compositor.composite())
+        # ^ Keep a reference to prevent garbage collection
+        self.showPhotoImage(self.photo)
+
+    def paintLayer(self):
+        """Get the layer of the frame shown that the canvas paints on.
+
+        The layer (PAINT_LAYER) is added to the frame if it has none
+        yet, and undoJournal is started over when the layer changes
+        (so undo only applies to the frame shown).
+
+        Returns:
+            CompositeLayer: The layer, or None if no frame is shown.
+        """
+        compositor = self.compositor
+        if (compositor is None) or (compositor.frame is None):
+            return None
+        for layer in compositor.layers:
+            if layer.name == PAINT_LAYER:
                 break
-            break
+        else:
+            layer = CompositeLayer(
+                PPTiledImage(compositor.frame.size), name=PAINT_LAYER,
+                **self.project.getLayerSettings(PAINT_LAYER)
+            )
+            compositor.layers.append(layer)
+        if layer.image.brushImage is None:
+            layer.image.setBrushImage(make_round_brush(BRUSH_DIAMETER,
+                                                       BRUSH_COLOR))
+        if layer is not self._paintLayer:
+            self.undoJournal = UndoJournal(layer.image)
+            self._paintLayer = layer
+            self._paintKey = compositor.key
+        return layer
+
+    def onPaintStart(self, event):
+        if (self.videoPath is None) or (self.prefetcher is None):
+            return  # Only video frames have layers.
+        if self.playing:
+            self.play()  # pause
+        self.showFullResolution()  # paint on the sharp frame if a proxy
+        if self.paintLayer() is None:
+            return
+        self._stroking = True
+        self.undoJournal.begin()
+        self._paintAt(event)
+
+    def onPaintMove(self, event):
+        if self._stroking:
+            self._paintAt(event)
+
+    def onPaintEnd(self, event):
+        if not self._stroking:
+            return
+        self._stroking = False
+        if self.undoJournal.end():
+            self.saveLayer()
+
+    def _paintAt(self, event):
+        # The frame is shown at full size at the canvas origin:
+        x = int(self.canvas.canvasx(event.x))
+        y = int(self.canvas.canvasy(event.y))
+        image = self._paintLayer.image
+        self.undoJournal.capture(brush_rect(image.brushImage, x, y))
+        rect = image.brushAt(x, y)
+        if rect is not None:
+            self.compositor.invalidate(rect)
+            self.showComposite()
+
+    def undo(self):
+        """Undo the last stroke on the frame shown."""
+        self._historyChanged(self.undoJournal.undo()
+                             if self._canUseHistory() else None)
+
+    def redo(self):
+        """Redo the last undone stroke on the frame shown."""
+        self._historyChanged(self.undoJournal.redo()
+                             if self._canUseHistory() else None)
+
+    def _canUseHistory(self):
+        return ((self.undoJournal is not None) and (not self._stroking)
+                and (self.compositor.key == self._paintKey)
+                and any(layer is self._paintLayer
+                        for layer in self.compositor.layers))
+
+    def _historyChanged(self, rect):
+        if rect is None:
+            return
+        self.compositor.invalidate(rect)
+        self.showComposite()
+        self.saveLayer()
+
+    def saveLayer(self):
+        """Set the painted layer in the project (see RCProject.setLayer).
+
+        Nothing is written until the project is saved.
+        """
+        source, frame_number = self._paintKey
+        self.project.setLayer(source, frame_number, self._paintLayer.name,
+                              self._paintLayer.image)
+
+    def frameLayers(self, frame_number):
+        """Get the overlay layers of a frame (see RCProject.getLayer).
+
+        Returns:
+            list[CompositeLayer]: The layers that have been painted
+                (including unsaved ones).
+        """
+        layers = []
+        for name in self.project.getLayerNames(self.videoPath, frame_number):
+            layers.append(CompositeLayer(
+                self.project.getLayer(self.videoPath, frame_number, name),
+                name=name,
+                **self.project.getLayerSettings(name)
+            ))
+        return layers
+
+    def _pollFrames(self):
+        self._pollOpen()
+        self._pollProxy()
+        prefetcher = self.prefetcher
+        while (prefetcher is not None) and (not prefetcher.ready.empty()):
+            index = prefetcher.ready.get_nowait()
+            if index == self.pendingFrame:
+                frame = get_shared_frame_cache().get(prefetcher.source,
+                                                     index)
+                if frame is not None:
+                    self.pendingFrame = None
+                    self._showCachedFrame(index, frame)
+        full = self.fullPrefetcher
+        while (full is not None) and (not full.ready.empty()):
+            index = full.ready.get_nowait()
+            if ((index == self.frameIndex) and (self.pendingFrame is None)
+                    and (not self.playing)):
+                frame = get_shared_frame_cache().get(full.source, index)
+                if frame is not None:
+                    self._showCachedFrame(index, frame, full=True)
+        self._pollJob = self.after(FRAME_POLL_MS, self._pollFrames)
 
     def clearCanvas(self):
         self.canvas.delete("all")
@@ -494,49 +987,35 @@ class ProjectFrame(ttk.Frame):
 
     def open(self, path, results_template=None):
         results = make_real(results_template)
+        self.closeVideo()  # Stop showing or painting the previous video.
         # self.project.open(path)
         self.project.addVideo(path, self.frameRate.get())
         self.seqPath.set(path)
         self.addRecent(path)
         self.saveSettings()
         self.clearCanvas()
-        try:
-            file_info = puremagic.from_file(path)
-            # ^ huh? Only gets a string: ".mp4" so:
-            if isinstance(file_info, str):
-                # Why just mp4?
-                logger.warning("file_info={}".format(file_info))
-                if "/" not in file_info:
-                    mime_type = path_mimetype(path)
-                    if mime_type is None:
-                        raise ValueError(
-                            "Unknown extension for \"{}\""
-                            .format(path))
-                else:
-                    mime_type = file_info
-            else:
-                logger.info("file_info={}".format(file_info))
-                mime_type = file_info[0].mime_type  # Get the MIME type
-            results['mime_type'] = mime_type
-            logger.warning("Loading {}".format(mime_type))
-            # Check if the file is an image or video
-            if mime_type.startswith("image/"):
-                results.update(
-                    self.openImageSequence(path, results_template=results)
-                )
-            elif mime_type.startswith("video/"):
-                results.update(self.openVideo(path))
-                results['category'] = "video"
-            else:
-                logger.error("The file is of another type:", mime_type)
-        except puremagic.PureError as ex:
-            logger.error("Could not determine file type:")
-            logger.exception(ex)
-        self.showPhotoImage(self.photo)
+        mime_type = sniff_mimetype(path)
+        if mime_type is None:
+            raise ValueError("Unknown extension for \"{}\"".format(path))
+        results['mime_type'] = mime_type
+        logger.warning("Loading {}".format(mime_type))
+        # Check if the file is an image or video
+        if mime_type.startswith("image/"):
+            results.update(
+                self.openImageSequence(path, results_template=results)
+            )
+            self.showPhotoImage(self.photo)
+        elif mime_type.startswith("video/"):
+            results.update(self.openVideo(path))
+            results['category'] = "video"
+            # (shown by _pollOpen when decoded)
+        else:
+            logger.error("The file is of another type: {}"
+                         .format(mime_type))
         return results
 
     def end(self):
-        pass
+        self.closeVideo()
 
 
 demo_paths = [
@@ -563,6 +1042,7 @@ def main():
             root.after(10, frame.open, demo_path)
             break
     root.mainloop()
+    frame.end()
     project.stop()
     saveError = project.save()
     if saveError is None:
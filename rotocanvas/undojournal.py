@@ -0,0 +1,233 @@
+"""Undo and redo for painting, by recording only the tiles each stroke
+changes.
+
+Call capture with each region before drawing into it (such as
+brush_rect before brushAt). The first time a stroke touches a tile, the
+tile's bytes are copied, and end compares them to the tile's bytes
+after the stroke, so undo and redo copy only the tiles the stroke
+changed (not the whole canvas).
+"""
+import zlib
+
+from collections import deque
+
+from rotocanvas.pythonpixels import (
+    PPRect,
+    PPTiledImage,
+    clip_rect_to_size,
+)
+
+DEFAULT_TILE_SIZE = 64
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_LEVEL = 1  # zlib level (fast, since it runs after each stroke)
+
+
+def brush_rect(brushImage, centerX, centerY):
+    """Get the rect that brushAt(centerX, centerY) may change."""
+    return PPRect(int(centerX) - int(brushImage.size[0] / 2),
+                  int(centerY) - int(brushImage.size[1] / 2),
+                  brushImage.size[0], brushImage.size[1])
+
+
+def union_rect(rects):
+    """Get the rect containing all rects (or None if there are none)."""
+    rects = [rect for rect in rects if rect is not None]
+    if not rects:
+        return None
+    left = min(rect.left for rect in rects)
+    top = min(rect.top for rect in rects)
+    right = max(rect.left + rect.width for rect in rects)
+    bottom = max(rect.top + rect.height for rect in rects)
+    return PPRect(left, top, right - left, bottom - top)
+
+
+class UndoJournal:
+    """A bounded history of strokes as before/after tile bytes.
+
+    Args:
+        image (Union[PPImage,PPTiledImage]): The canvas (such as
+            PixelWidget.viewImage). A PPTiledImage is journaled by its
+            own tiles (a tile that didn't exist is removed by undo).
+        tileSize (Optional[int]): The tile width and height for a
+            dense image (smaller tiles record less around each stroke).
+        maxBytes (Optional[int]): The (compressed) bytes to keep. The
+            oldest strokes are forgotten to stay within it, but the most
+            recent stroke is always kept.
+        level (Optional[int]): The zlib level, or 0 to not compress.
+    """
+    def __init__(self, image, tileSize=DEFAULT_TILE_SIZE,
+                 maxBytes=DEFAULT_MAX_BYTES, level=DEFAULT_LEVEL):
+        self.tileSize = tileSize
+        self.maxBytes = maxBytes
+        self.level = level
+        self.set_image(image)
+
+    def set_image(self, image):
+        """Journal another image (such as after a resize).
+
+        The history is cleared since it can't apply to another image.
+        """
+        self.image = image
+        if isinstance(image, PPTiledImage):
+            self.tileSize = image.tileSize
+        self.clear()
+
+    def clear(self):
+        self._undo = deque()  # entries (see end)
+        self._redo = []
+        self._before = None  # {tile: bytes} during a stroke
+        self.byte_count = 0
+
+    def can_undo(self):
+        return len(self._undo) > 0
+
+    def can_redo(self):
+        return len(self._redo) > 0
+
+    def begin(self):
+        """Start a stroke (ending any stroke in progress)."""
+        if self._before is not None:
+            self.end()
+        self._before = {}
+
+    def capture(self, rect):
+        """Record tiles in rect before they change (starts a stroke if
+        needed).
+
+        Args:
+            rect (PPRect): The region about to be drawn (clipped to the
+                image automatically).
+        """
+        if self._before is None:
+            self._before = {}
+        for key in self._tile_coords_in(rect):
+            if key not in self._before:
+                self._before[key] = self._read_tile(key)
+
+    def end(self):
+        """Finish the stroke.
+
+        Returns:
+            bool: True if the stroke changed anything (and can be undone).
+        """
+        before = self._before
+        self._before = None
+        if not before:
+            return False
+        entry = []
+        for key, old in before.items():
+            new = self._read_tile(key)
+            if new == old:
+                continue
+            entry.append((key, self._pack(old), self._pack(new)))
+        if not entry:
+            return False
+        self._undo.append(entry)
+        self.byte_count += self._entry_byte_count(entry)
+        for old_entry in self._redo:
+            self.byte_count -= self._entry_byte_count(old_entry)
+        self._redo = []
+        while (self.byte_count > self.maxBytes) and (len(self._undo) > 1):
+            self.byte_count -= self._entry_byte_count(self._undo.popleft())
+        return True
+
+    def undo(self):
+        """Undo the last stroke.
+
+        Returns:
+            PPRect: The region that changed (to redraw), or None if there
+                was nothing to undo.
+        """
+        if self._before is not None:
+            self.end()
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        return self._apply(entry, 1)
+
+    def redo(self):
+        """Redo the last undone stroke (see undo)."""
+        if self._before is not None:
+            self.end()  # (a new stroke clears redo)
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return self._apply(entry, 2)
+
+    def _apply(self, entry, which):
+        rects = []
+        for item in entry:
+            key = item[0]
+            self._write_tile(key, self._unpack(item[which]))
+            rects.append(self._tile_rect(key))
+        return union_rect(rects)
+
+    def _pack(self, data):
+        if (data is None) or (not self.level):
+            return data
+        return zlib.compress(data, self.level)
+
+    def _unpack(self, data):
+        if (data is None) or (not self.level):
+            return data
+        return zlib.decompress(data)
+
+    @staticmethod
+    def _entry_byte_count(entry):
+        return sum(len(data) for item in entry for data in item[1:]
+                   if data is not None)
+
+    def _tile_coords_in(self, rect):
+        if isinstance(self.image, PPTiledImage):
+            return self.image.get_tile_coords_in(rect)
+        rect = clip_rect_to_size(rect.left, rect.top, rect.width,
+                                 rect.height, self.image.size)
+        if rect is None:
+            return []
+        ts = self.tileSize
+        return [(tileX, tileY)
+                for tileY in range(rect.top // ts,
+                                   (rect.top + rect.height - 1) // ts + 1)
+                for tileX in range(rect.left // ts,
+                                   (rect.left + rect.width - 1) // ts + 1)]
+
+    def _tile_rect(self, key):
+        if isinstance(self.image, PPTiledImage):
+            return self.image.get_tile_rect(key[0], key[1])
+        ts = self.tileSize
+        left = key[0] * ts
+        top = key[1] * ts
+        return PPRect(left, top, min(ts, self.image.size[0] - left),
+                      min(ts, self.image.size[1] - top))
+
+    def _read_tile(self, key):
+        image = self.image
+        if isinstance(image, PPTiledImage):
+            tile = image.get_tile(key[0], key[1])
+            return None if tile is None else bytes(tile.data)
+        rect = self._tile_rect(key)
+        line_size = rect.width * image.byteDepth
+        start = rect.top * image.stride + rect.left * image.byteDepth
+        return b"".join(
+            bytes(image.data[start+y*image.stride:
+                             start+y*image.stride+line_size])
+            for y in range(rect.height)
+        )
+
+    def _write_tile(self, key, data):
+        image = self.image
+        if isinstance(image, PPTiledImage):
+            if data is None:
+                image.set_tile(key[0], key[1], None)
+            else:
+                image.get_tile(key[0], key[1], create=True).data[:] = data
+            return
+        rect = self._tile_rect(key)
+        line_size = rect.width * image.byteDepth
+        start = rect.top * image.stride + rect.left * image.byteDepth
+        for y in range(rect.height):
+            dstI = start + y * image.stride
+            image.data[dstI:dstI+line_size] = \
+                data[y*line_size:(y+1)*line_size]
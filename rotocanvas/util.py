@@ -29,7 +29,7 @@ def get_frame_name(prefix, i, minDigits, ext=None):
         ext (str): If not None, add a dot and extension to the name.
     """
     noExt = prefix + str(i).zfill(minDigits)
-    if (ext is None) and (len(ext) > 0):
+    if (ext is None) or (len(ext) == 0):
         return noExt
     else:
         return noExt + "." + ext
@@ -80,22 +80,169 @@ def get_frame_number(framePath, prefix=None, minDigits=None):
     return ret
 
 
+class SequenceIndex:
+    """An index of the numbered frames (images) in a directory.
+
+    The directory is scanned once, and refresh only parses names that
+    were added since the last scan (and only scans if the directory's
+    mtime changed), so looking up frames is O(1) without listing the
+    directory each time.
+
+    Args:
+        parent (str): The directory.
+        prefix (Optional[str]): Only index files with this prefix (the
+            name before the frame number). If None, index all numbered
+            files (if several have the same number, the first by name
+            is used).
+        extensions (Optional[list[str]]): Extensions without a dot
+            (case-insensitive). Defaults to imageExtensions.
+    """
+    def __init__(self, parent, prefix=None, extensions=None):
+        if extensions is None:
+            extensions = imageExtensions
+        self.parent = parent
+        self.prefix = prefix
+        self.dotExts = set("." + ext.lower() for ext in extensions)
+        self.mtime_ns = None
+        self._frame_by_name = {}  # file name -> frame number
+        self._numberS_by_name = {}  # file name -> frame number string
+        self._name_by_frame = {}  # frame number -> file name
+        self._frames = None  # sorted frame numbers (cached)
+        self.refresh()
+
+    def _parse(self, name):
+        prefix, numberS, dotExt = split_frame_name(name)
+        if (not numberS) or (dotExt.lower() not in self.dotExts):
+            return None
+        if (self.prefix is not None) and (prefix != self.prefix):
+            return None
+        return numberS
+
+    def refresh(self, force=False):
+        """Update the index if the directory changed.
+
+        Returns:
+            bool: True if the directory was scanned.
+        """
+        mtime_ns = os.stat(self.parent).st_mtime_ns
+        if (not force) and (mtime_ns == self.mtime_ns):
+            return False
+        self.mtime_ns = mtime_ns
+        names = set()
+        with os.scandir(self.parent) as entries:
+            for entry in entries:
+                if entry.name in self._frame_by_name:
+                    names.add(entry.name)
+                    continue
+                numberS = self._parse(entry.name)
+                if (numberS is None) or (not entry.is_file()):
+                    continue
+                names.add(entry.name)
+                self._frame_by_name[entry.name] = int(numberS)
+                self._numberS_by_name[entry.name] = numberS
+        for name in list(self._frame_by_name):
+            if name not in names:
+                del self._frame_by_name[name]
+                del self._numberS_by_name[name]
+        self._name_by_frame = {}
+        for name in sorted(self._frame_by_name, reverse=True):
+            # (reverse so the first name wins if numbers are the same)
+            self._name_by_frame[self._frame_by_name[name]] = name
+        self._frames = None
+        return True
+
+    def __len__(self):
+        return len(self._name_by_frame)
+
+    def __contains__(self, frame):
+        return frame in self._name_by_frame
+
+    @property
+    def frames(self):
+        """Get the frame numbers in order."""
+        if self._frames is None:
+            self._frames = sorted(self._name_by_frame)
+        return self._frames
+
+    @property
+    def first(self):
+        return self.frames[0] if self.frames else None
+
+    @property
+    def last(self):
+        return self.frames[-1] if self.frames else None
+
+    @property
+    def minDigits(self):
+        """Get the zero-padded digit count (see get_frame_name).
+
+        Returns:
+            int: The length of zero-padded numbers (such as 4 for
+                0001) if any, otherwise the shortest number's length
+                (so zfill won't change any number). 0 if no frames.
+        """
+        padded = [len(numberS) for numberS in self._numberS_by_name.values()
+                  if (len(numberS) > 1) and numberS.startswith("0")]
+        if padded:
+            return max(padded)
+        if not self._numberS_by_name:
+            return 0
+        return min(len(numberS)
+                   for numberS in self._numberS_by_name.values())
+
+    def gaps(self):
+        """Get missing frame numbers as (first, last) inclusive ranges."""
+        gaps = []
+        frames = self.frames
+        for i in range(1, len(frames)):
+            if frames[i] - frames[i-1] > 1:
+                gaps.append((frames[i-1] + 1, frames[i] - 1))
+        return gaps
+
+    def get_path(self, frame):
+        """Get the path of a frame number, or None if not present."""
+        name = self._name_by_frame.get(frame)
+        if name is None:
+            return None
+        return os.path.join(self.parent, name)
+
+    def get_frame(self, path):
+        """Get the frame number of a path (or name), or None."""
+        if os.path.dirname(path) not in ("", self.parent):
+            if (os.path.realpath(os.path.dirname(path))
+                    != os.path.realpath(self.parent)):
+                return None
+        return self._frame_by_name.get(os.path.basename(path))
+
+
+_sequence_indexes = {}
+
+
+def get_sequence_index(parent, prefix=None, extensions=None):
+    """Get a cached SequenceIndex (refreshed if the directory changed).
+    """
+    if extensions is None:
+        extensions = imageExtensions
+    key = (os.path.realpath(parent), prefix, tuple(extensions))
+    index = _sequence_indexes.get(key)
+    if index is None:
+        index = SequenceIndex(parent, prefix=prefix, extensions=extensions)
+        _sequence_indexes[key] = index
+    else:
+        index.refresh()
+    return index
+
+
 def divide_frames_in(parent, start, step):
     # i = start
     # minDigits = 0
     global imageExtensions
-    ext = None
-    firstFramePath = None
-    for sub in sorted(os.listdir(parent)):
-        subPath = os.path.join(parent, sub)
-        ext = getEndsWithI(sub, imageExtensions)
-        if ext is not None:
-            firstFramePath = subPath
-            break
-    if ext is None:
+    index = get_sequence_index(parent)
+    if not index.frames:
         print("There are no {} files in {}"
               "".format(imageExtensions, parent))
         return None
+    firstFramePath = index.get_path(index.first)
     # print("Detected {}".format(ext))
     # while True:
     #     numberS = str(i).zfill(padding)
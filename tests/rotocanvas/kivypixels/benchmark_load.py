@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Time how long KPImage takes to load each image format.
+
+Usage (from the repo directory):
+python3 -m tests.rotocanvas.kivypixels.benchmark_load [width height]
+
+Each format is timed using the Pillow path (decode_image_file) and the
+Kivy path (CoreImage then drawKivyImage), each followed by the single
+swizzle pass into a KPImage.
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+from timeit import default_timer as best_timer
+
+from PIL import Image
+
+from rotocanvas.kivypixels import (
+    CoreImage,
+    KPImage,
+    decode_image_file,
+)
+
+FORMATS = ["png", "jpg", "bmp", "tga", "webp"]
+
+
+def make_sample(path, size):
+    # A gradient compresses realistically (noise would be worst case).
+    im = Image.linear_gradient("L").resize(size).convert("RGB")
+    im.putalpha(Image.linear_gradient("L").rotate(90).resize(size))
+    if path.lower().endswith(".jpg"):
+        im = im.convert("RGB")
+    im.save(path)
+
+
+def time_call(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = best_timer()
+        fn()
+        took = best_timer() - start
+        if (best is None) or (took < best):
+            best = took
+    return best
+
+
+def main(args):
+    size = (2048, 1080)
+    if len(args) > 2:
+        size = (int(args[1]), int(args[2]))
+    tmp = tempfile.mkdtemp(prefix="rotocanvas-bench-")
+    print("size: {}".format(size))
+    print("{:<6} {:>12} {:>12}".format("format", "pillow (s)", "kivy (s)"))
+    try:
+        for ext in FORMATS:
+            path = os.path.join(tmp, "sample." + ext)
+            try:
+                make_sample(path, size)
+            except (KeyError, OSError) as ex:
+                print("{:<6} skipped ({})".format(ext, ex))
+                continue
+
+            def load_pillow():
+                decoded = decode_image_file(path)
+                image = KPImage(decoded[1])
+                image.blitDecoded(decoded)
+
+            def load_kivy():
+                im = CoreImage(path, keep_data=True)
+                image = KPImage((im.width, im.height))
+                image.drawKivyImage(im)
+
+            pillow_s = time_call(load_pillow)
+            try:
+                kivy_s = "{:>12.4f}".format(time_call(load_kivy))
+            except Exception as ex:
+                kivy_s = "{:>12}".format(type(ex).__name__)
+            print("{:<6} {:>12.4f} {}".format(ext, pillow_s, kivy_s))
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+import unittest
+
+from PIL import Image
+
+from rotocanvas.compositor import (
+    CompositeLayer,
+    Compositor,
+    pil_from_pp,
+)
+from rotocanvas.pythonpixels import (
+    PPImage,
+    PPRect,
+    PPTiledImage,
+)
+
+
+def paint(layer, left, top, width, height, bgra):
+    for y in range(top, top + height):
+        for x in range(left, left + width):
+            tile, local = layer._tile_at((x, y), True)
+            i = local[1] * tile.stride + local[0] * 4
+            tile.data[i:i+4] = bytes(bgra)
+
+
+class CompositorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frame = Image.new("RGB", (100, 60), (100, 100, 100))
+        self.layer = PPTiledImage((100, 60), tileSize=16)
+        paint(self.layer, 10, 10, 4, 4, (0, 0, 255, 255))  # opaque red
+
+    def test_pil_from_pp_uses_offsets(self):
+        image = PPImage((2, 1))
+        image.data[:] = bytes((1, 2, 3, 4, 5, 6, 7, 8))
+        self.assertEqual(pil_from_pp(image, PPRect(0, 0, 2, 1)).getpixel(
+            (0, 0)), (3, 2, 1, 4))
+        image.bOffset, image.gOffset, image.rOffset = 2, 0, 1  # KPImage
+        self.assertEqual(pil_from_pp(image, PPRect(1, 0, 1, 1)).getpixel(
+            (0, 0)), (6, 5, 7, 8))
+
+    def test_blend_and_opacity(self):
+        compositor = Compositor()
+        layers = [CompositeLayer(self.layer, opacity=.5)]
+        compositor.set_frame(("v", 0), self.frame, layers)
+        result = compositor.composite()
+        self.assertEqual(result.getpixel((11, 11)), (178, 50, 50))
+        self.assertEqual(result.getpixel((50, 50)), (100, 100, 100))
+        compositor.clear()
+        compositor.set_frame(("v", 0), self.frame,
+                             [CompositeLayer(self.layer, blend='multiply')])
+        self.assertEqual(compositor.composite().getpixel((11, 11)),
+                         (100, 0, 0))
+
+    def test_cached_and_dirty_regions(self):
+        compositor = Compositor()
+        compositor.set_frame(("v", 0), self.frame,
+                             [CompositeLayer(self.layer)])
+        first = compositor.composite()
+        self.assertEqual(compositor.redrawn_pixels, 100 * 60)
+        self.assertIs(compositor.composite(), first)  # cached
+        self.assertEqual(compositor.redrawn_pixels, 100 * 60)
+        compositor.set_frame(("v", 0), self.frame,
+                             lambda: self.fail("same frame"))
+        paint(self.layer, 50, 40, 2, 2, (255, 0, 0, 255))  # blue
+        compositor.invalidate(PPRect(50, 40, 2, 2))
+        result = compositor.composite()
+        self.assertEqual(compositor.redrawn_pixels, 100 * 60 + 4)
+        self.assertEqual(result.getpixel((50, 40)), (0, 0, 255))
+        self.assertEqual(result.getpixel((10, 10)), (255, 0, 0))
+
+    def test_replace_frame_keeps_layers(self):
+        compositor = Compositor()
+        compositor.set_frame(("v", 0), self.frame,
+                             [CompositeLayer(self.layer)])
+        compositor.composite()
+        layers = compositor.layers
+        full = Image.new("RGB", (100, 60), (0, 200, 0))
+        compositor.replace_frame(full)
+        self.assertIs(compositor.layers, layers)
+        result = compositor.composite()
+        self.assertEqual(result.getpixel((50, 50)), (0, 200, 0))
+        self.assertEqual(result.getpixel((11, 11)), (255, 0, 0))
+        with self.assertRaises(ValueError):
+            compositor.replace_frame(Image.new("RGB", (50, 30)))
+
+    def test_bad_blend(self):
+        with self.assertRaises(ValueError):
+            CompositeLayer(self.layer, blend='overlay-ish')
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
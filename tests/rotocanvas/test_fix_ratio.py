@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+import pickle
+import unittest
+
+from rotocanvas.fix_ratio import (
+    ratio_size,
+    ratio_stage,
+)
+
+
+class FixRatioTestCase(unittest.TestCase):
+    def test_ratio_size(self):
+        self.assertEqual(ratio_size(2880, 1920, 16, 9, 1), (3413, 1920))
+        self.assertEqual(ratio_size(2880, 1920, 4, 3, 0), (2880, 2160))
+        with self.assertRaises(ValueError):
+            ratio_size(2880, 1920, 4, 3, 2)
+
+    def test_ratio_stage_is_picklable(self):
+        stage = pickle.loads(pickle.dumps(ratio_stage(4, 3, "1")))
+        self.assertEqual(stage.keywords['preserveDim'], "1")
+        with self.assertRaises(ValueError):
+            ratio_stage(4, 3, 2)
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
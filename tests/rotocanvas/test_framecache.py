@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import unittest
+
+from rotocanvas.framecache import (
+    CachedFrame,
+    FrameCache,
+)
+
+FRAME_SIZE = (4, 2)
+FRAME_BYTES = FRAME_SIZE[0] * FRAME_SIZE[1] * 3
+
+
+def make_frame(index):
+    return CachedFrame(bytes([index % 256]) * FRAME_BYTES, FRAME_SIZE)
+
+
+class FakePlane(bytearray):
+    """A plane (like av.video.plane.VideoPlane) with padded lines."""
+    def __init__(self, data, line_size):
+        bytearray.__init__(self, data)
+        self.line_size = line_size
+
+
+class FakeAVFrame:
+    def __init__(self, lines, size, line_size):
+        self.width, self.height = size
+        self.planes = [FakePlane(b"".join(
+            line.ljust(line_size, b"\xff") for line in lines), line_size)]
+
+    def reformat(self, format):
+        return self
+
+
+class FrameCacheTestCase(unittest.TestCase):
+    def test_lru_within_budget(self):
+        cache = FrameCache(max_bytes=FRAME_BYTES * 3, window=0)
+        for index in range(3):
+            cache.put("a.mp4", index, make_frame(index))
+        self.assertIsNotNone(cache.get("a.mp4", 0))  # now most recent
+        cache.put("a.mp4", 3, make_frame(3))
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.byte_count, cache.max_bytes)
+        self.assertNotIn(("a.mp4", 1), cache)
+        self.assertIn(("a.mp4", 0), cache)
+        self.assertIsNone(cache.get("a.mp4", 1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_playhead_window_is_protected(self):
+        cache = FrameCache(max_bytes=FRAME_BYTES * 4, window=1)
+        cache.set_playhead("a.mp4", 1)
+        for index in range(8):
+            cache.put("a.mp4", index, make_frame(index))
+        for index in (0, 1, 2):
+            self.assertIn(("a.mp4", index), cache)
+        self.assertIn(("a.mp4", 7), cache)
+        self.assertEqual(len(cache), 4)
+        cache.put("b.mp4", 1, make_frame(1))  # other source: not protected
+        self.assertIn(("a.mp4", 1), cache)
+        self.assertNotIn(("a.mp4", 7), cache)
+
+    def test_get_or_decode(self):
+        cache = FrameCache()
+        decoded = []
+
+        def decode(index):
+            decoded.append(index)
+            return make_frame(index)
+
+        for index in (5, 6, 5, 6, 7):
+            frame = cache.get_or_decode("a.mp4", index, decode)
+            self.assertEqual(frame.data[0], index)
+        self.assertEqual(decoded, [5, 6, 7])
+        cache.clear("a.mp4")
+        self.assertEqual((len(cache), cache.byte_count), (0, 0))
+        with self.assertRaises(ValueError):
+            CachedFrame(b"\0", FRAME_SIZE)
+
+    def test_from_av_frame_removes_padding(self):
+        line_size = FRAME_SIZE[0] * 3
+        lines = [bytes([y]) * line_size for y in range(FRAME_SIZE[1])]
+        frame = CachedFrame.from_av_frame(
+            FakeAVFrame(lines, FRAME_SIZE, line_size + 4))
+        self.assertEqual(frame.data, b"".join(lines))
+        frame = CachedFrame.from_av_frame(
+            FakeAVFrame(lines, FRAME_SIZE, line_size))
+        self.assertEqual(frame.data, b"".join(lines))
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+
+from rotocanvas import moremimetypes
+from rotocanvas.moremimetypes import sniff_mimetype
+
+
+class SniffMimetypeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_sniff_is_cached_by_mtime(self):
+        from PIL import Image
+        path = os.path.join(self.tmp, "frame.jpg")  # content is PNG
+        Image.new("RGB", (4, 4)).save(path, format="PNG")
+        expected = "image/png" if moremimetypes.ENABLE_PUREMAGIC \
+            else "image/jpg"
+        self.assertEqual(sniff_mimetype(path), expected)
+        key = os.path.realpath(path)
+        self.assertEqual(moremimetypes._sniffed[key][2], expected)
+        with open(path, 'wb') as stream:
+            stream.write(b"not an image")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(sniff_mimetype(path), "image/jpg")  # extension
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
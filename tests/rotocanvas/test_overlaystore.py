@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+
+from rotocanvas.overlaystore import OverlayStore
+from rotocanvas.projectstore import ProjectStore
+from rotocanvas.pythonpixels import (
+    PPImage,
+    PPRect,
+    PPTiledImage,
+)
+
+
+class OverlayStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = ProjectStore(os.path.join(self.tmp, "t.rotocanvas"))
+        self.overlays = OverlayStore(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def make_layer(self, x=5):
+        layer = PPTiledImage((100, 70), tileSize=32)
+        layer.set_at_from_ivec((x, 5), (255, 0, 0, 255))
+        layer.set_at_from_ivec((90, 60), (0, 0, 255, 255))
+        layer.get_tile(1, 1, create=True)  # allocated but empty
+        return layer
+
+    def test_empty_tiles_are_skipped_and_shared(self):
+        self.assertEqual(self.overlays.save_layer(
+            "v.mp4", 1, "paint", self.make_layer()), 2)
+        self.assertEqual(self.overlays.save_layer(
+            "v.mp4", 2, "paint", self.make_layer()), 2)
+        self.assertEqual(self.overlays.save_layer(
+            "v.mp4", 3, "paint", self.make_layer(x=6)), 2)
+        stats = self.overlays.stats()
+        self.assertEqual(stats['tile_refs'], 6)
+        self.assertEqual(stats['tiles'], 3)  # only one tile differed
+        self.assertLess(stats['stored_bytes'], 3 * 32 * 32 * 4)
+
+    def test_load_layer(self):
+        saved = self.make_layer()
+        self.overlays.save_layer("v.mp4", 1, "paint", saved)
+        self.store.commit()
+        overlays = OverlayStore(self.store)  # (no decompressed tiles)
+        loaded = overlays.load_layer("v.mp4", 1, "paint")
+        self.assertEqual(sorted(loaded.tiles), [(0, 0), (2, 1)])
+        self.assertEqual(loaded.compose().data, saved.compose().data)
+        part = overlays.load_layer("v.mp4", 1, "paint",
+                                   rect=PPRect(0, 0, 10, 10))
+        self.assertEqual(sorted(part.tiles), [(0, 0)])
+        self.assertIsNone(overlays.load_layer("v.mp4", 2, "paint"))
+        self.assertEqual(overlays.layer_names("v.mp4", 1), ["paint"])
+
+    def test_dense_image(self):
+        dense = self.make_layer().compose()
+        self.assertIsInstance(dense, PPImage)
+        self.assertEqual(self.overlays.save_layer(
+            "v.mp4", 1, "paint", dense, tileSize=32), 2)
+        self.assertEqual(self.overlays.stats()['tiles'], 2)
+        loaded = self.overlays.load_layer("v.mp4", 1, "paint")
+        self.assertEqual(loaded.compose().data, dense.data)
+
+    def test_collect_garbage(self):
+        self.overlays.save_layer("v.mp4", 1, "paint", self.make_layer())
+        self.overlays.save_layer("v.mp4", 2, "paint", self.make_layer(x=6))
+        self.overlays.delete_layer("v.mp4", 2, "paint")
+        self.assertEqual(self.overlays.collect_garbage(), 1)
+        self.assertEqual(self.overlays.stats()['tiles'], 2)
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rotocanvas.projectstore import (
+    ProjectStore,
+    is_project_store,
+)
+from rotocanvas.pythonpixels import PPTiledImage
+from rotocanvas.rcproject import RCProject
+
+
+class ProjectStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "test.rotocanvas")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_frames_are_separate_records(self):
+        with ProjectStore(self.path) as store:
+            store.set_meta('width', 800)
+            store.put_frame("video.mp4", 3, {'layers': ["a"]})
+            store.put_frame("video.mp4", 1, {'layers': []})
+            store.commit()
+            store.put_frame("video.mp4", 2, {'layers': []})
+            # ^ not committed
+        self.assertTrue(is_project_store(self.path))
+        with ProjectStore(self.path) as store:
+            self.assertEqual(store.meta_items(), {'width': 800})
+            self.assertEqual(store.frame_numbers("video.mp4"), [1, 3])
+            self.assertEqual(store.get_frame("video.mp4", 3),
+                             {'layers': ["a"]})
+            self.assertIsNone(store.get_frame("video.mp4", 2))
+
+    def test_project_converts_legacy_json(self):
+        with open(self.path, 'w') as outs:
+            json.dump({'name': "Legacy"}, outs)
+        project = RCProject()
+        project.open(self.path)
+        self.assertEqual(project._meta, {'name': "Legacy"})
+        project.setFrameData("video.mp4", 5, {'strokes': 1})
+        self.assertIsNone(project.save())
+        self.assertTrue(os.path.isfile(self.path + ".json.bak"))
+        project.close()
+
+        project = RCProject()
+        project.open(self.path)
+        self.assertEqual(project._meta, {'name': "Legacy"})
+        self.assertEqual(project.getFrameNumbers("video.mp4"), [5])
+        project.setFrameData("video.mp4", 5, None)
+        project.setFrameData("video.mp4", 6, {'strokes': 2})
+        self.assertEqual(project.getFrameNumbers("video.mp4"), [6])
+        self.assertEqual(project.getFrameData("video.mp4", 6),
+                         {'strokes': 2})
+        project.save()
+        project.path = os.path.join(self.tmp, "copy.rotocanvas")
+        project.save()  # Save As copies the saved frames
+        project.close()
+        with ProjectStore(project.path) as store:
+            self.assertEqual(store.frame_numbers("video.mp4"), [6])
+
+    def test_project_overlays_are_saved(self):
+        project = RCProject()
+        project.path = self.path
+        layer = PPTiledImage((64, 64), tileSize=32)
+        layer.set_at_from_ivec((40, 3), (255, 255, 255, 255))
+        project.getOverlayStore().save_layer("video.mp4", 0, "paint", layer)
+        project.save()
+        project.close()
+        project.open(self.path)
+        loaded = project.getOverlayStore().load_layer("video.mp4", 0,
+                                                      "paint")
+        self.assertEqual(sorted(loaded.tiles), [(1, 0)])
+        project.close()
+
+    def test_save_as_with_unsaved_layer(self):
+        project = RCProject()
+        project.path = self.path
+        project.save()
+        layer = PPTiledImage((64, 64), tileSize=32)
+        layer.set_at_from_ivec((40, 3), (255, 255, 255, 255))
+        project.setLayer("video.mp4", 0, "paint", layer)
+        self.assertTrue(os.path.isfile(self.path))
+        self.assertEqual(project.getOverlayStore().layer_names(
+            "video.mp4", 0), [])  # not written until save
+        self.assertEqual(project.getLayerNames("video.mp4", 0), ["paint"])
+        self.assertIs(project.getLayer("video.mp4", 0, "paint"), layer)
+        # A layer saved directly (not committed) must not block Save As:
+        project.getOverlayStore().save_layer("video.mp4", 1, "paint", layer)
+        project.path = os.path.join(self.tmp, "copy.rotocanvas")
+        self.assertIsNone(project.save())
+        project.close()
+        project.open(os.path.join(self.tmp, "copy.rotocanvas"))
+        self.assertEqual(project.getLayerNames("video.mp4", 0), ["paint"])
+        self.assertEqual(project.getLayerNames("video.mp4", 1), ["paint"])
+        loaded = project.getLayer("video.mp4", 0, "paint")
+        self.assertEqual(sorted(loaded.tiles), [(1, 0)])
+        project.close()
+
+    def test_replaced_layer_tiles_are_removed(self):
+        project = RCProject()
+        project.path = self.path
+        layer = PPTiledImage((64, 64), tileSize=32)
+        for x in range(4):  # one stroke after another
+            layer.set_at_from_ivec((x, 3), (255, 255, 255, 255))
+            project.setLayer("video.mp4", 0, "paint", layer)
+            project.save()
+        stats = project.getOverlayStore().stats()
+        self.assertEqual((stats['tiles'], stats['tile_refs']), (1, 1))
+        project.setLayer("video.mp4", 0, "paint", None)
+        self.assertEqual(project.getLayerNames("video.mp4", 0), [])
+        project.save()
+        self.assertEqual(project.getOverlayStore().stats()['tiles'], 0)
+        project.close()
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
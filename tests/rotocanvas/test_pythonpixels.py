@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+import random
+import unittest
+
+from rotocanvas import pythonpixels
+from rotocanvas.pythonpixels import (
+    PPImage,
+    PPRect,
+    PPTiledImage,
+    brush_blend_with_bo,
+    tint_with_bo,
+)
+
+
+def make_noise_image(size, seed, byteDepth=4):
+    rng = random.Random(seed)
+    image = PPImage(size, byteDepth=byteDepth)
+    image.data[:] = bytes(rng.randrange(256) for _ in range(len(image.data)))
+    return image
+
+
+def blend_brush(dst, brush, destX, destY):
+    return brush_blend_with_bo(
+        dst.data, dst.stride, dst.byteDepth, dst.size,
+        brush.data, brush.stride, brush.byteDepth, brush.size,
+        destX, destY, dst.bOffset, dst.gOffset, dst.rOffset, dst.aOffset,
+    )
+
+
+class PythonPixelsTest(unittest.TestCase):
+    def test_brush_blend_matches_formula(self):
+        brush = make_noise_image((8, 6), 1)
+        # Make some of the brush fully transparent:
+        for i in range(brush.aOffset, len(brush.data), 32):
+            brush.data[i] = 0
+        python_dst = make_noise_image((20, 20), 2)
+        expected = bytearray(python_dst.data)
+        pythonpixels._brush_blend_python(
+            expected, python_dst.stride, python_dst.byteDepth,
+            brush.data, brush.stride, brush.byteDepth,
+            pythonpixels.PPRect(5, 7, 8, 6), 0, 0, 0, 1, 2, 3,
+        )
+        rect = blend_brush(python_dst, brush, 5, 7)
+        self.assertEqual((rect.left, rect.top, rect.width, rect.height),
+                         (5, 7, 8, 6))
+        for got, want in zip(python_dst.data, expected):
+            self.assertLessEqual(abs(got - want), 1)
+
+    def test_brush_blend_clips(self):
+        brush = make_noise_image((8, 8), 3)
+        for destX, destY in ((-4, -4), (16, 16), (-4, 16), (16, -4)):
+            dst = make_noise_image((20, 20), 4)
+            rect = blend_brush(dst, brush, destX, destY)
+            self.assertEqual((rect.width, rect.height), (4, 4))
+            self.assertEqual(len(dst.data), 20 * 20 * 4)
+        dst = make_noise_image((20, 20), 4)
+        before = bytes(dst.data)
+        self.assertIsNone(blend_brush(dst, brush, 20, 0))
+        self.assertIsNone(blend_brush(dst, brush, -8, -8))
+        self.assertEqual(bytes(dst.data), before)
+
+    def test_tint_matches_formula(self):
+        color = (0.2, 0.5, 1.0, 0.75)
+        image = make_noise_image((16, 4), 5)
+        expected = bytearray(image.data)
+        for i in range(0, len(expected), 4):
+            for channel in range(4):
+                expected[i + channel] = int(round(
+                    float(expected[i + channel]) * color[channel]))
+        python_data = bytearray(image.data)
+        enable_numpy = pythonpixels.ENABLE_NUMPY
+        try:
+            pythonpixels.ENABLE_NUMPY = False  # force the lookup tables
+            tint_with_bo(python_data, 4, color, 0, 1, 2, 3)
+        finally:
+            pythonpixels.ENABLE_NUMPY = enable_numpy
+        self.assertEqual(python_data, expected)
+        tint_with_bo(image.data, 4, color, 0, 1, 2, 3)
+        self.assertEqual(image.data, expected)
+
+    def test_blit_copy_with_bo_swizzle(self):
+        src = make_noise_image((7, 5), 6)
+        for enable_numpy in (pythonpixels.ENABLE_NUMPY, False):
+            dst = PPImage((7, 5))
+            dst.bOffset, dst.gOffset, dst.rOffset = 2, 0, 1
+            old_enable_numpy = pythonpixels.ENABLE_NUMPY
+            try:
+                pythonpixels.ENABLE_NUMPY = enable_numpy
+                dst.blit_copy_with_bo(src.data, src.stride, 4, src.size,
+                                      0, 1, 2, 3, flip_v=True)
+            finally:
+                pythonpixels.ENABLE_NUMPY = old_enable_numpy
+            for y in range(5):
+                for x in range(7):
+                    si = (4 - y) * src.stride + x * 4
+                    di = y * dst.stride + x * 4
+                    self.assertEqual(dst.data[di + 2], src.data[si])
+                    self.assertEqual(dst.data[di], src.data[si + 1])
+                    self.assertEqual(dst.data[di + 1], src.data[si + 2])
+                    self.assertEqual(dst.data[di + 3], src.data[si + 3])
+
+    def test_tiled_image_is_sparse(self):
+        image = PPTiledImage((16384, 16384), tileSize=256)
+        self.assertEqual(image.get_allocated_byte_count(), 0)
+        self.assertEqual(image.get_at((10000, 10000)), bytearray(4))
+        image.set_at_from_ivec((10000, 10001), (10, 20, 30, 40))
+        self.assertEqual(len(image.tiles), 1)
+        self.assertEqual(image.get_allocated_byte_count(), 256 * 256 * 4)
+        self.assertEqual(image.get_at((10000, 10001)),
+                         bytearray((10, 20, 30, 40)))
+        self.assertEqual(image.get_at((10001, 10000)), bytearray(4))
+        with self.assertRaises(IndexError):
+            image.get_at((16384, 0))
+
+    def test_tiled_brush_matches_dense(self):
+        size = (100, 70)  # not a multiple of tileSize (edge tiles)
+        brush = make_noise_image((21, 15), 7)
+        dense = PPImage(size)
+        tiled = PPTiledImage(size, tileSize=32)
+        tiled.setBrushImage(brush)
+        for centerX, centerY in ((32, 32), (0, 69), (99, 40), (60, 5)):
+            destX = centerX - int(brush.size[0] / 2)
+            destY = centerY - int(brush.size[1] / 2)
+            want = blend_brush(dense, brush, destX, destY)
+            got = tiled.brushAt(centerX, centerY)
+            self.assertEqual(
+                (got.left, got.top, got.width, got.height),
+                (want.left, want.top, want.width, want.height),
+            )
+        self.assertIsNone(tiled.brushAt(-100, -100))
+        self.assertLess(len(tiled.tiles), 4 * 3)
+        self.assertEqual(tiled.compose().data, dense.data)
+        part = tiled.compose(PPRect(20, 10, 50, 40))
+        for y in range(40):
+            start = (y + 10) * dense.stride + 20 * 4
+            self.assertEqual(part.data[y*part.stride:(y+1)*part.stride],
+                             dense.data[start:start+50*4])
+
+    def test_tiled_blit_and_drop_empty(self):
+        src = make_noise_image((10, 10), 8)
+        dense = PPImage((40, 40))
+        dense.blit(src, PPRect(12, 12, 10, 10))
+        tiled = PPTiledImage((40, 40), tileSize=16)
+        tiled.blit(src, PPRect(12, 12, 10, 10))
+        self.assertEqual(len(tiled.tiles), 4)
+        self.assertEqual(tiled.compose().data, dense.data)
+        tiled.get_tile(0, 0).data[:] = bytes(16 * 16 * 4)
+        tiled.drop_empty_tiles()
+        self.assertEqual(len(tiled.tiles), 3)
+        self.assertEqual(tiled.get_at((5, 5)), bytearray(4))
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
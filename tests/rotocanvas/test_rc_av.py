@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+try:
+    import av
+    import numpy as np
+    from rotocanvas import rc_av
+    from rotocanvas.framecache import FrameCache
+except ImportError:
+    av = None
+
+FRAME_COUNT = 30
+GOP_SIZE = 10
+
+
+def make_test_video(path, frame_count=FRAME_COUNT, size=(64, 48)):
+    """Write a small mpeg4 video with a keyframe every GOP_SIZE frames."""
+    with av.open(path, mode='w') as container:
+        stream = container.add_stream(
+            'mpeg4', rate=30,
+            options={'sc_threshold': '1000000000'},  # only GOP keyframes
+        )
+        stream.width, stream.height = size
+        stream.pix_fmt = 'yuv420p'
+        stream.bit_rate = 8000000  # nearly lossless so frames are distinct
+        stream.codec_context.gop_size = GOP_SIZE
+        for i in range(frame_count):
+            rgb = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+            rgb[:, :, :] = i * 8  # identify the frame by its gray level
+            frame = av.VideoFrame.from_ndarray(rgb, format='rgb24')
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@unittest.skipIf(av is None, "av and numpy are required")
+class RcAvTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.tmp_dir, "video.mp4")
+        make_test_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        index_path = rc_av.index_path_for(self.video_path)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+        for cache_path in (rc_av.proxy_path_for(self.video_path),
+                           self.video_path + "_rotocanvas"):
+            if os.path.isdir(cache_path):
+                shutil.rmtree(cache_path)
+
+    def analyze(self, **kwargs):
+        meta = rc_av.analyze_video(self.video_path, lambda status: None,
+                                   **kwargs)
+        meta.pop('container').close()
+        return meta
+
+    def test_index_round_trip(self):
+        meta = self.analyze()
+        self.assertEqual(len(meta['packet_pts']), FRAME_COUNT)
+        self.assertEqual(len(meta['iframe_pts']), FRAME_COUNT // GOP_SIZE)
+        self.assertTrue(os.path.isfile(
+            rc_av.index_path_for(self.video_path)))
+        cached = rc_av.load_index(self.video_path)
+        self.assertEqual(cached, meta)
+        self.assertEqual(self.analyze(), meta)
+
+    def test_index_is_invalidated(self):
+        meta = self.analyze()
+        fingerprint = rc_av.file_fingerprint(self.video_path)
+        size, mtime_ns, digest = fingerprint
+        self.assertIsNone(rc_av.load_index(
+            self.video_path, fingerprint=(size, mtime_ns + 1, digest)))
+        self.assertIsNone(rc_av.load_index(
+            self.video_path, fingerprint=(size, mtime_ns, bytes(32))))
+        index_path = rc_av.index_path_for(self.video_path)
+        with open(index_path, 'r+b') as stream:
+            stream.truncate(os.path.getsize(index_path) - 4)
+        self.assertIsNone(rc_av.load_index(self.video_path))
+        self.assertEqual(self.analyze(), meta)  # rebuilt
+
+    def test_no_cache(self):
+        self.analyze(use_cache=False)
+        self.assertFalse(os.path.isfile(
+            rc_av.index_path_for(self.video_path)))
+
+    def assertIsFrame(self, frame, index):
+        gray = frame.to_ndarray(format='gray').mean()
+        self.assertLess(abs(gray - index * 8), 4,
+                        "expected frame {}".format(index))
+
+    def test_frame_reader_random_access(self):
+        reader = rc_av.FrameReader(self.video_path)
+        try:
+            self.assertEqual(reader.frame_count, FRAME_COUNT)
+            for index in (17, 3, 29, 0, 20, 19):
+                self.assertIsFrame(reader.get_frame(index), index)
+            with self.assertRaises(IndexError):
+                reader.get_frame(FRAME_COUNT)
+        finally:
+            reader.close()
+
+    def test_frame_reader_sequential(self):
+        reader = rc_av.FrameReader(self.video_path)
+        try:
+            for index in range(FRAME_COUNT):
+                self.assertIsFrame(reader.get_frame(index), index)
+            self.assertEqual(reader.seek_count, 1)
+            seek_count = reader.seek_count
+            for index in range(FRAME_COUNT - 1, FRAME_COUNT - 6, -1):
+                self.assertIsFrame(reader.get_frame(index), index)
+            self.assertEqual(reader.seek_count, seek_count)  # history
+        finally:
+            reader.close()
+
+    def test_prefetcher_fills_cache(self):
+        cache = FrameCache()
+        prefetcher = rc_av.FramePrefetcher(self.video_path, cache,
+                                           ahead=4, behind=2)
+        try:
+            prefetcher.request(10)
+            wanted = {8, 9, 10, 11, 12, 13, 14}
+            done = set()
+            while not wanted.issubset(done):
+                done.add(prefetcher.ready.get(timeout=10))
+            for index in wanted:
+                frame = cache.get(self.video_path, index)
+                gray = np.frombuffer(frame.data, dtype=np.uint8).mean()
+                self.assertLess(abs(gray - index * 8), 4)
+            self.assertNotIn((self.video_path, 15), cache)
+        finally:
+            prefetcher.close()
+        self.assertFalse(prefetcher._thread.is_alive())
+
+    def test_proxy_matches_frame_numbers(self):
+        with self.assertRaises(FileNotFoundError):
+            rc_av.ProxyReader(self.video_path)
+        self.assertIsNone(rc_av.make_proxy(self.video_path,
+                                           is_cancelled=lambda: True))
+        with self.assertRaises(FileNotFoundError):
+            rc_av.ProxyReader(self.video_path)  # incomplete proxy
+        rc_av.make_proxy(self.video_path, max_height=24)
+        reader = rc_av.ProxyReader(self.video_path)
+        self.assertEqual(reader.frame_count, FRAME_COUNT)
+        self.assertEqual(reader.manifest['source_size'], [64, 48])
+        for index in (0, 13, FRAME_COUNT - 1):
+            frame = reader.get_cached_frame(index)
+            self.assertEqual(frame.size, (32, 24))
+            gray = np.frombuffer(frame.data, dtype=np.uint8).mean()
+            self.assertLess(abs(gray - index * 8), 4)
+        fingerprint = list(rc_av.file_fingerprint(self.video_path))
+        fingerprint[1] += 1  # as if modified
+        self.assertIsNone(rc_av.load_proxy_manifest(
+            self.video_path, fingerprint=tuple(fingerprint)))
+
+    def test_cache_keyframes_resumes(self):
+        ratios = []
+        cache_path = rc_av.cache_keyframes(self.video_path,
+                                           callback=ratios.append, workers=2)
+        names = sorted(os.listdir(cache_path))
+        meta = self.analyze()
+        self.assertEqual(names, sorted("{:04d}.jpg".format(pts)
+                                       for pts in meta['iframe_pts']))
+        self.assertEqual(ratios[-1], {'ratio': 1.0})
+        os.remove(os.path.join(cache_path, names[1]))
+        mtime = os.path.getmtime(os.path.join(cache_path, names[0]))
+        rc_av.cache_keyframes(self.video_path, meta=meta)
+        self.assertEqual(sorted(os.listdir(cache_path)), names)
+        self.assertEqual(
+            os.path.getmtime(os.path.join(cache_path, names[0])), mtime)
+
+    def test_analyze_and_cache_video(self):
+        meta, cache_path = rc_av.analyze_and_cache_video(
+            self.video_path, lambda status: None)
+        meta.pop('container').close()
+        self.assertEqual(meta, self.analyze())
+        names = sorted(os.listdir(cache_path))
+        self.assertEqual(names, sorted("{:04d}.jpg".format(pts)
+                                       for pts in meta['iframe_pts']))
+        os.remove(os.path.join(cache_path, names[0]))
+        meta, cache_path = rc_av.analyze_and_cache_video(
+            self.video_path, lambda status: None)  # uses the index
+        meta.pop('container').close()
+        self.assertEqual(sorted(os.listdir(cache_path)), names)
+
+    def test_iter_analyze_video(self):
+        statuses = list(rc_av.iter_analyze_video(self.video_path,
+                                                 interval=0))
+        self.assertGreater(len(statuses), 2)
+        final = statuses[-1]
+        self.assertTrue(final['done'])
+        self.assertEqual(final['packets'], FRAME_COUNT)
+        self.assertEqual(final['indexed_frames'], FRAME_COUNT)
+        self.assertGreater(final['bytes_per_sec'], 0)
+        final['meta'].pop('container').close()
+        counts = [status['indexed_frames'] for status in statuses]
+        self.assertEqual(counts, sorted(counts))  # grows incrementally
+
+    def test_iter_analyze_video_cancel(self):
+        statuses = rc_av.iter_analyze_video(self.video_path, interval=0)
+        status = next(statuses)
+        container = status['meta']['container']
+        statuses.close()
+        self.assertFalse(os.path.isfile(
+            rc_av.index_path_for(self.video_path)))
+        with self.assertRaises(IndexError):
+            container.streams.video[0]  # closed
+
+    def test_analyze_job(self):
+        job = rc_av.AnalyzeJob(self.video_path, interval=0)
+        self.assertTrue(job.done.wait(10))
+        self.assertIsNone(job.error)
+        job.result.pop('container').close()
+        self.assertEqual(job.result, self.analyze())
+        snapshot = job.snapshot()
+        self.assertNotIn('container', snapshot)
+        self.assertEqual(len(snapshot['packet_pts']), FRAME_COUNT)
+
+    def test_analyze_job_cancel_closes_container(self):
+        self.analyze()  # save the index, so the only status is done
+        start = threading.Event()
+
+        class WaitingJob(rc_av.AnalyzeJob):
+            def _run(self):
+                start.wait(10)
+                rc_av.AnalyzeJob._run(self)
+
+        opened = []
+
+        def open_video(*args, **kwargs):
+            opened.append(av_open(*args, **kwargs))
+            return opened[-1]
+
+        av_open = av.open
+        with mock.patch.object(rc_av.av, 'open', open_video):
+            job = WaitingJob(self.video_path, interval=0)
+            job.cancel(wait=False)
+            start.set()
+            self.assertTrue(job.done.wait(10))
+        self.assertIsNone(job.result)
+        self.assertEqual(len(opened), 1)
+        with self.assertRaises(IndexError):
+            opened[0].streams.video[0]  # closed
+
+    def test_partial_index(self):
+        def gray_of(frame):
+            return frame.to_ndarray(format='gray')[10, 10]
+
+        statuses = rc_av.iter_analyze_video(self.video_path,
+                                            use_cache=False, interval=0)
+        reader = None
+        for status in statuses:
+            prefix = rc_av.indexed_prefix(status['meta'])
+            self.assertLessEqual(len(prefix['packet_pts']),
+                                 status['indexed_frames'])
+            if len(prefix['packet_pts']) >= GOP_SIZE:
+                break
+        self.assertEqual(len(prefix['packet_pts']), GOP_SIZE)
+        self.assertNotIn('container', prefix)
+        reader = rc_av.FrameReader(self.video_path, meta=prefix)
+        try:
+            self.assertEqual(reader.frame_count, GOP_SIZE)
+            index = GOP_SIZE - 1
+            self.assertLess(abs(gray_of(reader.get_frame(index)) - index * 8),
+                            5)
+            with self.assertRaises(IndexError):
+                reader.get_frame(GOP_SIZE)
+            for status in statuses:
+                pass
+            reader.set_index(status['meta'])
+            self.assertEqual(reader.frame_count, FRAME_COUNT)
+            index = FRAME_COUNT - 1
+            self.assertLess(abs(gray_of(reader.get_frame(index)) - index * 8),
+                            5)
+        finally:
+            reader.close()
+            status['meta'].pop('container').close()
+
+    def test_open_video_job(self):
+        cache = FrameCache()
+        job = rc_av.OpenVideoJob(self.video_path, cache=cache, interval=0)
+        self.assertTrue(job.keyframes_done.wait(10))
+        self.assertIsNone(job.error)
+        self.assertIsNone(job.keyframe_error)
+        first = job.updates.get_nowait()
+        self.assertFalse(first['done'])
+        self.assertEqual(first['first_frame'].size, (64, 48))
+        self.assertIn((self.video_path, 0), cache)
+        self.assertNotIn('container', job.result)
+        self.assertEqual(job.result, self.analyze())
+        self.assertEqual(
+            sorted(os.listdir(job.cache_path)),
+            sorted("{:04d}.jpg".format(pts)
+                   for pts in job.result['iframe_pts']))
+
+    def test_open_video_job_with_index(self):
+        meta = self.analyze()  # save the index
+        job = rc_av.OpenVideoJob(self.video_path, interval=0)
+        self.assertTrue(job.keyframes_done.wait(30))
+        self.assertIsNone(job.worker)  # cached by cache_keyframes instead
+        self.assertIsNone(job.keyframe_error)
+        self.assertEqual(job.result, meta)
+        self.assertEqual(
+            sorted(os.listdir(job.cache_path)),
+            sorted("{:04d}.jpg".format(pts) for pts in meta['iframe_pts']))
+
+    def test_extract_frames(self):
+        from PIL import Image
+        frames = [(25, os.path.join(self.tmp_dir, "b.png")),
+                  (3, os.path.join(self.tmp_dir, "a.jpg")),
+                  (26, os.path.join(self.tmp_dir, "c.png"))]
+        decoded = rc_av.extract_frames(self.video_path, frames)
+        # 0-3, then 20-26 after seeking (not all 27 frames):
+        self.assertLess(decoded, 27)
+        for index, path in frames:
+            with Image.open(path) as image:
+                gray = image.convert("L").getpixel((10, 10))
+            self.assertLess(abs(gray - index * 8), 5)
+            os.remove(path)
+
+    def test_super_resolution_extracts_frames(self):
+        from PIL import Image
+        from rotocanvas import rcsource
+        source = rcsource.RCSource(self.video_path, "30/1")
+        self.assertEqual(source.vidPath, self.video_path)
+        out_dir = os.path.join(self.tmp_dir, "video_jpg")
+        self.addCleanup(shutil.rmtree, out_dir, True)
+        jobs = []
+        # Only the extraction is tested, so don't load OpenCV models:
+        with mock.patch.object(rcsource.settings, '_enable_opencv', True), \
+                mock.patch.object(rcsource.settings, '_scalingModels',
+                                  [["EDSR_x2.pb", 2]]), \
+                mock.patch('rcupscale.upscale_files',
+                           lambda job_list, **kwargs: jobs.extend(job_list)):
+            source.superResolutionAI(
+                onlyFrames=["00:00:00.1", "00:00:00.8"], minDigits=4)
+        self.assertEqual(len(jobs), 2)
+        for (model, original_path, out_path), index in zip(jobs, (3, 24)):
+            self.assertEqual(original_path, os.path.join(
+                out_dir, "originals", "{:04d}.jpg".format(index)))
+            with Image.open(original_path) as image:
+                gray = image.convert("L").getpixel((10, 10))
+            self.assertLess(abs(gray - index * 8), 5)
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from rotocanvas.rcsettings import RCSettings
+
+
+class RCSettingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.modelsDir = os.path.join(self.tmp, "models")
+        os.makedirs(self.modelsDir)
+        self.configPath = os.path.join(self.tmp, "config",
+                                       "rcsettings.json")
+        self.edsr = os.path.join(self.modelsDir, "EDSR_x4.pb")
+        with open(self.edsr, 'wb'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_discovery_is_lazy(self):
+        had_cv2 = 'cv2' in sys.modules
+        settings = RCSettings(configPath=self.configPath,
+                              tryDirs=[self.modelsDir])
+        self.assertIsNone(settings._scalingModels)
+        self.assertIsNone(settings._enable_opencv)
+        self.assertEqual('cv2' in sys.modules, had_cv2)
+        self.assertFalse(os.path.isfile(self.configPath))
+
+    def test_models_are_saved(self):
+        settings = RCSettings(configPath=self.configPath,
+                              tryDirs=[self.modelsDir])
+        self.assertEqual(settings.scalingModels, [[self.edsr, 4]])
+        self.assertTrue(os.path.isfile(self.configPath))
+        # The saved models are used without scanning tryDirs:
+        settings = RCSettings(configPath=self.configPath, tryDirs=[])
+        self.assertEqual(settings.scalingModels, [[self.edsr, 4]])
+        # but not if a model is gone:
+        os.remove(self.edsr)
+        lapsrn = os.path.join(self.modelsDir, "LapSRN_x8.pb")
+        with open(lapsrn, 'wb'):
+            pass
+        settings = RCSettings(configPath=self.configPath,
+                              tryDirs=[self.modelsDir])
+        self.assertEqual(settings.scalingModels, [[lapsrn, 8]])
+
+    def test_add_model(self):
+        settings = RCSettings(configPath=False, tryDirs=[self.modelsDir])
+        fsrcnn = os.path.join(self.tmp, "FSRCNN_x3.pb")
+        with open(fsrcnn, 'wb'):
+            pass
+        settings.addModel(fsrcnn)
+        self.assertEqual(settings.scalingModels[-1], [fsrcnn, 3])
+        with self.assertRaises(ValueError):
+            settings.addModel(self.configPath)
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
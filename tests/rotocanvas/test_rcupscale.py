@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from rotocanvas import rcupscale
+from rotocanvas.rcupscale import (
+    JobManifest,
+    model_name_and_scale,
+    tile_boxes,
+    upscale_files,
+    upsample_tiled,
+)
+
+if rcupscale.ENABLE_NUMPY:
+    import numpy as np
+
+
+def upsample_nearest(image, scale=3):
+    return image.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+class FakeSuperRes:
+    """A stand-in for a DnnSuperResImpl that counts models loaded."""
+    loads = []  # model paths
+
+    def readModel(self, path):
+        FakeSuperRes.loads.append(path)
+
+    def setModel(self, name, scale):
+        self.scale = scale
+
+    def upsample(self, image):
+        return upsample_nearest(image, scale=self.scale)
+
+
+class RCUpscaleTestCase(unittest.TestCase):
+    def test_model_name_and_scale(self):
+        self.assertEqual(
+            model_name_and_scale(os.path.join("models", "EDSR_x4.pb")),
+            ("edsr", 4),
+        )
+        self.assertEqual(model_name_and_scale("LapSRN_x8.pb"), ("lapsrn", 8))
+
+    def test_no_jobs(self):
+        self.assertEqual(upscale_files([]), [])
+
+    @unittest.skipIf(rcupscale.opencv_enabled, "OpenCV is installed")
+    def test_requires_opencv(self):
+        with self.assertRaises(RuntimeError):
+            rcupscale.get_model("EDSR_x4.pb")
+
+    def test_tile_boxes_cover_once(self):
+        covered = {}
+        for core, padded in tile_boxes(50, 23, 16, overlap=4):
+            self.assertLessEqual(padded[0], core[0])
+            self.assertGreaterEqual(padded[2], core[2])
+            for y in range(core[1], core[3]):
+                for x in range(core[0], core[2]):
+                    covered[(x, y)] = covered.get((x, y), 0) + 1
+        self.assertEqual(len(covered), 50 * 23)
+        self.assertEqual(set(covered.values()), {1})
+
+    @unittest.skipIf(not rcupscale.ENABLE_NUMPY, "numpy is required")
+    def test_upsample_tiled_matches_whole(self):
+        rng = np.random.default_rng(1)
+        image = rng.integers(0, 256, size=(37, 53, 3), dtype=np.uint8)
+        whole = upsample_nearest(image)
+        for workers in (1, 3):
+            tiled = upsample_tiled(upsample_nearest, image, 3, 16,
+                                   overlap=5, workers=workers)
+            self.assertEqual(tiled.dtype, np.uint8)
+            self.assertTrue(np.array_equal(tiled, whole))
+        gray = image[:, :, 0]
+        self.assertTrue(np.array_equal(
+            upsample_tiled(upsample_nearest, gray, 3, 20),
+            upsample_nearest(gray)))
+
+    @unittest.skipIf(not rcupscale.ENABLE_NUMPY, "numpy is required")
+    def test_tile_workers_load_model_once(self):
+        fake_cv2 = mock.Mock()
+        fake_cv2.dnn_superres.DnnSuperResImpl_create = FakeSuperRes
+        fake_cv2.imread.return_value = np.zeros((40, 40, 3), dtype=np.uint8)
+        FakeSuperRes.loads = []
+        model_path = "TileWorkers_x2.pb"  # not cached by other tests
+        with mock.patch.object(rcupscale, 'cv2', fake_cv2), \
+                mock.patch.object(rcupscale, 'opencv_enabled', True):
+            for _ in range(5):
+                rcupscale.upscale_file(model_path, "in.png", "out.png",
+                                       tile_size=8, overlap=2,
+                                       tile_workers=3)
+        self.assertEqual(fake_cv2.imwrite.call_count, 5)
+        # once per thread of the pool, not once per thread per frame:
+        self.assertLessEqual(len(FakeSuperRes.loads), 3)
+
+    def test_manifest_resumes(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            manifest_path = os.path.join(tmp_dir, "jobs.jsonl")
+            jobs = [("EDSR_x4.pb", os.path.join(tmp_dir, "{}.png".format(i)),
+                     os.path.join(tmp_dir, "out{}.png".format(i)))
+                    for i in range(3)]
+            with open(jobs[0][2], 'wb'):
+                pass
+            manifest = JobManifest(manifest_path)
+            manifest.record(jobs[0], JobManifest.DONE, duration=1.0, frame=0)
+            manifest.close()
+            with open(manifest_path, 'a') as stream:
+                stream.write('{"output": "partial')  # as if it crashed
+            manifest = JobManifest(manifest_path)
+            self.assertTrue(manifest.is_done(jobs[0][2]))
+            self.assertFalse(manifest.is_done(jobs[1][2]))
+            stop_event = threading.Event()
+            # The inputs don't exist, so the jobs that run fail:
+            results = upscale_files(jobs, workers=1, manifest=manifest,
+                                    frames=[0, 1, 2], stop_event=stop_event)
+            manifest.close()
+            self.assertEqual(results, [jobs[0][2], None, None])
+            manifest = JobManifest(manifest_path)
+            self.assertEqual(manifest.records[jobs[2][2]]['status'],
+                             JobManifest.FAILED)
+            self.assertEqual(manifest.records[jobs[2][2]]['frame'], 2)
+            stop_event.set()
+            upscale_files(jobs, workers=1, manifest=manifest,
+                          stop_event=stop_event)
+            manifest.close()
+            with open(manifest_path, 'r') as stream:
+                self.assertEqual(len(stream.readlines()), 4)  # none ran
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
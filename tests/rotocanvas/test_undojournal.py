@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import unittest
+
+from rotocanvas.pythonpixels import (
+    PPImage,
+    PPRect,
+    PPTiledImage,
+    brush_blend_with_bo,
+)
+from rotocanvas.undojournal import (
+    UndoJournal,
+    brush_rect,
+)
+
+
+def make_brush():
+    brush = PPImage((5, 5))
+    for i in range(0, len(brush.data), 4):
+        brush.data[i:i+4] = b"\xff\xff\xff\xff"
+    return brush
+
+
+def brush_at(image, x, y):
+    """Draw image.brushImage like KPImage.brushAt (without kivy)."""
+    if isinstance(image, PPTiledImage):
+        return image.brushAt(x, y)
+    brush = image.brushImage
+    rect = brush_rect(brush, x, y)
+    return brush_blend_with_bo(
+        image.data, image.stride, image.byteDepth, image.size,
+        brush.data, brush.stride, brush.byteDepth, brush.size,
+        rect.left, rect.top,
+        image.bOffset, image.gOffset, image.rOffset, image.aOffset,
+    )
+
+
+class UndoJournalTestCase(unittest.TestCase):
+    def stroke(self, journal, image, points):
+        journal.begin()
+        for x, y in points:
+            journal.capture(brush_rect(image.brushImage, x, y))
+            brush_at(image, x, y)
+        return journal.end()
+
+    def test_dense_undo_redo(self):
+        image = PPImage((200, 100))
+        image.brushImage = make_brush()
+        journal = UndoJournal(image, tileSize=16)
+        blank = bytes(image.data)
+        self.assertTrue(self.stroke(journal, image, [(10, 10), (12, 11)]))
+        first = bytes(image.data)
+        self.assertTrue(self.stroke(journal, image, [(150, 80)]))
+        # Only the few tiles under the brush were recorded:
+        self.assertLess(journal.byte_count, len(image.data) // 10)
+        rect = journal.undo()
+        self.assertEqual((rect.left, rect.top), (144, 64))
+        self.assertEqual(bytes(image.data), first)
+        journal.undo()
+        self.assertEqual(bytes(image.data), blank)
+        self.assertIsNone(journal.undo())
+        journal.redo()
+        self.assertEqual(bytes(image.data), first)
+        self.stroke(journal, image, [(50, 50)])
+        self.assertFalse(journal.can_redo())  # a new stroke clears redo
+
+    def test_unchanged_stroke_is_not_recorded(self):
+        image = PPImage((32, 32))
+        journal = UndoJournal(image, tileSize=16)
+        journal.capture(PPRect(0, 0, 32, 32))
+        self.assertFalse(journal.end())
+        self.assertFalse(journal.can_undo())
+
+    def test_max_bytes(self):
+        image = PPImage((64, 64))
+        image.brushImage = make_brush()
+        journal = UndoJournal(image, tileSize=16, level=0,
+                              maxBytes=3 * 2 * 16 * 16 * 4)
+        for i in range(5):
+            self.stroke(journal, image, [(8 + i * 10, 8)])
+        self.assertLessEqual(journal.byte_count, journal.maxBytes)
+        undone = 0
+        while journal.undo() is not None:
+            undone += 1
+        self.assertLess(undone, 5)
+        self.assertGreater(undone, 0)
+
+    def test_tiled_image(self):
+        image = PPTiledImage((100, 100), tileSize=32)
+        image.setBrushImage(make_brush())
+        journal = UndoJournal(image)
+        self.stroke(journal, image, [(40, 40)])
+        self.assertEqual(list(image.tiles), [(1, 1)])
+        journal.undo()
+        self.assertEqual(image.tiles, {})  # the tile didn't exist before
+        journal.redo()
+        self.assertFalse(image.is_tile_empty(1, 1))
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+
+from rotocanvas.util import (
+    SequenceIndex,
+    get_frame_name,
+    get_sequence_index,
+)
+
+
+class SequenceIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for i in (1, 2, 3, 7, 8, 12):
+            self.touch("shot0_{}.png".format(str(i).zfill(4)))
+        self.touch("other_0005.png")
+        self.touch("shot0_0004.txt")
+        self.touch("notes.png")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def touch(self, name):
+        with open(os.path.join(self.tmp, name), 'wb'):
+            pass
+
+    def test_frames_and_gaps(self):
+        index = SequenceIndex(self.tmp, prefix="shot0_")
+        self.assertEqual(index.frames, [1, 2, 3, 7, 8, 12])
+        self.assertEqual((index.first, index.last), (1, 12))
+        self.assertEqual(index.gaps(), [(4, 6), (9, 11)])
+        self.assertEqual(index.minDigits, 4)
+        path = os.path.join(self.tmp, "shot0_0007.png")
+        self.assertEqual(index.get_path(7), path)
+        self.assertEqual(index.get_frame(path), 7)
+        self.assertIsNone(index.get_path(5))
+        self.assertNotIn(5, index)
+
+    def test_refresh(self):
+        index = get_sequence_index(self.tmp, prefix="shot0_")
+        self.assertFalse(index.refresh())
+        self.touch("shot0_0005.png")
+        os.remove(os.path.join(self.tmp, "shot0_0012.png"))
+        index.refresh(force=True)
+        self.assertEqual(index.frames, [1, 2, 3, 5, 7, 8])
+        self.assertIs(get_sequence_index(self.tmp, prefix="shot0_"), index)
+
+    def test_get_frame_name(self):
+        self.assertEqual(get_frame_name("shot0_", 7, 4, "png"),
+                         "shot0_0007.png")
+        self.assertEqual(get_frame_name("shot0_", 7, 4, None), "shot0_0007")
+
+
+if __name__ == "__main__":
+    print("Error: You must run this from the repo directory via:")
+    print("python3 -m pytest")